@@ -0,0 +1,507 @@
+#!/usr/bin/env python3
+"""
+Summary statistics over data that doesn't fit in memory.
+
+Sums, means, variances, quantiles, rates of checkboxes and histograms with
+fixed bin edges are kept as small partial states that are updated one
+DataFrame at a time, e.g. from utils.iter_dataframes(), and merged with each
+other, so chunks can also be summed up in different processes. On data small
+enough to be one chunk the results match pandas, up to floating point
+rounding. The plotting functions can draw from these instead of the data.
+
+Example:
+    python aggregate.py --chunk_size 100000 --workers 4
+"""
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import os
+import numpy as np
+import pandas as pd
+
+# Values each level of a QuantileSketch holds before it is compacted.
+SKETCH_SIZE = 4096
+
+QUANTILES = (0.25, 0.5, 0.75)
+
+
+class QuantileSketch:
+    """
+    Mergeable quantiles of a stream of numbers. The numbers are all kept, and
+    the quantiles are exact, until there are more than size of them. After
+    that the numbers are compacted in levels: every other number of a full
+    level is moved up a level, where it counts twice (KLL).
+
+    Attributes:
+        size (int): Numbers a level holds before it is compacted.
+        levels (list(numpy.ndarray)): The numbers of each level. A number at
+            level i counts 2**i times.
+    """
+
+    def __init__(self, size=SKETCH_SIZE):
+        self.size = size
+        self.levels = [np.empty(0)]
+        self._offsets = [0]
+
+    def __len__(self):
+        return sum(len(items) << level
+                   for level, items in enumerate(self.levels))
+
+    @property
+    def exact(self):
+        return len(self.levels) == 1
+
+    def add(self, values):
+        """
+        Args:
+            values (numpy.ndarray): The numbers to add, without NaN.
+        """
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compact()
+
+    def merge(self, other):
+        """
+        Adds every number another sketch has seen.
+
+        Args:
+            other (QuantileSketch): The sketch to merge in.
+        """
+        for level, items in enumerate(other.levels):
+            if level == len(self.levels):
+                self.levels.append(np.empty(0))
+                self._offsets.append(0)
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self._compact()
+
+    def _compact(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self.size:
+                items = np.sort(items)
+                # An odd number out stays, so no weight is lost.
+                odd = len(items) % 2
+                self.levels[level] = items[len(items) - odd:]
+
+                # Alternate which half moves up, so neither end is favoured.
+                offset = self._offsets[level]
+                self._offsets[level] ^= 1
+                promoted = items[offset:len(items) - odd:2]
+
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                    self._offsets.append(0)
+                self.levels[level + 1] = np.concatenate(
+                    [self.levels[level + 1], promoted])
+            level += 1
+
+    def quantile(self, q):
+        """
+        Args:
+            q (float or list(float)): The quantiles, between 0 and 1.
+
+        Returns:
+            float or numpy.ndarray: The numbers at those quantiles, found
+                like pandas does (linear interpolation). NaN without numbers.
+        """
+        if self.exact:
+            if len(self.levels[0]) == 0:
+                return np.full(np.shape(q), np.nan)[()]
+            return np.quantile(self.levels[0], q)
+
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), float(1 << level))
+                                  for level, items in enumerate(self.levels)])
+        order = np.argsort(values, kind='stable')
+        values = values[order]
+        weights = weights[order]
+
+        # Each number stands in for weight numbers in a row, put it in the
+        # middle of them. With all weights 1 this is the same as exact.
+        positions = np.cumsum(weights) - (weights + 1) / 2
+        total = weights.sum()
+        return np.interp(np.asarray(q) * (total - 1), positions, values)[()]
+
+
+class ColumnStats:
+    """
+    Mergeable stats of one column.
+
+    Attributes:
+        count (int): Values that aren't missing.
+        total (float): Their sum.
+        m2 (float): Sum of squared differences from the mean.
+        minimum (float): The smallest value.
+        maximum (float): The largest value.
+        sketch (QuantileSketch): For the quantiles.
+    """
+
+    def __init__(self, sketch_size=SKETCH_SIZE):
+        self.count = 0
+        self.total = 0.0
+        self.m2 = 0.0
+        self.minimum = np.nan
+        self.maximum = np.nan
+        self.sketch = QuantileSketch(sketch_size)
+
+    @property
+    def mean(self):
+        if self.count == 0:
+            return np.nan
+        return self.total / self.count
+
+    def variance(self):
+        """
+        Returns:
+            float: The sample variance. NaN with fewer than two values.
+        """
+        if self.count < 2:
+            return np.nan
+        return self.m2 / (self.count - 1)
+
+    def add(self, values):
+        """
+        Args:
+            values (numpy.ndarray): The values of a chunk, without NaN.
+        """
+        if len(values) == 0:
+            return
+
+        chunk = ColumnStats(self.sketch.size)
+        chunk.count = len(values)
+        chunk.total = values.sum()
+        # Two passes over the chunk, like pandas.
+        chunk.m2 = np.square(values - chunk.total / chunk.count).sum()
+        chunk.minimum = values.min()
+        chunk.maximum = values.max()
+        chunk.sketch.add(values)
+        self.merge(chunk)
+
+    def merge(self, other):
+        """
+        Adds everything another ColumnStats has seen (Chan et al.).
+
+        Args:
+            other (ColumnStats): The stats to merge in.
+        """
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.m2 = other.m2
+        else:
+            count = self.count + other.count
+            delta = other.mean - self.mean
+            self.m2 += (other.m2 +
+                        delta * delta * self.count * other.count / count)
+
+        self.count += other.count
+        self.total += other.total
+        self.minimum = np.fmin(self.minimum, other.minimum)
+        self.maximum = np.fmax(self.maximum, other.maximum)
+        self.sketch.merge(other.sketch)
+
+
+class Histogram:
+    """
+    Mergeable counts of values in fixed bins, like numpy.histogram(): every
+    bin holds values from its left edge up to its right edge, the last one
+    also holds values equal to its right edge. Values outside the edges
+    aren't counted.
+
+    Attributes:
+        edges (numpy.ndarray): The bin edges, increasing.
+        counts (numpy.ndarray): How many values are in each bin.
+    """
+
+    def __init__(self, edges):
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.counts = np.zeros(len(self.edges) - 1, dtype=np.int64)
+
+    def add(self, values):
+        """
+        Args:
+            values (numpy.ndarray): The values of a chunk, without NaN.
+        """
+        self.counts += np.histogram(values, self.edges)[0]
+
+    def merge(self, other):
+        """
+        Args:
+            other (Histogram): Counts of other chunks, in the same bins.
+
+        Raises:
+            AssertionError: When the bin edges differ.
+        """
+        if not np.array_equal(self.edges, other.edges):
+            logging.warning("Can't merge histograms with other bin edges")
+            raise AssertionError(
+                "Can't merge histograms with other bin edges")
+        self.counts += other.counts
+
+
+def column_values(df, name):
+    """
+    Args:
+        df (pandas.DataFrame): The data.
+        name (str): The column.
+
+    Returns:
+        numpy.ndarray: Its values as float64, without missing values.
+    """
+    values = df[name].to_numpy(dtype=np.float64, na_value=np.nan)
+    return values[~np.isnan(values)]
+
+
+class Aggregate:
+    """
+    Mergeable stats of every numeric and checkbox column of a set of chunks.
+
+    Attributes:
+        columns (list(str)): The columns to keep stats of. None for every
+            numeric and checkbox column.
+        rows (int): Rows seen, missing values or not.
+        stats (dict(str->ColumnStats)): The stats of each column.
+        boolean (set(str)): The checkbox columns.
+        histograms (dict(str->Histogram)): The histogram of each column
+            edges were given for.
+    """
+
+    def __init__(self, columns=None, sketch_size=SKETCH_SIZE, edges=None):
+        self.columns = columns
+        self.sketch_size = sketch_size
+        self.rows = 0
+        self.stats = {}
+        self.boolean = set()
+        self.histograms = {}
+        for name in columns or []:
+            self.stats[name] = ColumnStats(sketch_size)
+        for name, column_edges in (edges or {}).items():
+            self.histograms[name] = Histogram(column_edges)
+
+    def add(self, df):
+        """
+        Args:
+            df (pandas.DataFrame): The next chunk.
+
+        Returns:
+            Aggregate: Itself.
+        """
+        self.rows += len(df)
+
+        names = self.columns
+        if names is None:
+            names = [name for name in df.columns
+                     if pd.api.types.is_numeric_dtype(df[name])]
+
+        for name in names:
+            if name not in df:
+                continue
+            column = df[name]
+            if pd.api.types.is_bool_dtype(column):
+                self.boolean.add(name)
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = ColumnStats(self.sketch_size)
+            stats.add(column_values(df, name))
+
+        for name, histogram in self.histograms.items():
+            if name in df:
+                histogram.add(column_values(df, name))
+
+        return self
+
+    def merge(self, other):
+        """
+        Args:
+            other (Aggregate): The stats of other chunks.
+
+        Returns:
+            Aggregate: Itself.
+        """
+        self.rows += other.rows
+        self.boolean |= other.boolean
+        for name, stats in other.stats.items():
+            if name not in self.stats:
+                self.stats[name] = ColumnStats(self.sketch_size)
+            self.stats[name].merge(stats)
+        for name, histogram in other.histograms.items():
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(histogram.edges)
+            self.histograms[name].merge(histogram)
+        return self
+
+    def _series(self, value):
+        return pd.Series(dict((name, value(stats))
+                              for name, stats in self.stats.items()),
+                         dtype=np.float64)
+
+    def counts(self):
+        return self._series(lambda stats: stats.count)
+
+    def sums(self):
+        return self._series(lambda stats: stats.total)
+
+    def means(self):
+        """
+        Returns:
+            pandas.Series: The mean of each column, missing values left out.
+        """
+        return self._series(lambda stats: stats.mean)
+
+    def variances(self):
+        return self._series(lambda stats: stats.variance())
+
+    def rates(self):
+        """
+        Returns:
+            pandas.Series: How often each checkbox was checked, out of the
+                responses that were asked.
+        """
+        return self.means()[[name for name in self.stats
+                             if name in self.boolean]]
+
+    def averages(self):
+        """
+        Returns:
+            pandas.Series: The sum of each column over all rows, counting
+                missing values as 0, like utils.column_averages().
+        """
+        return self.sums() / self.rows
+
+    def quantiles(self, q=QUANTILES):
+        """
+        Args:
+            q (list(float)): The quantiles, between 0 and 1.
+
+        Returns:
+            pandas.DataFrame: One row per column, one column per quantile.
+        """
+        return pd.DataFrame(
+            [stats.sketch.quantile(q) for stats in self.stats.values()],
+            index=list(self.stats), columns=list(q), dtype=np.float64)
+
+    def summary(self, q=QUANTILES):
+        """
+        Returns:
+            pandas.DataFrame: Like DataFrame.describe().T, plus the sums.
+        """
+        quantiles = self.quantiles(q)
+        quantiles.columns = ['{:g}%'.format(each * 100) for each in q]
+
+        summary = pd.DataFrame({
+            'count': self.counts(),
+            'mean': self.means(),
+            'std': np.sqrt(self.variances()),
+            'min': self._series(lambda stats: stats.minimum),
+        })
+        summary = pd.concat([summary, quantiles], axis=1)
+        summary['max'] = self._series(lambda stats: stats.maximum)
+        summary['sum'] = self.sums()
+        return summary
+
+
+def aggregate(df, columns=None, sketch_size=SKETCH_SIZE, edges=None):
+    """
+    Args:
+        df (pandas.DataFrame): The data. Can also be an iterator of
+            dataframes, like from utils.iter_dataframes().
+        columns (list(str)): Optional. Defaults to every numeric and checkbox
+            column.
+        sketch_size (int): Optional. See QuantileSketch.
+        edges (dict(str->list(float))): Optional. The bin edges of the
+            columns to keep histograms of, e.g. from utils.histogram_edges().
+
+    Returns:
+        Aggregate: The stats of the data.
+    """
+    if isinstance(df, pd.DataFrame):
+        df = [df]
+
+    result = Aggregate(columns, sketch_size, edges)
+    for chunk in df:
+        result.add(chunk)
+    return result
+
+
+def histogram(df, column_name, bins=10):
+    """
+    Counts the values of one column in bins spread evenly from its smallest
+    to its largest value, the same bins DataFrame.hist() draws.
+
+    Args:
+        df (pandas.DataFrame): The data.
+        column_name (str): The column.
+        bins (int): Optional. Number of bins.
+
+    Returns:
+        Histogram: The counts.
+    """
+    values = column_values(df, column_name)
+    result = Histogram(np.histogram_bin_edges(values, bins))
+    result.add(values)
+    return result
+
+
+def aggregate_parallel(frames, columns=None, sketch_size=SKETCH_SIZE,
+                       workers=None, edges=None):
+    """
+    Aggregates each chunk in a process pool and merges the results. Only a
+    few chunks are in flight at once, so the data is never all in memory.
+
+    Args:
+        frames (iterator(pandas.DataFrame)): The chunks.
+        columns (list(str)): Optional. See aggregate().
+        sketch_size (int): Optional. See QuantileSketch.
+        workers (int): Optional. Number of processes. Defaults to the number
+            of cores.
+        edges (dict(str->list(float))): Optional. See aggregate().
+
+    Returns:
+        Aggregate: The stats of every chunk.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    result = Aggregate(columns, sketch_size, edges)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for chunk in frames:
+            pending.append(executor.submit(aggregate, chunk, columns,
+                                           sketch_size, edges))
+            if len(pending) >= 2 * workers:
+                result.merge(pending.popleft().result())
+        while pending:
+            result.merge(pending.popleft().result())
+
+    return result
+
+
+def main(args):
+    import utils
+
+    frames = utils.iter_dataframes(args.chunk_size)
+    if args.workers > 1:
+        result = aggregate_parallel(frames, workers=args.workers)
+    else:
+        result = aggregate(frames)
+
+    utils.turn_off_scientific_notation()
+    print("{} responses".format(result.rows))
+    print(result.summary())
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+
+    parser.add_argument('-c', '--chunk_size',
+                        help="Responses read at a time.",
+                        type=int,
+                        default=100000)
+    parser.add_argument('-w', '--workers',
+                        help="Processes to aggregate chunks in.",
+                        type=int,
+                        default=1)
+
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Benchmarks loading, filtering and plot preparation on synthetic data.
+
+Data files of each size are made with generate_data.py, then every stage is
+timed (best of a few runs) and its peak memory measured (one more run under
+tracemalloc, which only sees memory allocated through Python and NumPy). The
+results are written to a JSON file, which a later run can be compared with
+to catch regressions.
+
+Example:
+    python benchmark.py --sizes 10000 100000 --output baseline.json
+    python benchmark.py --sizes 10000 100000 --compare baseline.json
+"""
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import aggregate
+import dataframe_cache
+import generate_data
+import utils
+
+DATA_DIR = 'benchmark_data'
+BASELINE_FILE = 'benchmark_baseline.json'
+
+# Columns the radar plots in the notebooks use.
+RADAR_COLUMNS = [
+    'ripped',
+    'kpop_dance_sing',
+    'perfect_vision',
+    'dress_like_fuccboi',
+    'over_10k_instagram',
+    'church_going',
+    'instrument_good',
+    'sports_varsity_college',
+]
+
+HISTOGRAM_COLUMNS = list(utils.OUTLIER_RULES)
+
+
+def data_file(size, seed=0, data_dir=DATA_DIR):
+    """
+    Makes a synthetic data file, unless it was made before.
+
+    Args:
+        size (int): Number of responses.
+        seed (int): Optional. See generate_data.generate().
+        data_dir (str): Optional. Where the data files are kept.
+
+    Returns:
+        str: The data file.
+    """
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+
+    file_name = os.path.join(data_dir, 'synthetic_{}_{}.json'.format(size,
+                                                                     seed))
+    if not os.path.exists(file_name):
+        # Written under another name first, so an interrupted run doesn't
+        # leave half a file behind.
+        generate_data.generate_file(file_name + '.tmp', size, seed=seed)
+        os.replace(file_name + '.tmp', file_name)
+    return file_name
+
+
+def measure(function, repeats):
+    """
+    Args:
+        function (function): The stage to run.
+        repeats (int): Times to time it.
+
+    Returns:
+        object: What the function returned.
+        dict: The best time in seconds and the peak bytes allocated.
+    """
+    best = None
+    for _ in range(repeats):
+        gc.collect()
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        del result
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return result, {'seconds': best, 'peak_bytes': peak}
+
+
+def radar_inputs(df):
+    """
+    Args:
+        df (pandas.DataFrame): The responses without outliers.
+
+    Returns:
+        pandas.Series: What plotting.plot_radar_df() draws.
+    """
+    return aggregate.aggregate(df, RADAR_COLUMNS).sums()
+
+
+def histogram_inputs(df, bins=10):
+    """
+    Args:
+        df (pandas.DataFrame): The responses without outliers.
+        bins (int): Optional. Bins per histogram.
+
+    Returns:
+        dict(str->tuple): The counts and bin edges of each histogram column.
+    """
+    histograms = {}
+    for column in HISTOGRAM_COLUMNS:
+        values = df[column].to_numpy(dtype=np.float64, na_value=np.nan)
+        histograms[column] = np.histogram(values[~np.isnan(values)], bins)
+    return histograms
+
+
+def run_stages(file_name, repeats):
+    """
+    Runs every stage on one data file, each on the output of the one before.
+
+    Args:
+        file_name (str): The data file.
+        repeats (int): Times to time each stage.
+
+    Returns:
+        dict(str->dict): The results of each stage, in order.
+    """
+    utils.DATA_FILE_NAME = file_name
+    dataframe_cache.clear_cache(file_name)
+    results = {}
+
+    data, results['load_data'] = measure(utils.load_data, repeats)
+    _, results['filter'] = measure(lambda: utils.filter(data), repeats)
+    del data
+
+    df, results['load_data_dataframe'] = measure(
+        lambda: utils.load_data_dataframe(use_cache=False), repeats)
+
+    utils.load_data_dataframe(refresh=True)
+    _, results['load_data_dataframe_cached'] = measure(
+        utils.load_data_dataframe, repeats)
+    dataframe_cache.clear_cache(file_name)
+
+    (df, _, _), results['drop_all_outliers'] = measure(
+        lambda: utils.drop_all_outliers(df), repeats)
+    _, results['radar'] = measure(lambda: radar_inputs(df), repeats)
+    _, results['histogram'] = measure(lambda: histogram_inputs(df), repeats)
+
+    return results
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Finds stages that got slower or use more memory than in a baseline.
+
+    Args:
+        results (dict): What main() writes.
+        baseline (dict): The same from an earlier run.
+        tolerance (float): How much worse is still fine, e.g. 0.2 for 20%.
+
+    Returns:
+        list(str): A line about each regression.
+    """
+    regressions = []
+    for size, stages in results['results'].items():
+        for stage, result in stages.items():
+            before = baseline['results'].get(size, {}).get(stage)
+            if before is None:
+                continue
+            for key in ('seconds', 'peak_bytes'):
+                limit = before[key] * (1 + tolerance)
+                if before[key] and result[key] > limit:
+                    regressions.append(
+                        "{} at {}: {} {:.3g} -> {:.3g}".format(
+                            stage, size, key, before[key], result[key]))
+    return regressions
+
+
+def main(args):
+    # Read first, the baseline may be the file that gets written.
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    results = {
+        'created': time.time(),
+        'environment': environment(),
+        'repeats': args.repeats,
+        'seed': args.seed,
+        'results': {},
+    }
+
+    for size in args.sizes:
+        file_name = data_file(size, args.seed, args.data_dir)
+        stages = run_stages(file_name, args.repeats)
+        results['results'][str(size)] = stages
+
+        print("{} responses".format(size))
+        for stage, result in stages.items():
+            print("    {:<28} {:>9.3f}s {:>10.1f} MB".format(
+                stage, result['seconds'], result['peak_bytes'] / 1e6))
+
+    with open(args.output, 'w') as output_file:
+        json.dump(results, output_file, indent=4, sort_keys=True)
+    print("Wrote {}".format(args.output))
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print("Regression: " + regression)
+        if regressions:
+            sys.exit(1)
+        print("No regressions against {}".format(args.compare))
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+
+    parser.add_argument('-s', '--sizes',
+                        help="Numbers of responses to benchmark with.",
+                        type=int,
+                        nargs='+',
+                        default=[10000, 100000])
+    parser.add_argument('-r', '--repeats',
+                        help="Times to run each stage, the best time is kept.",
+                        type=int,
+                        default=3)
+    parser.add_argument('--seed',
+                        help="Seed of the synthetic data.",
+                        type=int,
+                        default=0)
+    parser.add_argument('--data_dir',
+                        help="Where the synthetic data files are kept.",
+                        default=DATA_DIR)
+    parser.add_argument('-o', '--output',
+                        help="Where to write the results.",
+                        default=BASELINE_FILE)
+    parser.add_argument('-c', '--compare',
+                        help="Results of an earlier run to compare with.",
+                        default=None)
+    parser.add_argument('-t', '--tolerance',
+                        help="How much slower or bigger is still fine.",
+                        type=float,
+                        default=0.2)
+
+    args = parser.parse_args()
+    main(args)
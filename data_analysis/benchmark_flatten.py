@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Benchmarks flattening raw documents into a DataFrame: one QuizResponse and
+one dictionary per row (the old way) against ResponseTable.
+
+The rows are copies of the documents in a data file, or of synthetic ones
+from generate_data.py when no file is given, repeated until there are
+enough of them.
+
+Example:
+    python benchmark_flatten.py --rows 1000000
+    python benchmark_flatten.py --rows 1000000 --data_file data.json
+"""
+import itertools
+import time
+import generate_data
+import utils
+
+# Synthetic documents made when there is no data file, copies of them make
+# up the rest of the rows.
+SAMPLE_SIZE = 10000
+
+
+class EagerQuizResponse:
+    """
+    QuizResponse the way it was before it turned lazy, copying everything
+    as soon as it is made. Kept here so the old way is still timed as it
+    was.
+    """
+
+    def __init__(self, resp_data):
+        self.data = resp_data
+        self.timestamp = resp_data['timestamp_secs']
+        self.total_score = resp_data['total_score']
+        self.responses = utils.QuizResponse.filter_questions(
+            resp_data['responses'])
+
+
+def flatten_per_row(data):
+    """
+    The old way: a QuizResponse per document, then a DataFrame from a list
+    of dictionaries.
+
+    Args:
+        data (list(dict)): The raw documents.
+
+    Returns:
+        pandas.DataFrame: One row per response.
+    """
+    rows = []
+    for document in data:
+        # There is one dictionary that just stores the count of responses.
+        if 'responses' not in document:
+            continue
+        response = EagerQuizResponse(document)
+        response_dict = response.responses
+        response_dict['timestamp'] = response.timestamp
+        response_dict['total_score'] = response.total_score
+        rows.append(response_dict)
+    return utils.create_dataframe(rows)
+
+
+def flatten_columns(data):
+    """
+    Args:
+        data (list(dict)): The raw documents.
+
+    Returns:
+        pandas.DataFrame: One row per response.
+    """
+    return utils.ResponseTable.from_documents(data).to_dataframe()
+
+
+def repeat_documents(data, rows):
+    """
+    Args:
+        data (list(dict)): The raw documents.
+        rows (int): How many responses to make.
+
+    Returns:
+        list(dict): The responses repeated up to the number of rows.
+    """
+    responses = [document for document in data if 'responses' in document]
+    return list(itertools.islice(itertools.cycle(responses), rows))
+
+
+def time_it(function, data, repeats):
+    """
+    Args:
+        function (function): What to time.
+        data (list(dict)): What to call it with.
+        repeats (int): Times to call it.
+
+    Returns:
+        float: The best time in seconds over the repeats.
+    """
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def load_sample(data_file=None, seed=0):
+    """
+    Args:
+        data_file (str): Optional. A data file from download_mongo_db.py.
+        seed (int): Optional. See generate_data.generate().
+
+    Returns:
+        list(dict): The documents in the data file, or SAMPLE_SIZE synthetic
+            ones when there is none.
+    """
+    if data_file is None:
+        return list(generate_data.generate(SAMPLE_SIZE, seed=seed))
+    return list(utils.iter_documents(data_file))
+
+
+def main(args):
+    data = repeat_documents(load_sample(args.data_file, args.seed),
+                            args.rows)
+
+    per_row = time_it(flatten_per_row, data, args.repeats)
+    columns = time_it(flatten_columns, data, args.repeats)
+
+    print("{} rows".format(len(data)))
+    print("QuizResponse per row: {:.3f}s".format(per_row))
+    print("ResponseTable:        {:.3f}s".format(columns))
+    print("Speed up:             {:.2f}x".format(per_row / columns))
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+
+    parser.add_argument('-n', '--rows',
+                        help="Number of responses to flatten.",
+                        type=int,
+                        default=1000000)
+    parser.add_argument('-r', '--repeats',
+                        help="Times to run each, the best time is kept.",
+                        type=int,
+                        default=3)
+    parser.add_argument('--data_file',
+                        help="Copy the documents in this file instead of "
+                             "synthetic ones.")
+    parser.add_argument('--seed',
+                        help="Seed of the synthetic documents.",
+                        type=int,
+                        default=0)
+
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+On-disk cache for the cleaned DataFrame of quiz responses.
+
+The finished DataFrame is stored in a columnar format next to the data file:
+Feather when pyarrow is installed, otherwise one NumPy file per column that
+numeric columns are memory mapped back from. The cache is keyed by the path,
+modification time, size and content hash of the data file, so it is thrown
+away as soon as the data changes.
+"""
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+# Bump when the cleaning in utils.load_data_dataframe() changes, so old
+# caches aren't used.
+CACHE_VERSION = 2
+
+CACHE_DIR_NAME = '.sadscore_cache'
+META_FILE_NAME = 'meta.json'
+FEATHER_FILE_NAME = 'data.feather'
+
+
+def cache_dir_for(source_file_name):
+    """
+    Args:
+        source_file_name (str): The data file.
+
+    Returns:
+        str: The folder the cache of that data file is kept in.
+    """
+    source_file_name = os.path.abspath(source_file_name)
+    directory, name = os.path.split(source_file_name)
+    return os.path.join(directory, CACHE_DIR_NAME, name)
+
+
+def file_hash(file_name, chunk_size=1 << 20):
+    """
+    Hashes the contents of a file without reading it all into memory.
+
+    Args:
+        file_name (str): The file to hash.
+        chunk_size (int): Optional. Bytes read at a time.
+
+    Returns:
+        str: The SHA-1 hex digest.
+    """
+    digest = hashlib.sha1()
+    with open(file_name, 'rb') as input_file:
+        for chunk in iter(lambda: input_file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_key(source_file_name):
+    """
+    Args:
+        source_file_name (str): The data file.
+
+    Returns:
+        dict: What the cache of the data file is keyed on, except the content
+            hash, which is only computed when these change.
+    """
+    stat = os.stat(source_file_name)
+    return {
+        'path': os.path.abspath(source_file_name),
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'version': CACHE_VERSION,
+    }
+
+
+def read_meta(cache_dir):
+    meta_file_name = os.path.join(cache_dir, META_FILE_NAME)
+    if not os.path.exists(meta_file_name):
+        return None
+    with open(meta_file_name) as meta_file:
+        return json.load(meta_file)
+
+
+def write_meta(cache_dir, meta):
+    # Written last and renamed into place, so a half written cache is never
+    # picked up.
+    meta_file_name = os.path.join(cache_dir, META_FILE_NAME)
+    with open(meta_file_name + '.tmp', 'w') as meta_file:
+        json.dump(meta, meta_file, indent=4, sort_keys=True)
+    os.replace(meta_file_name + '.tmp', meta_file_name)
+
+
+def is_fresh(source_file_name, meta):
+    """
+    Checks whether a cache still matches its data file. When only the
+    modification time changed, the content hash decides.
+
+    Args:
+        source_file_name (str): The data file.
+        meta (dict): The meta data of the cache.
+
+    Returns:
+        bool: Whether the cache can be used.
+    """
+    key = source_key(source_file_name)
+    if meta['key'] == key:
+        return True
+
+    same_file = (meta['key']['path'] == key['path'] and
+                 meta['key']['size'] == key['size'] and
+                 meta['key']['version'] == key['version'])
+    if same_file and meta['hash'] == file_hash(source_file_name):
+        # Touched but not changed, remember the new time.
+        meta['key'] = key
+        write_meta(cache_dir_for(source_file_name), meta)
+        return True
+
+    return False
+
+
+def write_numpy(df, cache_dir):
+    """
+    Stores each column as a .npy file.
+
+    Args:
+        df (pandas.DataFrame): The DataFrame to store.
+        cache_dir (str): The cache folder.
+
+    Returns:
+        dict: How to read the columns back.
+    """
+    columns = []
+    for i, name in enumerate(df.columns):
+        column = df[name]
+        file_name = 'column_{:04d}.npy'.format(i)
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            np.save(os.path.join(cache_dir, file_name),
+                    column.cat.codes.to_numpy())
+            np.save(os.path.join(cache_dir, 'categories_' + file_name),
+                    column.cat.categories.to_numpy(), allow_pickle=True)
+            kind = 'category'
+        elif isinstance(column.dtype, pd.api.extensions.ExtensionDtype):
+            # Nullable types keep their values and their mask.
+            np.save(os.path.join(cache_dir, file_name),
+                    column.to_numpy(dtype=object), allow_pickle=True)
+            kind = 'extension'
+        else:
+            np.save(os.path.join(cache_dir, file_name), column.to_numpy(),
+                    allow_pickle=column.dtype == object)
+            kind = 'object' if column.dtype == object else 'numpy'
+        columns.append({'name': name, 'file': file_name, 'kind': kind,
+                        'dtype': str(column.dtype)})
+    return {'format': 'numpy', 'columns': columns}
+
+
+def read_numpy(cache_dir, layout):
+    """
+    Reads the columns stored by write_numpy(). Plain numeric columns are
+    memory mapped instead of read.
+
+    Args:
+        cache_dir (str): The cache folder.
+        layout (dict): What write_numpy() returned.
+
+    Returns:
+        pandas.DataFrame: The stored DataFrame.
+    """
+    data = {}
+    for column in layout['columns']:
+        path = os.path.join(cache_dir, column['file'])
+        if column['kind'] == 'numpy':
+            # Copy on write, so the DataFrame can still be changed.
+            data[column['name']] = np.load(path, mmap_mode='c')
+        elif column['kind'] == 'category':
+            categories = np.load(
+                os.path.join(cache_dir, 'categories_' + column['file']),
+                allow_pickle=True)
+            data[column['name']] = pd.Categorical.from_codes(
+                np.load(path), categories)
+        elif column['kind'] == 'extension':
+            data[column['name']] = pd.array(np.load(path, allow_pickle=True),
+                                            dtype=column['dtype'])
+        else:
+            data[column['name']] = np.load(path, allow_pickle=True)
+
+    columns = [column['name'] for column in layout['columns']]
+    return pd.DataFrame(data, columns=columns, copy=False)
+
+
+def read_cache(source_file_name):
+    """
+    Reads the cached DataFrame of a data file.
+
+    Args:
+        source_file_name (str): The data file.
+
+    Returns:
+        pandas.DataFrame: The cached DataFrame. None when there's no cache or
+            the data file changed since it was written.
+    """
+    cache_dir = cache_dir_for(source_file_name)
+    meta = read_meta(cache_dir)
+    if meta is None or not is_fresh(source_file_name, meta):
+        return None
+
+    try:
+        if meta['layout']['format'] == 'feather':
+            return pd.read_feather(os.path.join(cache_dir, FEATHER_FILE_NAME))
+        return read_numpy(cache_dir, meta['layout'])
+    except Exception:
+        # A broken cache is the same as no cache.
+        return None
+
+
+def write_cache(source_file_name, df, key=None, content_hash=None):
+    """
+    Stores the DataFrame of a data file. Uses Feather when pyarrow is
+    installed and can store every column, NumPy files otherwise.
+
+    Args:
+        source_file_name (str): The data file.
+        df (pandas.DataFrame): Its cleaned DataFrame.
+        key (dict): Optional. The source_key() of the data file the
+            DataFrame was built from. Defaults to the data file as it is now.
+        content_hash (str): Optional. The file_hash() of that data file.
+    """
+    if key is None:
+        key = source_key(source_file_name)
+    if content_hash is None:
+        content_hash = file_hash(source_file_name)
+
+    cache_dir = cache_dir_for(source_file_name)
+    clear_cache(source_file_name)
+    os.makedirs(cache_dir)
+
+    layout = None
+    if pyarrow is not None:
+        try:
+            df.reset_index(drop=True).to_feather(
+                os.path.join(cache_dir, FEATHER_FILE_NAME))
+            layout = {'format': 'feather'}
+        except (pyarrow.ArrowException, ValueError, TypeError):
+            layout = None
+    if layout is None:
+        layout = write_numpy(df.reset_index(drop=True), cache_dir)
+
+    write_meta(cache_dir, {
+        'key': key,
+        'hash': content_hash,
+        'layout': layout,
+    })
+
+
+def clear_cache(source_file_name):
+    """
+    Removes the cache of a data file.
+
+    Args:
+        source_file_name (str): The data file.
+    """
+    cache_dir = cache_dir_for(source_file_name)
+    if os.path.exists(cache_dir):
+        shutil.rmtree(cache_dir)
+
+
+def cached(source_file_name, build, refresh=False):
+    """
+    Gets the DataFrame of a data file from the cache, building and caching it
+    when needed.
+
+    Args:
+        source_file_name (str): The data file.
+        build (function): Builds the DataFrame from the data file.
+        refresh (bool): Optional. Whether to rebuild even if the cache is
+            fresh.
+
+    Returns:
+        pandas.DataFrame: The DataFrame.
+    """
+    if not refresh:
+        df = read_cache(source_file_name)
+        if df is not None:
+            return df
+
+    # Keyed on the data file as it was before the build, so a file that
+    # changes during the build isn't cached with the DataFrame of the old one.
+    key = source_key(source_file_name)
+    content_hash = file_hash(source_file_name)
+
+    df = build()
+
+    if source_key(source_file_name) != key:
+        # Changed while building, the next call builds from the new file.
+        return df
+
+    try:
+        write_cache(source_file_name, df, key, content_hash)
+    except OSError:
+        # Can't write next to the data, just don't cache.
+        pass
+    return df
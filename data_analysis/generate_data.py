@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Generates synthetic quiz responses shaped like the real export, for
+benchmarking.
+
+Every document has the questions of quiz_men_1.js (or index.js for version
+0), their values as the browser sends them (checkboxes as booleans, numbers
+as strings, blank when left empty) and the scores the browser would give.
+Some numbers are made out of range, so drop_all_outliers() has something to
+drop. Documents are written in batches, so any size fits in memory.
+
+Example:
+    python generate_data.py --documents 1000000 --output synthetic.json
+"""
+import json
+import numpy as np
+import pandas as pd
+import scoring
+import utils
+
+# The first _id and timestamp_secs, 2019-01-01.
+START_SECS = 1546300800
+
+# How the answers to the number questions are spread.
+#   distribution: numpy.random.Generator method and its arguments.
+#   outliers: Values outside the range utils.OUTLIER_RULES allows.
+NUMBER_QUESTIONS = {
+    'height_cm': {'distribution': ('normal', 173, 8),
+                  'outliers': (5, 120, 251, 1000)},
+    'iq_score': {'distribution': ('normal', 115, 15),
+                 'outliers': (-100, -1, 201, 10000)},
+    'instruments': {'distribution': ('poisson', 1),
+                    'outliers': (-10, -1, 21, 100)},
+    'foreign_langauges_fluent': {'distribution': ('poisson', 0.7),
+                                 'outliers': (-10, -1, 21, 100)},
+    'foreign_langauges_nonfluent': {'distribution': ('poisson', 1),
+                                    'outliers': (-10, -1, 21, 100)},
+    'tattoos': {'distribution': ('poisson', 0.3),
+                'outliers': (-10, -1, 21, 100)},
+    # A select from 1 to 10, so it's never blank or out of range.
+    'attractiveness': {'distribution': ('normal', 6, 1.5)},
+}
+
+ATTRACTIVENESS_RANGE = (1, 10)
+
+
+def number_answers(rng, name, count, blank_rate, outlier_rate):
+    """
+    Args:
+        rng (numpy.random.Generator): Random numbers.
+        name (str): The number question.
+        count (int): How many answers.
+        blank_rate (float): Share of answers left blank.
+        outlier_rate (float): Share of answers out of range.
+
+    Returns:
+        numpy.ndarray: The answers as numbers, NaN when blank.
+    """
+    question = NUMBER_QUESTIONS[name]
+    method = getattr(rng, question['distribution'][0])
+    values = np.round(method(*question['distribution'][1:], size=count))
+    values = values.astype(np.float64)
+
+    if 'outliers' not in question:
+        return np.clip(values, *ATTRACTIVENESS_RANGE)
+
+    # Half of the outliers are too low, half are too high.
+    low, low_max, high_min, high = question['outliers']
+    outliers = rng.random(count) < outlier_rate
+    too_low = rng.random(count) < 0.5
+    values[outliers & too_low] = rng.integers(
+        low, low_max + 1, size=(outliers & too_low).sum())
+    values[outliers & ~too_low] = rng.integers(
+        high_min, high + 1, size=(outliers & ~too_low).sum())
+
+    values[rng.random(count) < blank_rate] = np.nan
+    return values
+
+
+def generate_batch(rng, start, count, version=scoring.LATEST_VERSION,
+                   blank_rate=0.05, outlier_rate=0.01, check_rates=None):
+    """
+    Makes a batch of responses to one quiz version.
+
+    Args:
+        rng (numpy.random.Generator): Random numbers.
+        start (int): Number of responses made before this batch.
+        count (int): How many responses to make.
+        version (int): Optional. The quiz version in scoring.SCORING_TABLE.
+        blank_rate (float): Optional. Share of number answers left blank.
+        outlier_rate (float): Optional. Share of number answers out of range.
+        check_rates (dict(str->float)): Optional. How often each checkbox is
+            checked. Random when not given.
+
+    Returns:
+        list(dict): The documents, like the ones in the export.
+    """
+    table = scoring.SCORING_TABLE[version]
+    if check_rates is None:
+        check_rates = {}
+
+    responses = [{} for _ in range(count)]
+    total_scores = np.zeros(count)
+
+    for name, points in table['checkboxes'].items():
+        rate = check_rates.get(name, 0.3)
+        checked = rng.random(count) < rate
+        total_scores += checked * points
+        for response, value in zip(responses, checked.tolist()):
+            response[name] = {'name': name, 'value': value,
+                              'score': points if value else 0}
+
+    for name, rule in table['numeric'].items():
+        values = number_answers(rng, name, count, blank_rate, outlier_rate)
+        strings = ['' if np.isnan(value) else str(int(value))
+                   for value in values]
+        scores = scoring.NUMERIC_RULES[rule['rule']](pd.Series(strings), rule)
+        total_scores += scores
+        for response, value, score in zip(responses, strings,
+                                          scores.tolist()):
+            response[name] = {'name': name, 'value': value,
+                              'score': int(score)}
+
+    # Responses come in a few seconds apart.
+    seconds = START_SECS + start * 5 + np.cumsum(rng.random(count) * 10)
+
+    documents = []
+    for i, (response, total_score, timestamp) in enumerate(
+            zip(responses, total_scores.tolist(), seconds.tolist())):
+        documents.append({
+            '_id': '{:08x}{:016x}'.format(int(timestamp), start + i),
+            'form_type': 'men',
+            'form_version': version,
+            'responses': response,
+            'timestamp_secs': timestamp,
+            'total_score': int(total_score)
+        })
+    return documents
+
+
+def generate(documents, seed=0, batch_size=10000, **kwargs):
+    """
+    Makes responses a batch at a time, then the counter document like the
+    one in each response collection.
+
+    Args:
+        documents (int): How many responses to make.
+        seed (int): Optional. The same seed makes the same responses.
+        batch_size (int): Optional. Responses made at a time.
+        **kwargs: Passed on to generate_batch().
+
+    Yields:
+        dict: Each document.
+    """
+    rng = np.random.default_rng(seed)
+    check_rates = dict(
+        (name, rate) for name, rate in zip(
+            utils.CHECKBOX_QUESTIONS,
+            rng.uniform(0.05, 0.6, size=len(utils.CHECKBOX_QUESTIONS))))
+
+    for start in range(0, documents, batch_size):
+        count = min(batch_size, documents - start)
+        for document in generate_batch(rng, start, count,
+                                       check_rates=check_rates, **kwargs):
+            yield document
+
+    yield {'_id': 'responses', 'count': documents}
+
+
+def write(documents, output_file, ndjson=False):
+    """
+    Writes documents as one JSON array like download_mongo_db.py, but with
+    one document per line instead of indented, which is much faster to
+    write.
+
+    Args:
+        documents (iterable(dict)): The documents to write.
+        output_file (file): Where to write them.
+        ndjson (bool): Optional. Write NDJSON instead of an array.
+
+    Returns:
+        int: The number of documents written.
+    """
+    count = 0
+    for document in documents:
+        if not ndjson:
+            output_file.write('[\n' if count == 0 else ',\n')
+        output_file.write(json.dumps(document, sort_keys=True))
+        if ndjson:
+            output_file.write('\n')
+        count += 1
+
+    if not ndjson:
+        output_file.write('[]' if count == 0 else '\n]')
+    return count
+
+
+def generate_file(file_name, documents, seed=0, ndjson=False, **kwargs):
+    """
+    Args:
+        file_name (str): Where to write the responses.
+        documents (int): How many responses to make.
+        seed (int): Optional. See generate().
+        ndjson (bool): Optional. See write().
+        **kwargs: Passed on to generate_batch().
+
+    Returns:
+        int: The number of documents written, with the counter document.
+    """
+    with open(file_name, 'w') as output_file:
+        return write(generate(documents, seed, **kwargs), output_file,
+                     ndjson)
+
+
+def main(args):
+    count = generate_file(args.output, args.documents, seed=args.seed,
+                          ndjson=args.ndjson, version=args.version,
+                          blank_rate=args.blank_rate,
+                          outlier_rate=args.outlier_rate)
+    print("Wrote {} documents to {}".format(count, args.output))
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+
+    parser.add_argument('-n', '--documents',
+                        help="Number of responses to make.",
+                        type=int,
+                        default=10000)
+    parser.add_argument('-o', '--output',
+                        help="File to write.",
+                        default='synthetic_data.json')
+    parser.add_argument('--seed',
+                        help="The same seed makes the same responses.",
+                        type=int,
+                        default=0)
+    parser.add_argument('--ndjson',
+                        help="Write one document per line.",
+                        default=False,
+                        action='store_true')
+    parser.add_argument('--version',
+                        help="Quiz version of the responses.",
+                        type=int,
+                        choices=sorted(scoring.SCORING_TABLE),
+                        default=scoring.LATEST_VERSION)
+    parser.add_argument('--blank_rate',
+                        help="Share of number answers left blank.",
+                        type=float,
+                        default=0.05)
+    parser.add_argument('--outlier_rate',
+                        help="Share of number answers out of range.",
+                        type=float,
+                        default=0.01)
+
+    args = parser.parse_args()
+    main(args)
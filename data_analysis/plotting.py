@@ -1,25 +1,50 @@
 #!/usr/bin/env python3
 """
 Plotting functions
+
+Each function takes the data, or a summary of it from aggregate.py, which can
+be computed a chunk at a time and is much smaller to keep or send around.
 """
 import matplotlib.pyplot as plt
 from math import pi             # For radar graph.
+import pandas as pd
+import aggregate
+
+def draw_histogram(ax, column, bins=10):
+    """
+    Args:
+        ax (matplotlib.axes.Axes): Where to draw.
+        column (pandas.Series): The data. Can also be an aggregate.Histogram,
+            then bins is ignored.
+        bins (int): Optional. Number of bins.
+    """
+    if isinstance(column, aggregate.Histogram):
+        # One value at the left edge of each bin, weighted by its count.
+        ax.hist(column.edges[:-1], bins=column.edges, weights=column.counts,
+                alpha=0.9, color='blue')
+        ax.grid(True)
+    else:
+        column.hist(ax=ax, alpha=0.9, color='blue', bins=bins)
 
 def histogram(df, column_name, title, xlabel, ylabel, bins=10):
     """
     Makes a histogram of the data.
 
     Args:
-        df (pandas.DataFrame): All of the data.
+        df (pandas.DataFrame): All of the data. Can also be a dict of
+            aggregate.Histogram, like the histograms of an
+            aggregate.Aggregate.
         column_name (str): The specific data to use for the plot.
         title (str): The title of the plot.
         xlabel (str): The xlabel of the plot.
         ylabel (str): The ylabel of the plot.
+        bins (int): Optional. Number of bins. Not used for a Histogram,
+            which has its own.
     """
     # Get the data.
     column = df[column_name]
     ax = plt.gca()
-    column.hist(ax=ax, alpha=0.9, color='blue', bins=bins)
+    draw_histogram(ax, column, bins)
 
     # Handle title and labels.
     plt.title(title)
@@ -32,8 +57,10 @@ def histograms(column_name, original, filtered, title, xlabel, ylabel):
 
     Args:
         column_name (str): The specific data to use for the plot.
-        original (pandas.DataFrame): All of the data including outliers.
-        filtered (pandas.DataFrame): All of the data without outliers.
+        original (pandas.DataFrame): All of the data including outliers. Can
+            also be a dict of aggregate.Histogram, see histogram().
+        filtered (pandas.DataFrame): All of the data without outliers. Can
+            also be a dict of aggregate.Histogram.
         title (str): The title of the plot.
         xlabel (str): The xlabel of the plot.
         ylabel (str): The ylabel of the plot.
@@ -46,12 +73,12 @@ def histograms(column_name, original, filtered, title, xlabel, ylabel):
     _, (ax1, ax2) = plt.subplots(1, 2)
 
     # Plot the data with outliers.
-    orig_column.hist(ax=ax1, alpha=0.9, color='blue')
+    draw_histogram(ax1, orig_column)
     ax1.set_title('Original {title} Histogram'.format(title=title))
     ax1.set(xlabel=xlabel, ylabel=ylabel)
 
     # Plot the data without outliers.
-    filt_column.hist(ax=ax2, alpha=0.9, color='blue')
+    draw_histogram(ax2, filt_column)
     ax2.set_title('Filtered {title} Histogram'.format(title=title))
     ax2.set(xlabel=xlabel, ylabel=ylabel)
 
@@ -73,12 +100,15 @@ def pie_chart(percentages, column_name, yes_label, no_label, title):
     Helps plot a pie chart for yes or no data.
 
     Args:
-        percentages (pandas.DataFrame): All of the data averaged.
+        percentages (pandas.DataFrame): All of the data averaged. Can also be
+            an aggregate.Aggregate of the data.
         column_name (str): The specific data to use for the plot.
         yes_label (str): The label for the yes portion of the chart.
         no_label (str): The label for the no portion of the chart.
         title (str): The title of the plot.
     """
+    if isinstance(percentages, aggregate.Aggregate):
+        percentages = percentages.averages()
     yes_percentage = percentages[column_name]
     no_percentage = 1 - yes_percentage
 
@@ -177,18 +207,23 @@ def plot_radar_df(df, column_names, xlabels=None, fill_color='b'):
     Helps plot a radar graph.
 
     Args:
-        df (pandas.DataFrame): The data to be accessed to be plotted.
+        df (pandas.DataFrame): The data to be accessed to be plotted. Can also
+            be an iterator of dataframes, like from utils.iter_dataframes(),
+            an aggregate.Aggregate of the data or the sums of the columns
+            (pandas.Series or dict).
         column_names (list(str)): The names of the columns to be plotted on the
             graph.
         xlabels (dict(str->str)): Maps each column name to human readable label.
             Optional. When not specified, the column names are used as the
             labels.
     """
-    # Get sums.
-    sums = df.sum()
-
-    # Grab only the qualities we want.
-    sums = sums[column_names]
+    # Get sums of only the qualities we want.
+    if isinstance(df, aggregate.Aggregate):
+        sums = df.sums()[column_names]
+    elif isinstance(df, (pd.Series, dict)):
+        sums = pd.Series(df)[column_names]
+    else:
+        sums = aggregate.aggregate(df, column_names).sums()
 
     # Convert it to a dict.
     sums = sums.to_dict()
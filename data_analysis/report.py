@@ -0,0 +1,491 @@
+#!/usr/bin/env python3
+"""
+Renders a deck of figures to PNG/SVG files in parallel.
+
+Each figure is described by a spec, a dict like:
+
+    {
+        'name': 'height_cm',            # The file name, without extension.
+        'kind': 'histograms',           # A key of KINDS.
+        'data': 'filtered',             # Which frame to draw from.
+        'args': {...},                  # Passed on to the plotting function.
+        'formats': ['png'],             # Optional.
+        'figsize': [6.4, 4.8],          # Optional.
+        'dpi': 100,                     # Optional.
+        'wspace': 0.5,                  # Optional. plt.subplots_adjust().
+    }
+
+Figures are drawn with the Agg backend in a process pool. Each process only
+gets a summary of the columns its figure needs (see summarize()), a few
+kilobytes no matter how much data there is. A manifest in the output
+directory keeps a hash of the spec and of those columns for every figure, so
+a figure whose spec and data haven't changed since the last run isn't drawn
+again.
+
+Example:
+    python report.py --output_dir report --formats png svg
+"""
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import logging
+import os
+import time
+import matplotlib
+import pandas as pd
+import aggregate
+import utils
+
+MANIFEST_FILE = '.report_manifest.json'
+
+# Bump to redraw every figure, e.g. when the plotting functions change.
+RENDER_VERSION = 2
+
+# The plotting function of each kind of figure, and which frames it draws
+# from. None means the frame named by the 'data' of the spec.
+KINDS = {
+    'histogram': ('histogram', [None]),
+    'histograms': ('histograms', ['original', 'filtered']),
+    'pie_chart': ('pie_chart', [None]),
+    'radar': ('plot_radar_df', [None]),
+}
+
+HISTOGRAMS = [
+    # (column, title, xlabel)
+    ('height_cm', 'Height', 'Height (cm)'),
+    ('foreign_langauges_fluent', 'Fluent', 'Foreign Languages'),
+    ('foreign_langauges_nonfluent', 'Non-Fluent', 'Foreign Languages'),
+    ('instruments', 'Instruments', 'Instruments'),
+    ('iq_score', 'IQ Score', 'IQ Score'),
+    ('tattoos', 'Tattoos', 'Tattoos'),
+]
+
+PIE_CHARTS = [
+    # (column, yes_label, no_label, title)
+    ('degree_acceptable', 'STEM, Law, or Medicine Degree', 'Everything Else',
+     'Acceptable Degrees'),
+    ('degree_graduated', 'Graduated', 'Undergrad or not a student',
+     'Graduated'),
+    ('degree_masters', 'Masters', 'Undergraduate or Below', 'Masters'),
+    ('degree_phd', 'PhD', 'Masters or Below', 'PhD'),
+    ('degree_waste_of_time', "'Bad' Degree", 'Good Degree or No Degree',
+     'Perceived Bad vs Good Degrees'),
+    ('unemployed_not_student', 'Unemployed', 'Employed or Student',
+     'Unemployed'),
+    ('job_unacceptable_not_student', 'Minimum Wage Job',
+     "'Good' Job or Student", 'Minimum Wage Job, Not a Student'),
+    ('gpa_acceptable', '3.9+ GPA', '< 3.9 GPA', 'GPA'),
+    ('dropped_out', 'Dropped Out', 'Enrolled, Graduated, or Never Attended',
+     'Drops Outs'),
+    ('instrument_good', 'Good at Instruments', 'Bad or Never played.',
+     'Instruments Skill'),
+    ('sports_varsity_college', 'Varsity/College Sports',
+     'Bad or Never played.', 'Varsity/College Sports'),
+    ('english_non_fluent', 'Not Fluent in English', 'Fluent in English',
+     'English Fluency'),
+    ('english_only', 'Only Knows English', 'Knows More Than English',
+     'Non-English Languages'),
+    ('church_going', 'Attends Church', 'Does Not Attend Church',
+     'Church Attendance'),
+    ('ripped', 'Ripped', 'Weak', 'Ripped'),
+    ('kpop_dance_sing', 'Can Dances/Sings', 'Cannout Dance/Sing',
+     'Kpop Skills'),
+    ('perfect_vision', 'Perfect Vision', 'Imperfect Vision', 'Vision'),
+    ('dress_like_fuccboi', 'Dresses Well', 'Does Not Dress Well', 'Fashion'),
+    ('over_10k_instagram', '> 10 k followers', '< 10 k followers',
+     'Instagram Followers'),
+    ('asian_community_prominent_figure', 'Prominent Figure',
+     'Not a Prominent Figure', 'Asian Community'),
+    ('pi_tenth_digit', r'Knows 10th digit of $\pi$',
+     r'Does not know 10th digit of $\pi$', 'Pi'),
+    ('racist_against_other_asians', 'Racist', 'Not Racist', 'Racism'),
+    ('always_offer_to_pay', 'Offers to Pay', "Doesn't Offer to Pay",
+     'Paying for Dates'),
+    ('salty_about_paying', 'Salty About Paying', 'Okay with Paying',
+     'Salty About Paying'),
+    ('let_the_girl_pay_if_she_wants', "Let's the Girl Pay",
+     "Doesn't Let the Girl Pay", 'Letting the Girl Pay'),
+    ('above_platinum', 'Platinum', 'Below Platinum or Does not play League',
+     'Above Platinum'),
+    ('scored_yourself', 'Scored Yourself', 'Did Not Score Yourself',
+     'Scored Yourself'),
+]
+
+RADARS = {
+    # name: (fill_color, {column: label})
+    'qualities': ('red', {
+        'dress_like_fuccboi': 'Dresses Well',
+        'ripped': 'Ripped',
+        'perfect_vision': 'Perfect Vision',
+        'pi_tenth_digit': 'Knows 10th \ndigit of Pi',
+        'instrument_good': 'Good at \nInstruments',
+        'racist_against_other_asians': 'Racist Against \nOther Asians',
+    }),
+    'social': ('darkgreen', {
+        'above_platinum': '> Platinum in \nLeague of Legends',
+        'over_10k_instagram': '> 10 k Instagram Followers',
+        'kpop_dance_sing': 'Can Sing/Dance like \nKpop Performers',
+        'church_going': 'Goes to Church',
+        'asian_community_prominent_figure': 'Prominent Figure \n'
+                                            'in Asian Community',
+    }),
+}
+
+
+def default_specs():
+    """
+    Returns:
+        list(dict): The figures of Data-analysis.ipynb and the radar graphs
+            of Plots for traits.ipynb.
+    """
+    specs = []
+    for column, title, xlabel in HISTOGRAMS:
+        specs.append({
+            'name': column,
+            'kind': 'histograms',
+            'args': {'column_name': column, 'title': title,
+                     'xlabel': xlabel, 'ylabel': 'Number of People'},
+            'wspace': 0.5,
+        })
+    specs.append({
+        'name': 'attractiveness',
+        'kind': 'histogram',
+        'data': 'filtered',
+        'args': {'column_name': 'attractiveness',
+                 'title': 'Attractiveness Histogram',
+                 'xlabel': 'Attractiveness', 'ylabel': 'Number of People'},
+    })
+    specs.append({
+        'name': 'total_score',
+        'kind': 'histogram',
+        'data': 'total_score_filtered',
+        'args': {'column_name': 'total_score', 'title': 'Total Score',
+                 'xlabel': 'Total Score', 'ylabel': 'Number of People',
+                 'bins': 100},
+    })
+    for column, yes_label, no_label, title in PIE_CHARTS:
+        specs.append({
+            'name': column,
+            'kind': 'pie_chart',
+            'data': 'filtered',
+            'args': {'column_name': column, 'yes_label': yes_label,
+                     'no_label': no_label, 'title': title},
+        })
+    for name, (fill_color, xlabels) in RADARS.items():
+        specs.append({
+            'name': name + '_radar',
+            'kind': 'radar',
+            'data': 'filtered',
+            'args': {'column_names': list(xlabels), 'xlabels': xlabels,
+                     'fill_color': fill_color},
+            'dpi': 300,
+        })
+    return specs
+
+
+def load_frames(df=None):
+    """
+    Args:
+        df (pandas.DataFrame): Optional. All of the data. Loaded with
+            utils.load_data_dataframe() when not given.
+
+    Returns:
+        dict(str->pandas.DataFrame): The frames specs can draw from:
+            original, filtered (no outliers) and total_score_filtered.
+    """
+    if df is None:
+        df = utils.load_data_dataframe()
+    filtered, _, _ = utils.drop_all_outliers(df)
+    total_score_filtered, _ = utils.drop_total_score_outliers(df)
+    return {
+        'original': df,
+        'filtered': filtered,
+        'total_score_filtered': total_score_filtered,
+    }
+
+
+def fail(message):
+    logging.warning(message)
+    raise AssertionError(message)
+
+
+def spec_inputs(spec, frames):
+    """
+    Args:
+        spec (dict): The figure.
+        frames (dict(str->pandas.DataFrame)): See load_frames().
+
+    Raises:
+        AssertionError: When the kind, a frame or a column doesn't exist.
+
+    Returns:
+        dict(str->pandas.DataFrame): Each frame the figure draws from, with
+            only the columns it needs.
+    """
+    if spec.get('kind') not in KINDS:
+        fail("Unknown kind of figure {}: {}".format(spec.get('name'),
+                                                     spec.get('kind')))
+
+    args = spec.get('args', {})
+    columns = list(args.get('column_names', []))
+    if 'column_name' in args:
+        columns.append(args['column_name'])
+
+    inputs = {}
+    for frame in KINDS[spec['kind']][1]:
+        frame = frame or spec.get('data', 'filtered')
+        if frame not in frames:
+            fail("Unknown frame of figure {}: {}".format(spec['name'],
+                                                          frame))
+        missing = [column for column in columns
+                   if column not in frames[frame]]
+        if missing:
+            fail("Missing columns of figure {}: {}".format(
+                spec['name'], ', '.join(missing)))
+        inputs[frame] = frames[frame][columns]
+    return inputs
+
+
+def hash_frame(df):
+    """
+    Args:
+        df (pandas.DataFrame): The data.
+
+    Returns:
+        str: A hash of its values, index, column names and dtypes.
+    """
+    digest = hashlib.sha1()
+    digest.update(json.dumps([[str(name), str(dtype)]
+                              for name, dtype in df.dtypes.items()])
+                  .encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy()
+                  .tobytes())
+    return digest.hexdigest()
+
+
+def spec_key(spec, inputs):
+    """
+    Args:
+        spec (dict): The figure.
+        inputs (dict(str->pandas.DataFrame)): See spec_inputs().
+
+    Returns:
+        str: Changes whenever the spec, its data or matplotlib do.
+    """
+    digest = hashlib.sha1()
+    digest.update(json.dumps([RENDER_VERSION, matplotlib.__version__, spec],
+                             sort_keys=True).encode('utf-8'))
+    for frame in sorted(inputs):
+        digest.update(frame.encode('utf-8'))
+        digest.update(hash_frame(inputs[frame]).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def summarize(spec, inputs):
+    """
+    Args:
+        spec (dict): The figure.
+        inputs (dict(str->pandas.DataFrame)): See spec_inputs().
+
+    Returns:
+        dict(str->object): What the plotting function draws from each frame:
+            a dict of aggregate.Histogram for histograms, otherwise an
+            aggregate.Aggregate.
+    """
+    args = spec.get('args', {})
+    summaries = {}
+    for frame, df in inputs.items():
+        if spec['kind'] in ('histogram', 'histograms'):
+            column_name = args['column_name']
+            summaries[frame] = {column_name: aggregate.histogram(
+                df, column_name, args.get('bins', 10))}
+        else:
+            summaries[frame] = aggregate.aggregate(df, list(df.columns))
+    return summaries
+
+
+def output_files(spec, output_dir, formats):
+    return [os.path.join(output_dir, '{}.{}'.format(spec['name'], extension))
+            for extension in spec.get('formats', formats)]
+
+
+def use_agg():
+    """
+    Sets up a worker process to draw without a display.
+    """
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    plt.close('all')
+
+
+def draw(spec, summaries, files):
+    """
+    Draws one figure and saves it. Runs in a worker process.
+
+    Args:
+        spec (dict): The figure.
+        summaries (dict(str->object)): See summarize().
+        files (list(str)): Where to save it. The extension is the format.
+
+    Returns:
+        str: The name of the figure.
+        float: Seconds it took.
+    """
+    import matplotlib.pyplot as plt
+    import plotting
+
+    start = time.perf_counter()
+    function_name, frames = KINDS[spec['kind']]
+    function = getattr(plotting, function_name)
+    args = dict(spec.get('args', {}))
+    data = summaries[spec.get('data', 'filtered')] if None in frames else None
+
+    plt.figure(figsize=spec.get('figsize'), dpi=spec.get('dpi'))
+    if spec['kind'] == 'histograms':
+        function(original=summaries['original'],
+                 filtered=summaries['filtered'], **args)
+    else:
+        function(data, **args)
+
+    if 'wspace' in spec:
+        plt.subplots_adjust(wspace=spec['wspace'])
+
+    for file_name in files:
+        # Written under another name first, so an interrupted run doesn't
+        # leave half a file behind.
+        extension = os.path.splitext(file_name)[1]
+        temporary = file_name + '.tmp' + extension
+        plt.savefig(temporary, dpi=spec.get('dpi'), bbox_inches='tight')
+        os.replace(temporary, file_name)
+    plt.close('all')
+
+    return spec['name'], time.perf_counter() - start
+
+
+def read_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, MANIFEST_FILE)) as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_manifest(output_dir, manifest):
+    file_name = os.path.join(output_dir, MANIFEST_FILE)
+    with open(file_name + '.tmp', 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=4, sort_keys=True)
+    os.replace(file_name + '.tmp', file_name)
+
+
+def render(specs, frames, output_dir='report', formats=('png',),
+           workers=None, force=False):
+    """
+    Draws every figure whose spec or data changed since the last run.
+
+    Args:
+        specs (list(dict)): The figures, see the top of this file.
+        frames (dict(str->pandas.DataFrame)): See load_frames().
+        output_dir (str): Optional. Where to save the figures.
+        formats (list(str)): Optional. Extensions to save figures as, for
+            specs without formats of their own.
+        workers (int): Optional. Number of processes. Defaults to the number
+            of cores.
+        force (bool): Optional. Draw every figure.
+
+    Raises:
+        AssertionError: When two specs have the same name, or a spec is
+            invalid, see spec_inputs().
+
+    Returns:
+        dict(str->float): Seconds each figure that was drawn took.
+        list(str): The names of the figures that were up to date.
+    """
+    names = [spec['name'] for spec in specs]
+    duplicates = sorted(set(name for name in names if names.count(name) > 1))
+    if duplicates:
+        fail("Figures with the same name: {}".format(', '.join(duplicates)))
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    manifest = read_manifest(output_dir)
+    jobs = []
+    skipped = []
+    for spec in specs:
+        inputs = spec_inputs(spec, frames)
+        key = spec_key(spec, inputs)
+        files = output_files(spec, output_dir, formats)
+        entry = manifest.get(spec['name'], {})
+        if (not force and entry.get('key') == key and
+                all(os.path.exists(file_name) for file_name in files)):
+            skipped.append(spec['name'])
+            continue
+        jobs.append((spec, inputs, files, key))
+
+    drawn = {}
+    if jobs:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs)),
+                                 initializer=use_agg) as executor:
+            futures = [executor.submit(draw, spec, summarize(spec, inputs),
+                                       files)
+                       for spec, inputs, files, _ in jobs]
+            for (spec, _, files, key), future in zip(jobs, futures):
+                name, seconds = future.result()
+                drawn[name] = seconds
+                manifest[name] = {
+                    'key': key,
+                    'files': [os.path.basename(file_name)
+                              for file_name in files],
+                }
+        write_manifest(output_dir, manifest)
+
+    return drawn, skipped
+
+
+def main(args):
+    specs = default_specs()
+    if args.specs is not None:
+        with open(args.specs) as specs_file:
+            specs = json.load(specs_file)
+
+    start = time.perf_counter()
+    frames = load_frames()
+    drawn, skipped = render(specs, frames, args.output_dir, args.formats,
+                            args.workers, args.force)
+
+    print("Drew {} figures, {} up to date, in {:.2f}s".format(
+        len(drawn), len(skipped), time.perf_counter() - start))
+    for name, seconds in sorted(drawn.items(), key=lambda item: -item[1]):
+        print("    {:<36} {:>7.2f}s".format(name, seconds))
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+
+    parser.add_argument('-o', '--output_dir',
+                        help="Where to save the figures.",
+                        default='report')
+    parser.add_argument('-f', '--formats',
+                        help="Formats to save the figures as.",
+                        nargs='+',
+                        choices=['png', 'svg', 'pdf'],
+                        default=['png'])
+    parser.add_argument('-s', '--specs',
+                        help="JSON file with a list of figure specs. "
+                             "Defaults to the figures of the notebooks.",
+                        default=None)
+    parser.add_argument('-w', '--workers',
+                        help="Processes to draw in. Defaults to the number "
+                             "of cores.",
+                        type=int,
+                        default=None)
+    parser.add_argument('--force',
+                        help="Draw every figure, even if up to date.",
+                        default=False,
+                        action='store_true')
+
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+Scores quiz responses the same way the quiz pages do in the browser.
+
+The rules and weights of each quiz version are declared in SCORING_TABLE,
+copied from server/static/js/index.js (version 0) and
+server/static/js/quiz_men_1.js (version 1). A whole DataFrame is rescored at
+once with NumPy, so weights can be changed and the history rescored without
+replaying any submissions.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import numpy as np
+import pandas as pd
+
+CENTIMETERS_PER_INCH = 2.54
+
+# Points for each quiz version.
+#   checkboxes: Points added when the box is checked.
+#   numeric: How each number question is scored, see NUMERIC_RULES.
+SCORING_TABLE = {
+    0: {
+        'checkboxes': {
+            'degree_acceptable': 3,
+            'degree_graduated': 2,
+            'degree_waste_of_time': -3,
+            'salary_six_figure': 5,
+            'unemployed_not_student': -5,
+            'job_unacceptable_not_student': -4,
+            'gpa_acceptable': 4,
+            'dropped_out': -9000,
+            'instrument_good': 3,
+            'sports_varsity_college': 2,
+            'english_non_fluent': -3,
+            'english_only': 2,
+            'church_going': 4,
+            'ripped': 4,
+            'kpop_dance_sing': 3,
+            'perfect_vision': 3,
+            'dress_like_fuccboi': 2,
+            'over_10k_instagram': 2,
+            'asian_community_prominent_figure': 3,
+            'pi_tenth_digit': -1,
+            'racist_against_other_asians': -10,
+            'scored_yourself': -3,
+        },
+        'numeric': {
+            # +1 for every cm over 177, -1 for every cm under 170.
+            'height_cm': {'rule': 'range', 'above': 177, 'below': 170,
+                          'nan_value': 0},
+            # +3 for an IQ over 130, -3 for under 110.
+            'iq_score': {'rule': 'threshold', 'above': 130, 'below': 110,
+                         'points': 3, 'nan_value': 0},
+            'instruments': {'rule': 'linear', 'points': 3},
+            'foreign_langauges_fluent': {'rule': 'linear', 'points': 3},
+            'foreign_langauges_nonfluent': {'rule': 'linear', 'points': 1},
+            'tattoos': {'rule': 'linear', 'points': -1},
+        },
+    },
+    1: {
+        'checkboxes': {
+            'degree_acceptable': 2,
+            'degree_graduated': 2,
+            'degree_masters': 2,
+            'degree_phd': 5,
+            'degree_waste_of_time': -3,
+            'salary_over_80k': 2,
+            'salary_over_100k': 3,
+            'salary_over_200k': 2,
+            'unemployed_not_student': -5,
+            'job_unacceptable_not_student': -4,
+            'gpa_acceptable': 4,
+            'dropped_out': -9000,
+            'instrument_good': 3,
+            'sports_varsity_college': 2,
+            'english_non_fluent': -3,
+            'english_only': -5,
+            'church_going': 4,
+            'ripped': 3,
+            'kpop_dance_sing': 3,
+            'perfect_vision': 3,
+            'dress_like_fuccboi': 2,
+            'over_10k_instagram': 2,
+            'asian_community_prominent_figure': 3,
+            'pi_tenth_digit': -1,
+            'racist_against_other_asians': -10,
+            'always_offer_to_pay': 3,
+            'salty_about_paying': -3,
+            'let_the_girl_pay_if_she_wants': 1,
+            'above_platinum': 1,
+            'scored_yourself': -3,
+        },
+        'numeric': {
+            # +1 for every inch over 5'10, -1 for every inch under 5'7. A
+            # blank height scores 0 in the browser, so there's no nan_value.
+            'height_cm': {'rule': 'range', 'above': 70, 'below': 67,
+                          'divisor': CENTIMETERS_PER_INCH},
+            'iq_score': {'rule': 'threshold', 'above': 130, 'below': 110,
+                         'points': 3, 'nan_value': 0},
+            'instruments': {'rule': 'linear', 'points': 3},
+            'foreign_langauges_fluent': {'rule': 'linear', 'points': 3},
+            'foreign_langauges_nonfluent': {'rule': 'linear', 'points': 1},
+            'tattoos': {'rule': 'linear', 'points': -1},
+            # 6 is 0 points, +/-1 for each step away capped at +/-3, 10 is 0.
+            'attractiveness': {'rule': 'clamped', 'median': 6,
+                               'conceited': 10, 'min': -3, 'max': 3,
+                               'nan_value': 0},
+        },
+    },
+}
+
+LATEST_VERSION = max(SCORING_TABLE)
+
+
+def parse_int(values, nan_value=None):
+    """
+    Converts values the way parseInt() does in the browser.
+
+    Args:
+        values (pandas.Series): The raw values. Strings or numbers.
+        nan_value (int): Optional. What to use for values that aren't
+            numbers. They are left as NaN when not given.
+
+    Returns:
+        numpy.ndarray: The values as floats truncated towards zero.
+    """
+    numbers = np.trunc(pd.to_numeric(values, errors='coerce').to_numpy(
+        dtype=np.float64, na_value=np.nan))
+    if nan_value is not None:
+        numbers[np.isnan(numbers)] = nan_value
+    return numbers
+
+
+def js_round(values):
+    """
+    Rounds halves up like Math.round() instead of to even like np.round().
+
+    Args:
+        values (numpy.ndarray): The values to round.
+
+    Returns:
+        numpy.ndarray: The rounded values.
+    """
+    return np.floor(values + 0.5)
+
+
+def linear_score(values, rule):
+    """Points for every one of something, e.g. 3 per instrument."""
+    return parse_int(values, 0) * rule['points']
+
+
+def threshold_score(values, rule):
+    """Fixed points above one value and fixed points off below another."""
+    numbers = parse_int(values, rule.get('nan_value'))
+    scores = np.zeros(len(numbers))
+    scores[numbers > rule['above']] = rule['points']
+    scores[numbers < rule['below']] = -rule['points']
+    return scores
+
+
+def range_score(values, rule):
+    """A point for every unit above a range and a point off for every unit
+    below it."""
+    numbers = parse_int(values, rule.get('nan_value'))
+    if 'divisor' in rule:
+        numbers = js_round(numbers / rule['divisor'])
+
+    scores = np.zeros(len(numbers))
+    above = numbers > rule['above']
+    below = numbers < rule['below']
+    scores[above] = numbers[above] - rule['above']
+    scores[below] = numbers[below] - rule['below']
+    return scores
+
+
+def clamped_score(values, rule):
+    """Points for how far from the median, capped, with one value worth
+    nothing."""
+    numbers = parse_int(values, rule.get('nan_value'))
+    scores = np.clip(numbers - rule['median'], rule['min'], rule['max'])
+    scores[numbers == rule['conceited']] = 0
+    return scores
+
+
+NUMERIC_RULES = {
+    'linear': linear_score,
+    'threshold': threshold_score,
+    'range': range_score,
+    'clamped': clamped_score,
+}
+
+
+def infer_versions(df):
+    """
+    Finds the quiz version of each response. Uses the form_version column
+    when there is one. Otherwise responses that answered the version 0 only
+    salary_six_figure question are version 0 and the rest are the latest.
+
+    Args:
+        df (pandas.DataFrame): The quiz responses.
+
+    Returns:
+        numpy.ndarray: The quiz version of each row.
+    """
+    if 'form_version' in df.columns:
+        return pd.to_numeric(df['form_version'], errors='coerce').fillna(
+            LATEST_VERSION).to_numpy(dtype=np.int64)
+
+    versions = np.full(len(df), LATEST_VERSION, dtype=np.int64)
+    if 'salary_six_figure' in df.columns:
+        versions[df['salary_six_figure'].notna().to_numpy()] = 0
+    return versions
+
+
+def score_version(df, version):
+    """
+    Scores every row with the rules of one quiz version.
+
+    Args:
+        df (pandas.DataFrame): The quiz responses, one column per question.
+        version (int): The quiz version in SCORING_TABLE.
+
+    Returns:
+        numpy.ndarray: The total score of each row.
+    """
+    table = SCORING_TABLE[version]
+    scores = np.zeros(len(df))
+
+    # Every checkbox at once: checked matrix times point vector.
+    names = [name for name in table['checkboxes'] if name in df.columns]
+    if names:
+        checked = df[names].eq(True).to_numpy(dtype=bool, na_value=False)
+        points = np.array([table['checkboxes'][name] for name in names])
+        scores += checked.dot(points)
+
+    missing = pd.Series(np.nan, index=df.index)
+    for name, rule in table['numeric'].items():
+        values = df[name] if name in df.columns else missing
+        scores += NUMERIC_RULES[rule['rule']](values, rule)
+
+    return scores
+
+
+def rescore(df, version=None):
+    """
+    Rescores every quiz response.
+
+    Args:
+        df (pandas.DataFrame): The quiz responses, one column per question.
+            E.g. from utils.load_data_dataframe().
+        version (int): Optional. Score every row with this quiz version.
+            When not given the version of each row is used, see
+            infer_versions().
+
+    Returns:
+        pandas.Series: The total score of each row.
+    """
+    if version is not None:
+        return pd.Series(score_version(df, version), index=df.index)
+
+    versions = infer_versions(df)
+    scores = np.zeros(len(df))
+    for each_version in np.unique(versions):
+        rows = versions == each_version
+        scores[rows] = score_version(df[rows], int(each_version))
+
+    return pd.Series(scores, index=df.index)
+
+
+def rescore_parallel(df, version=None, workers=None, chunk_size=500000):
+    """
+    Rescores a large DataFrame in chunks across a process pool.
+
+    Args:
+        df (pandas.DataFrame): The quiz responses, one column per question.
+        version (int): Optional. See rescore().
+        workers (int): Optional. Number of processes. Defaults to the number
+            of cores.
+        chunk_size (int): Optional. Rows sent to a process at a time.
+
+    Returns:
+        pandas.Series: The total score of each row.
+    """
+    if len(df) <= chunk_size:
+        return rescore(df, version)
+
+    chunks = [df.iloc[start:start + chunk_size]
+              for start in range(0, len(df), chunk_size)]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        scores = list(executor.map(rescore, chunks, repeat(version)))
+
+    return pd.concat(scores)
+
+
+def check_parity(df, version=None):
+    """
+    Compares rescored totals with the total_score recorded by the browser.
+
+    Args:
+        df (pandas.DataFrame): The quiz responses with a total_score column.
+        version (int): Optional. See rescore().
+
+    Returns:
+        pandas.DataFrame: Rows where the scores differ, with the recorded
+            and rescored totals.
+    """
+    scores = rescore(df, version)
+    recorded = pd.to_numeric(df['total_score'], errors='coerce')
+
+    mismatched = recorded != scores
+    return pd.DataFrame({
+        'total_score': recorded[mismatched],
+        'rescored': scores[mismatched]
+    })
+
+
+def main():
+    import utils
+
+    df = utils.load_data_dataframe()
+    mismatches = check_parity(df)
+
+    print("{} of {} responses match their recorded total_score.".format(
+        len(df) - len(mismatches), len(df)))
+    if len(mismatches):
+        print(mismatches.head(20))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Tests for aggregate.py, run from the data_analysis directory with pytest.
+"""
+import numpy as np
+import pandas as pd
+import aggregate
+import generate_data
+import utils
+
+
+def expected_summary(df):
+    """
+    Args:
+        df (pandas.DataFrame): The data.
+
+    Returns:
+        pandas.DataFrame: DataFrame.describe().T of every numeric and
+            checkbox column as float64, plus the sums.
+    """
+    floats = pd.DataFrame(dict(
+        (name, df[name].to_numpy(dtype=np.float64, na_value=np.nan))
+        for name in df.columns
+        if pd.api.types.is_numeric_dtype(df[name])), index=df.index)
+    summary = floats.describe().T
+    summary['sum'] = floats.sum()
+    return summary
+
+
+def check_summary(result, df):
+    pd.testing.assert_frame_equal(result.summary(), expected_summary(df),
+                                  check_names=False)
+
+
+def test_summary_matches_describe():
+    df = pd.DataFrame({
+        'height_cm': [175.0, 160.5, np.nan, 190.0, 181.0, 170.0],
+        'iq_score': pd.array([120, None, 95, 140, None, 101], dtype='Int16'),
+        'tattoos': pd.array([0, 1, 2, 0, 0, 7], dtype='Int8'),
+        'ripped': pd.array([True, None, False, True, None, False],
+                           dtype='boolean'),
+        'church_going': [True, False, False, False, True, False],
+        'comment': ['a', 'b', 'c', 'd', 'e', 'f'],
+    })
+
+    result = aggregate.aggregate(df)
+
+    check_summary(result, df)
+    assert result.boolean == {'ripped', 'church_going'}
+    assert result.rows == len(df)
+
+
+def test_chunks_match_describe(tmp_path):
+    file_name = str(tmp_path / 'data.json')
+    generate_data.generate_file(file_name, 1000, seed=1)
+
+    chunks = list(utils.iter_dataframes(300, file_name))
+    df = pd.concat(chunks)
+    assert len(chunks) == 4
+
+    check_summary(aggregate.aggregate(iter(chunks)), df)
+
+    # Chunks aggregated on their own and merged, like aggregate_parallel().
+    merged = aggregate.Aggregate()
+    for chunk in chunks:
+        merged.merge(aggregate.aggregate(chunk))
+    check_summary(merged, df)
@@ -0,0 +1,82 @@
+"""
+Tests for scoring.py, run from the data_analysis directory with pytest.
+
+The expected totals were worked out by hand from server/static/js/index.js
+(version 0) and server/static/js/quiz_men_1.js (version 1), the way the
+browser adds them up. Numbers are sent as strings, blank when left empty.
+"""
+import numpy as np
+import pandas as pd
+import scoring
+
+# Every number question answered so that it scores 0 in version 1: 175cm is
+# 69 inches, between 5'7 and 5'10.
+NEUTRAL = {'height_cm': '175', 'iq_score': '120', 'instruments': '',
+           'foreign_langauges_fluent': '', 'foreign_langauges_nonfluent': '',
+           'tattoos': '', 'attractiveness': '6'}
+
+# (answers, total_score the browser recorded) for version 1.
+VERSION_1 = [
+    # Blank height is NaN in parseInt and scores 0, a blank IQ counts as 0
+    # which is under 110 (-3), a blank attractiveness counts as 0, -6
+    # capped at -3.
+    (dict(NEUTRAL, height_cm='', iq_score='', attractiveness=''), -6),
+    (dict(NEUTRAL, height_cm='abc'), 0),
+    # 180cm is 71 inches (+1), IQ over 130 (+3), 2 instruments (+6), a
+    # tattoo (-1), and 10 is conceited so 0.
+    (dict(NEUTRAL, height_cm='180', iq_score='131', instruments='2',
+          tattoos='1', attractiveness='10'), 9),
+    # parseInt('165.9') is 165, 65 inches (-2), attractiveness 7 (+1).
+    (dict(NEUTRAL, height_cm='165.9', attractiveness='7'), -1),
+    # The IQ thresholds are strict.
+    (dict(NEUTRAL, iq_score='130'), 0),
+    (dict(NEUTRAL, iq_score='110'), 0),
+    (dict(NEUTRAL, iq_score='109'), -3),
+    (dict(NEUTRAL, iq_score='131'), 3),
+    (dict(NEUTRAL, dropped_out=True, degree_phd=True), -8995),
+    (dict(NEUTRAL, english_only=True, always_offer_to_pay=True,
+          salty_about_paying=False), -2),
+]
+
+# (answers, total_score the browser recorded) for version 0, which has no
+# attractiveness question and none of the version 1 only checkboxes.
+VERSION_0 = [
+    # Six figures (+5), 180cm is 3 over 177, a blank IQ is 0 (-3), an
+    # instrument (+3).
+    ({'salary_six_figure': True, 'height_cm': '180', 'iq_score': '',
+      'instruments': '1'}, 8),
+    # A blank height counts as 0cm, 170 under.
+    ({'salary_six_figure': False, 'dropped_out': True, 'height_cm': '',
+      'iq_score': '120'}, -9170),
+    ({'salary_six_figure': False, 'height_cm': '172', 'iq_score': '131',
+      'english_only': True}, 5),
+]
+
+
+def responses(cases, version=None):
+    df = pd.DataFrame([answers for answers, _ in cases])
+    if version is not None:
+        df['form_version'] = version
+    df['total_score'] = [total for _, total in cases]
+    return df
+
+
+def test_version_1_matches_the_browser():
+    df = responses(VERSION_1, version=1)
+    np.testing.assert_array_equal(scoring.rescore(df), df['total_score'])
+    assert len(scoring.check_parity(df)) == 0
+
+
+def test_version_0_matches_the_browser():
+    df = responses(VERSION_0, version=0)
+    np.testing.assert_array_equal(scoring.rescore(df), df['total_score'])
+    assert len(scoring.check_parity(df)) == 0
+
+
+def test_versions_inferred_without_form_version():
+    # Version 0 rows are the ones that answered salary_six_figure.
+    df = responses(VERSION_0 + VERSION_1)
+    assert 'form_version' not in df.columns
+    np.testing.assert_array_equal(scoring.infer_versions(df),
+                                  [0] * len(VERSION_0) + [1] * len(VERSION_1))
+    np.testing.assert_array_equal(scoring.rescore(df), df['total_score'])
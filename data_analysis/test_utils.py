@@ -0,0 +1,65 @@
+"""
+Tests for utils.py, run from the data_analysis directory with pytest.
+"""
+import numpy as np
+import pandas as pd
+import utils
+
+
+def make_frame():
+    """
+    Returns:
+        pandas.DataFrame: Rows in range, out of range for one rule and for
+            several, and with missing values, with the dtypes
+            apply_schema() gives.
+    """
+    nan = np.nan
+    return pd.DataFrame({
+        'height_cm': [175.0, 300.0, 100.0, 180.0, 160.0, nan, 170.0],
+        'instruments': pd.array([0, 1, 2, None, 0, 1, 0], dtype='Int16'),
+        'iq_score': pd.array([120, 110, 500, 130, None, 100, 201],
+                             dtype='Int16'),
+        'foreign_langauges_fluent': pd.array([1, 0, 0, 1, 0, 0, -1],
+                                             dtype='Int8'),
+        'foreign_langauges_nonfluent': pd.array([0, 0, 0, 0, 0, 0, 0],
+                                                dtype='Int8'),
+        'tattoos': pd.array([0, 2, 0, 0, 50, 0, 0], dtype='Int8'),
+        'total_score': [1, 2, 3, 4, 5, 6, 7],
+    }, index=[10, 11, 12, 13, 14, 15, 16])
+
+
+def test_outlier_rules_match_drop_outliers():
+    df = make_frame()
+    clean, outliers, counts = utils.drop_all_outliers(df)
+
+    # The old way, one rule after another.
+    expected = df
+    listed = set()
+    for column, (min_val, max_val) in utils.OUTLIER_RULES.items():
+        expected, caught = utils.drop_outliers(expected, column, min_val,
+                                               max_val)
+        listed.update(caught.index)
+    pd.testing.assert_frame_equal(clean, expected)
+
+    # Each rule on its own, so rows breaking several get all of them.
+    tags = dict((index, set()) for index in outliers.index)
+    for column, (min_val, max_val) in utils.OUTLIER_RULES.items():
+        _, caught = utils.drop_outliers(df, column, min_val, max_val)
+        for index in caught.index:
+            tags[index].add(column)
+        assert counts[column] == len(caught)
+    for column in utils.OUTLIER_RULES:
+        for index in df.index[df[column].isna()]:
+            tags[index].add('missing:' + column)
+        assert counts['missing:' + column] == df[column].isna().sum()
+
+    assert dict((index, set(rules.split(',')))
+                for index, rules in outliers['outlier_rules'].items()) == tags
+    assert tags[12] == {'height_cm', 'iq_score'}
+    assert tags[14] == {'tattoos', 'missing:iq_score'}
+
+    # drop_outliers() dropped rows with missing values without listing them.
+    unlisted = set(df.index) - set(clean.index) - listed
+    assert unlisted == {13, 14, 15}
+    for index in unlisted:
+        assert any(rule.startswith('missing:') for rule in tags[index])
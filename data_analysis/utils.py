@@ -2,11 +2,297 @@
 """
 Functions that help with loading and filtering the data.
 """
+import atexit
+import contextlib
+import functools
+import gzip
 import json
+import os
+import time
+import tracemalloc
+import numpy as np
 import pandas as pd
+import aggregate
+import dataframe_cache
 
 DATA_FILE_NAME = '../data_fetching/sadscore_data.json'
 
+# Responses per DataFrame when streaming.
+CHUNK_SIZE = 100000
+
+# Checkbox questions of every quiz version. They are missing for responses to
+# a version that didn't ask them.
+CHECKBOX_QUESTIONS = [
+    'above_platinum',
+    'always_offer_to_pay',
+    'asian_community_prominent_figure',
+    'church_going',
+    'degree_acceptable',
+    'degree_graduated',
+    'degree_masters',
+    'degree_phd',
+    'degree_waste_of_time',
+    'dress_like_fuccboi',
+    'dropped_out',
+    'english_non_fluent',
+    'english_only',
+    'gpa_acceptable',
+    'instrument_good',
+    'job_unacceptable_not_student',
+    'kpop_dance_sing',
+    'let_the_girl_pay_if_she_wants',
+    'over_10k_instagram',
+    'perfect_vision',
+    'pi_tenth_digit',
+    'racist_against_other_asians',
+    'ripped',
+    'salary_over_100k',
+    'salary_over_200k',
+    'salary_over_80k',
+    'salary_six_figure',
+    'salty_about_paying',
+    'scored_yourself',
+    'sports_varsity_college',
+    'unemployed_not_student',
+]
+
+# How clean_dataframe() stores each column.
+#   dtype: The smallest type that holds every sensible answer. A column only
+#       becomes nullable (boolean, Int16, ...) when some answers are missing,
+#       and is widened when an answer doesn't fit, e.g. to float32 for a
+#       height_cm of 170.5.
+#   fill: What a blank answer counts as. Blank answers stay missing without
+#       one, and so do answers that aren't numbers.
+# Columns not listed keep their type, except text, which becomes categorical.
+SCHEMA = dict((name, {'dtype': 'bool'}) for name in CHECKBOX_QUESTIONS)
+SCHEMA.update({
+    'height_cm': {'dtype': 'int16'},
+    'iq_score': {'dtype': 'int16'},
+    'instruments': {'dtype': 'int8'},
+    'foreign_langauges_fluent': {'dtype': 'int8'},
+    'foreign_langauges_nonfluent': {'dtype': 'int8'},
+    'tattoos': {'dtype': 'int8', 'fill': 0},
+    'attractiveness': {'dtype': 'int8'},
+    'timestamp': {'dtype': 'float64'},
+    'total_score': {'dtype': 'int16'},
+})
+
+# The inclusive (min, max) allowed for each column by drop_all_outliers().
+OUTLIER_RULES = {
+    # Between 4ft and 8ft.
+    'height_cm': (121, 250),
+    'instruments': (0, 20),
+    'iq_score': (0, 200),
+    'foreign_langauges_fluent': (0, 20),
+    'foreign_langauges_nonfluent': (0, 20),
+    'tattoos': (0, 20),
+}
+
+# Set to 1 to print how long each stage took when Python exits, or to a file
+# name ending in .json to write it there.
+PROFILE_ENV = 'SADSCORE_PROFILE'
+
+# The Profiler stages are recorded in. None when profiling is off.
+_profiler = None
+
+
+def count_rows(value):
+    """
+    Args:
+        value (object): What a stage took or returned.
+
+    Returns:
+        int: The number of rows in it. None when it has no length, like an
+            iterator. The first item counts for tuples.
+    """
+    if isinstance(value, tuple) and value:
+        value = value[0]
+    try:
+        return len(value)
+    except TypeError:
+        return None
+
+
+class Profiler:
+    """
+    Records the wall time, CPU time, peak memory and rows in and out of each
+    stage. Stages can run inside other stages, their times are included in
+    the outer stage.
+
+    Attributes:
+        stages (list(dict)): One record per stage run, in the order they
+            started.
+        memory (bool): Whether to measure peak memory with tracemalloc,
+            which makes everything several times slower.
+    """
+
+    def __init__(self, memory=True):
+        self.stages = []
+        self.memory = memory
+        self._stack = []
+        self._started_tracemalloc = False
+
+    def start(self):
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+    def stop(self):
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    @contextlib.contextmanager
+    def stage(self, name, rows_in=None):
+        """
+        Records one run of a stage.
+
+        Args:
+            name (str): The stage.
+            rows_in (int): Optional. Rows the stage was given.
+
+        Yields:
+            dict: The record. Set 'rows_out' on it.
+        """
+        record = {'stage': name, 'depth': len(self._stack),
+                  'rows_in': rows_in, 'rows_out': None}
+        self.stages.append(record)
+
+        # One peak is kept by tracemalloc, so the outer stage takes note of
+        # its peak before it is reset for this one. Without tracemalloc
+        # these are all 0.
+        current, peak = tracemalloc.get_traced_memory()
+        if self._stack:
+            self._stack[-1]['peak'] = max(self._stack[-1]['peak'], peak)
+        tracemalloc.reset_peak()
+        frame = {'start': current, 'peak': current}
+        self._stack.append(frame)
+
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield record
+        finally:
+            record['wall_secs'] = time.perf_counter() - wall
+            record['cpu_secs'] = time.process_time() - cpu
+
+            _, peak = tracemalloc.get_traced_memory()
+            frame['peak'] = max(frame['peak'], peak)
+            if self.memory:
+                record['peak_bytes'] = frame['peak'] - frame['start']
+            self._stack.pop()
+            if self._stack:
+                self._stack[-1]['peak'] = max(self._stack[-1]['peak'],
+                                              frame['peak'])
+
+    def table(self):
+        """
+        Returns:
+            str: The stages as a table, inner stages indented.
+        """
+        row = '{:<34} {:>9} {:>9} {:>10} {:>10} {:>10}'
+        lines = [row.format('stage', 'wall s', 'cpu s', 'peak MB', 'rows in',
+                            'rows out')]
+        for record in self.stages:
+            lines.append(row.format(
+                '  ' * record['depth'] + record['stage'],
+                '{:.3f}'.format(record.get('wall_secs', 0)),
+                '{:.3f}'.format(record.get('cpu_secs', 0)),
+                '' if 'peak_bytes' not in record else
+                '{:.1f}'.format(record['peak_bytes'] / 1e6),
+                '' if record['rows_in'] is None else record['rows_in'],
+                '' if record['rows_out'] is None else record['rows_out']))
+        return '\n'.join(lines)
+
+    def report(self, output=None):
+        """
+        Args:
+            output (str): Optional. A JSON file to write the stages to.
+                Prints the table when not given.
+        """
+        if output is None:
+            print(self.table())
+            return
+        with open(output, 'w') as output_file:
+            json.dump(self.stages, output_file, indent=4)
+
+
+def profiled(name):
+    """
+    Makes a function a stage of the profiler. When profiling is off the
+    function is called straight away, the only cost is checking that.
+
+    Args:
+        name (str): The stage.
+
+    Returns:
+        function: The decorator.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return function(*args, **kwargs)
+
+            rows_in = count_rows(args[0]) if args else None
+            with _profiler.stage(name, rows_in) as record:
+                result = function(*args, **kwargs)
+                record['rows_out'] = count_rows(result)
+            return result
+        return wrapper
+    return decorator
+
+
+@contextlib.contextmanager
+def profile(output=None, memory=True):
+    """
+    Profiles the stages run inside it, then prints them or writes them to
+    a JSON file.
+
+    Example:
+        with utils.profile():
+            df = utils.load_data_dataframe(use_cache=False)
+            df, outliers, counts = utils.drop_all_outliers(df)
+
+    Args:
+        output (str): Optional. A JSON file to write the stages to.
+        memory (bool): Optional. Whether to measure peak memory too.
+
+    Yields:
+        Profiler: The stages recorded so far.
+    """
+    global _profiler
+
+    outer = _profiler
+    profiler = _profiler = Profiler(memory)
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        _profiler = outer
+        profiler.report(output)
+
+
+def profile_from_environment():
+    """
+    Profiles everything until Python exits when PROFILE_ENV is set.
+    """
+    global _profiler
+
+    setting = os.environ.get(PROFILE_ENV)
+    if not setting or setting == '0':
+        return
+
+    output = setting if setting.endswith('.json') else None
+    _profiler = Profiler()
+    _profiler.start()
+    atexit.register(_profiler.report, output)
+
+
+profile_from_environment()
+
+
 def dumps(dict_):
     """
     Converts dictionaries to indented JSON for readability.
@@ -32,6 +318,8 @@ def print_dict(dict_):
 class QuizResponse:
     """
     Wraps each individual response dictionary so that it is easier to access.
+    Nothing is copied until it is used, see ResponseTable for loading many
+    responses at once.
 
     Attributes:
         data (dict): The raw quiz response data.
@@ -39,12 +327,27 @@ class QuizResponse:
         total_score (int): The total score of this response.
         responses (dict): Just the quiz question and value recorded.
     """
+    __slots__ = ['data', '_responses']
 
     def __init__(self, resp_data):
         self.data = resp_data
-        self.timestamp = resp_data['timestamp_secs']
-        self.total_score = resp_data['total_score']
-        self.responses = QuizResponse.filter_questions(resp_data['responses'])
+        self._responses = None
+
+    @property
+    def timestamp(self):
+        return self.data['timestamp_secs']
+
+    @property
+    def total_score(self):
+        return self.data['total_score']
+
+    @property
+    def responses(self):
+        # Built on first use and kept, so changes to it stick.
+        if self._responses is None:
+            self._responses = QuizResponse.filter_questions(
+                self.data['responses'])
+        return self._responses
 
     def __repr__(self):
         return 'QuizResponse(\n' + dumps(self.responses) + '\n)'
@@ -79,6 +382,92 @@ class QuizResponse:
         return new_questions
 
 
+class ResponseTable:
+    """
+    Quiz responses stored as one list of values per question, built straight
+    from the raw documents in one pass.
+
+    Attributes:
+        columns (dict(str->list)): The values of each question, plus
+            'timestamp' and 'total_score'. Questions a response didn't answer
+            are NaN.
+        documents (list(dict)): The raw documents, in the same order.
+    """
+
+    def __init__(self, columns, documents):
+        self.columns = columns
+        self.documents = documents
+
+    def __len__(self):
+        return len(self.documents)
+
+    def __getitem__(self, index):
+        """
+        Args:
+            index (int): The row.
+
+        Returns:
+            QuizResponse: A view of that response.
+        """
+        return QuizResponse(self.documents[index])
+
+    @staticmethod
+    @profiled('ResponseTable.from_documents')
+    def from_documents(data):
+        """
+        Flattens raw documents into columns. The document that just stores the
+        count of responses is skipped.
+
+        Args:
+            data (list(dict)): The nested dictionaries to be converted.
+
+        Returns:
+            ResponseTable: The responses as columns.
+        """
+        columns = {}
+        documents = []
+        row = 0
+        for document in data:
+            # There is one dictionary that just stores the count of responses.
+            if 'responses' not in document:
+                continue
+
+            for key, question in document['responses'].items():
+                column = columns.get(key)
+                if column is None:
+                    column = columns[key] = []
+                if len(column) < row:
+                    column.extend([np.nan] * (row - len(column)))
+                column.append(question['value'])
+
+            for key, field in (('timestamp', 'timestamp_secs'),
+                               ('total_score', 'total_score')):
+                column = columns.get(key)
+                if column is None:
+                    column = columns[key] = []
+                if len(column) < row:
+                    column.extend([np.nan] * (row - len(column)))
+                column.append(document[field])
+
+            documents.append(document)
+            row += 1
+
+        # Pad questions the last responses didn't answer.
+        for column in columns.values():
+            if len(column) < row:
+                column.extend([np.nan] * (row - len(column)))
+
+        return ResponseTable(columns, documents)
+
+    def to_dataframe(self):
+        """
+        Returns:
+            pandas.DataFrame: One row per response, one column per question.
+        """
+        return pd.DataFrame(self.columns)
+
+
+@profiled('load_data')
 def load_data():
     """
     Loads the JSON data as a dictionary.
@@ -91,6 +480,104 @@ def load_data():
     
     return data
 
+def iter_documents(file_name=None, buffer_size=1 << 16):
+    """
+    Reads the documents one at a time instead of loading the whole file.
+    Works with a JSON array (download_mongo_db.py) or newline delimited JSON
+    (download_mongo_db.py --ndjson), gzipped or not.
+
+    Args:
+        file_name (str): Optional. Defaults to DATA_FILE_NAME.
+        buffer_size (int): Optional. Characters read at a time.
+
+    Yields:
+        dict: Each document.
+    """
+    if file_name is None:
+        file_name = DATA_FILE_NAME
+
+    opener = gzip.open if file_name.endswith('.gz') else open
+    decoder = json.JSONDecoder()
+
+    with opener(file_name, 'rt') as input_file:
+        buffer = ''
+        pos = 0
+        eof = False
+        in_array = None
+
+        while True:
+            # Skip whitespace and commas between documents.
+            while True:
+                while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                    pos += 1
+                if pos < len(buffer) or eof:
+                    break
+                buffer = input_file.read(buffer_size)
+                pos = 0
+                eof = not buffer
+
+            if pos >= len(buffer):
+                return
+
+            # A JSON array is opened once, NDJSON never is.
+            if in_array is None:
+                in_array = buffer[pos] == '['
+                if in_array:
+                    pos += 1
+                    continue
+
+            if in_array and buffer[pos] == ']':
+                return
+
+            try:
+                document, pos = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                if eof:
+                    raise
+                # The document doesn't fit in the buffer yet, read more.
+                chunk = input_file.read(max(buffer_size, len(buffer)))
+                eof = not chunk
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+
+            yield document
+
+def iter_dataframes(chunk_size=CHUNK_SIZE, file_name=None):
+    """
+    Loads the data as dataframes of a few responses at a time, cleaned the
+    same way as load_data_dataframe(). Only one chunk is in memory at once.
+
+    Args:
+        chunk_size (int): Optional. Responses per dataframe.
+        file_name (str): Optional. Defaults to DATA_FILE_NAME.
+
+    Yields:
+        pandas.DataFrame: The next responses. The index carries on from the
+            previous chunk.
+    """
+    offset = 0
+    batch = []
+    documents = iter_documents(file_name)
+    while True:
+        for document in documents:
+            batch.append(document)
+            if len(batch) >= chunk_size:
+                break
+
+        if not batch:
+            return
+
+        df = ResponseTable.from_documents(batch).to_dataframe()
+        batch = []
+        if len(df) == 0:
+            continue
+
+        df.index = pd.RangeIndex(offset, offset + len(df))
+        offset += len(df)
+        yield clean_dataframe(df)
+
+@profiled('filter')
 def filter(data):
     """
     Runs through all the data, creates QuizResponse objects, and puts them in a
@@ -111,6 +598,7 @@ def filter(data):
         filtered.append(qr)
     return filtered
 
+@profiled('create_dataframe')
 def create_dataframe(data):
     """
     Create a DataFrame from our data for easier manipulation.
@@ -124,49 +612,180 @@ def create_dataframe(data):
     df = pd.DataFrame(data)
     return df
 
-def load_data_dataframe():
+@profiled('load_data_dataframe')
+def load_data_dataframe(refresh=False, use_cache=True):
     """
-    Loads data as dataframe.
+    Loads data as dataframe. The finished dataframe is cached on disk next to
+    the data file and reused until the data file changes.
+
+    Args:
+        refresh (bool): Optional. Whether to rebuild the cached dataframe even
+            if the data file hasn't changed.
+        use_cache (bool): Optional. Whether to use the on-disk cache at all.
+
+    Returns:
+        pandas.DataFrame: The data loaded as dataframe.
+    """
+    if not use_cache:
+        return build_dataframe()
+
+    return dataframe_cache.cached(DATA_FILE_NAME, build_dataframe,
+                                  refresh=refresh)
+
+@profiled('build_dataframe')
+def build_dataframe():
+    """
+    Builds the dataframe from the data file.
 
     Returns:
         pandas.DataFrame: The data loaded as dataframe.
     """
     data = load_data()
-    data = filter(data)
+    df = ResponseTable.from_documents(data).to_dataframe()
 
-    # Just use the list of responses for each QuizReponse object.
-    responses = []
-    for response in data:
-        response_dict = response.responses
-        response_dict['timestamp'] = response.timestamp
-        response_dict['total_score'] = response.total_score
+    return clean_dataframe(df)
+
+@profiled('clean_dataframe')
+def clean_dataframe(df):
+    """
+    Stores every column with the type declared in SCHEMA. The number
+    questions are sent as strings.
+
+    Args:
+        df (pandas.DataFrame): The responses, one column per question.
 
-        responses.append(response)
-    just_list = [ r.responses for r in data]
+    Returns:
+        pandas.DataFrame: A new dataframe with the declared types.
+    """
+    return apply_schema(df)
 
-    df = create_dataframe(just_list)
+def to_boolean(column):
+    """
+    Args:
+        column (pandas.Series): Checkbox answers, missing where not asked.
 
-    # Columns to convert to numeric types.
-    numeric_columns = [
-        'foreign_langauges_fluent',
-        'foreign_langauges_nonfluent',
-        'height_cm',
-        'instruments',
-        'iq_score',
-        'attractiveness'
-    ]
+    Returns:
+        pandas.Series: The answers as bool, or boolean when some are missing.
+    """
+    if column.isna().any():
+        return column.astype('boolean')
+    return column.astype(bool)
 
-    # Fix strings to numeric values.
-    for column in numeric_columns:
-        df[column] = pd.to_numeric(df[column])
+def to_integer(column, dtype, fill=None):
+    """
+    Converts numbers to the smallest integer type, starting from dtype, that
+    holds them all.
 
-    # Convert tattoos column to numeric and fill NaN with 0's.
-    column = 'tattoos'
-    df[column] = pd.to_numeric(df[column])
-    df[column].fillna(0)
+    Args:
+        column (pandas.Series): The answers, as numbers or strings.
+        dtype (str): The smallest integer type to use.
+        fill (int): Optional. What to use for blank answers.
 
+    Returns:
+        pandas.Series: The answers as integers, nullable when some are
+            missing. Floats when some aren't whole numbers, see to_float().
+    """
+    numbers = pd.to_numeric(column, errors='coerce')
+    if fill is not None:
+        numbers = numbers.fillna(fill)
+
+    values = numbers.to_numpy(dtype=np.float64, na_value=np.nan)
+    missing = np.isnan(values)
+    present = values[~missing]
+
+    if not np.array_equal(present, np.trunc(present)):
+        return to_float(values, column.index)
+
+    widths = ['int8', 'int16', 'int32', 'int64']
+    for each_dtype in widths[widths.index(dtype):]:
+        info = np.iinfo(each_dtype)
+        if len(present) == 0 or (present.min() >= info.min and
+                                 present.max() <= info.max):
+            break
+    else:
+        return to_float(values, column.index)
+
+    integers = np.where(missing, 0, values).astype(each_dtype)
+    if missing.any():
+        return pd.Series(pd.arrays.IntegerArray(integers, missing),
+                         index=column.index)
+    return pd.Series(integers, index=column.index)
+
+def to_float(values, index):
+    """
+    Args:
+        values (numpy.ndarray): Numbers, NaN where missing.
+        index (pandas.Index): Their index.
 
-    return df
+    Returns:
+        pandas.Series: The numbers as float32 when that keeps them exact,
+            float64 otherwise.
+    """
+    single = values.astype(np.float32)
+    if np.array_equal(single, values, equal_nan=True):
+        values = single
+    return pd.Series(values, index=index)
+
+def apply_schema(df, schema=None):
+    """
+    Converts every column to the type declared for it, all in one step.
+
+    Args:
+        df (pandas.DataFrame): The responses, one column per question.
+        schema (dict(str->dict)): Optional. Defaults to SCHEMA.
+
+    Returns:
+        pandas.DataFrame: A new dataframe with the declared types.
+    """
+    if schema is None:
+        schema = SCHEMA
+
+    columns = {}
+    for name in df.columns:
+        column = df[name]
+        rule = schema.get(name)
+        if rule is None:
+            if column.dtype == object:
+                column = column.astype('category')
+        elif rule['dtype'] == 'bool':
+            column = to_boolean(column)
+        elif rule['dtype'].startswith('int'):
+            column = to_integer(column, rule['dtype'], rule.get('fill'))
+        else:
+            column = pd.to_numeric(column, errors='coerce')
+            if rule.get('fill') is not None:
+                column = column.fillna(rule['fill'])
+            column = column.astype(rule['dtype'])
+        columns[name] = column
+
+    return pd.DataFrame(columns, index=df.index)
+
+def memory_report(df=None):
+    """
+    Shows how much memory each column takes before and after apply_schema().
+
+    Args:
+        df (pandas.DataFrame): Optional. The responses before cleaning.
+            Defaults to the data file flattened with ResponseTable.
+
+    Returns:
+        pandas.DataFrame: The type and bytes of each column before and after,
+            with the totals in the last row.
+    """
+    if df is None:
+        df = ResponseTable.from_documents(load_data()).to_dataframe()
+    clean = apply_schema(df)
+
+    report = pd.DataFrame({
+        'dtype_before': df.dtypes.astype(str),
+        'bytes_before': df.memory_usage(deep=True, index=False),
+        'dtype_after': clean.dtypes.astype(str),
+        'bytes_after': clean.memory_usage(deep=True, index=False),
+    })
+    report.loc['total'] = ['', report['bytes_before'].sum(), '',
+                           report['bytes_after'].sum()]
+    report['ratio'] = report['bytes_before'] / report['bytes_after']
+    return report
 
 def turn_off_scientific_notation():
     """
@@ -188,70 +807,114 @@ def drop_outliers(df, column_name, min_val, max_val):
         pandas.DataFrame: The same dataframe, but with outliers removed.
     """
 
-    # Find the outliers.
-    max_outliers = df[df[column_name] > max_val]
-    min_outliers = df[df[column_name] < min_val]
+    # Find the outliers. Missing values compare as False.
+    max_outliers = df[df[column_name].gt(max_val).fillna(False)]
+    min_outliers = df[df[column_name].lt(min_val).fillna(False)]
     outliers = pd.concat([max_outliers,min_outliers])
     
     # Drop the outliers.
-    df = df[df[column_name] <= max_val]
-    df = df[df[column_name] >= min_val]
+    df = df[df[column_name].le(max_val).fillna(False)]
+    df = df[df[column_name].ge(min_val).fillna(False)]
 
     return df, outliers
 
-def drop_all_outliers(df):
+def apply_outlier_rules(df, rules=None):
     """
-    Drops all outliers.
+    Checks every rule in one pass: the columns of the rules are compared
+    against all of their ranges at once, so adding a rule doesn't add a pass
+    over the data. Rules for columns that aren't in the data are skipped.
+
+    A missing value isn't out of range, but drop_outliers() never kept it
+    either. Those rows are dropped too and tagged missing:<column> instead
+    of with the rule, so they can be told apart from real outliers.
 
     Args:
-        df (pandas.DataFrame): The data to filter out outliers from.
-    
+        df (pandas.DataFrame): The data to filter.
+        rules (dict(str->tuple)): Optional. The inclusive (min, max) allowed
+            in each column. Defaults to OUTLIER_RULES.
+
     Returns:
-        pandas.DataFrame: The same data without outliers.
+        pandas.DataFrame: The data without outliers or missing values.
+        pandas.DataFrame: The outliers, each once, with the rules they broke
+            and the columns they miss in an outlier_rules column, comma
+            separated.
+        pandas.Series: How many rows broke each rule, then how many miss
+            each column under missing:<column>.
+    """
+    if rules is None:
+        rules = OUTLIER_RULES
+
+    columns = [column for column in rules if column in df.columns]
+    lows = np.array([rules[column][0] for column in columns], dtype=np.float64)
+    highs = np.array([rules[column][1] for column in columns], dtype=np.float64)
+
+    values = df[columns].to_numpy(dtype=np.float64, na_value=np.nan)
+    missing = np.isnan(values)
+    with np.errstate(invalid='ignore'):
+        out_of_range = ~((values >= lows) & (values <= highs)) & ~missing
+
+    tag_names = columns + ['missing:' + column for column in columns]
+    broken = np.hstack([out_of_range, missing])
+    is_outlier = broken.any(axis=1)
+    counts = pd.Series(broken.sum(axis=0), index=tag_names, dtype=np.int64)
+
+    # Tag each distinct combination of broken rules once, not each row. A
+    # combination is the bits of the rules it broke.
+    bits = broken[is_outlier].dot(
+        1 << np.arange(len(tag_names), dtype=np.int64))
+    combinations, inverse = np.unique(bits, return_inverse=True)
+    tags = np.array([','.join(name for i, name in enumerate(tag_names)
+                              if combination >> i & 1)
+                     for combination in combinations], dtype=object)
+    outliers = df[is_outlier].assign(outlier_rules=tags[inverse])
+
+    return df[~is_outlier], outliers, counts
+
+@profiled('drop_all_outliers')
+def drop_all_outliers(df, on_outliers=None):
     """
+    Drops all outliers, see OUTLIER_RULES and apply_outlier_rules().
 
-    # Keep heights between 4ft and 8ft.
-    df, outliers_height = drop_outliers(df, 'height_cm', 121, 250)
+    Example:
+        outliers = []
+        frames = drop_all_outliers(iter_dataframes(), outliers.append)
+        averages = column_averages(frames)
 
-    # Drop Instruments outliers.
-    df, outliers_instruments = drop_outliers(df, 'instruments', 0, 20)
-    
-    # Drop IQ Score outliers.
-    df, outliers_iq_score = drop_outliers(df, 'iq_score', 0, 200)
-
-    # Drop fluent languages outliers.
-    df, outliers_foreign_langauges_fluent = drop_outliers(
-                                            df, 
-                                            'foreign_langauges_fluent',
-                                            0,
-                                            20)
-    
-    # Drop non-fluent languages outliers.
-    df, outliers_foreign_langauges_nonfluent = drop_outliers(
-                                                df,
-                                                'foreign_langauges_nonfluent',
-                                                0,
-                                                20)
-
-    # Drop non-fluent languages outliers.
-    df, outliers_tattoos = drop_outliers(
-                                                df,
-                                                'tattoos',
-                                                0,
-                                                20)
-
-    # Combine outliers
-    outliers = pd.concat(
-                [
-                    outliers_height,
-                    outliers_instruments,
-                    outliers_iq_score,
-                    outliers_foreign_langauges_fluent,
-                    outliers_foreign_langauges_nonfluent,
-                    outliers_tattoos
-                ])
+    Args:
+        df (pandas.DataFrame): The data to filter out outliers from. Can also
+            be an iterator of dataframes, like from iter_dataframes().
+        on_outliers (function): Optional. For an iterator, called with the
+            outliers of each dataframe as it is filtered.
+
+    Returns:
+        pandas.DataFrame: The same data without outliers. For an iterator, a
+            generator of each dataframe without outliers instead, and
+            nothing else.
+        pandas.DataFrame: The outliers, with the rules they broke in an
+            outlier_rules column.
+        pandas.Series: How many rows broke each rule.
+    """
+    if not isinstance(df, pd.DataFrame):
+        return iter_without_outliers(df, on_outliers)
+
+    return apply_outlier_rules(df)
+
+def iter_without_outliers(frames, on_outliers=None):
+    """
+    Args:
+        frames (iterator(pandas.DataFrame)): The data, a dataframe at a time.
+        on_outliers (function): Optional. Called with the outliers of each
+            dataframe.
+
+    Yields:
+        pandas.DataFrame: Each dataframe without outliers.
+    """
+    for chunk in frames:
+        chunk, outliers, _ = drop_all_outliers(chunk)
+        if on_outliers is not None:
+            on_outliers(outliers)
+        yield chunk
 
-    return df, outliers
 
 def drop_total_score_outliers(df):
     return drop_outliers(
@@ -261,13 +924,46 @@ def drop_total_score_outliers(df):
                         1000)
 
 
+@profiled('column_averages')
+def column_averages(df):
+    """
+    Averages every column over all rows, counting missing values as 0.
+
+    Args:
+        df (pandas.DataFrame): The data. Can also be an iterator of
+            dataframes, like from iter_dataframes(), which are added up one
+            at a time.
+
+    Returns:
+        pandas.Series: The average of each column.
+    """
+    return aggregate.aggregate(df).averages()
+
+def histogram_edges(bins=10, rules=None):
+    """
+    Bin edges spread evenly over the range each outlier rule allows, so
+    histograms of data without outliers can be counted a chunk at a time.
+
+    Args:
+        bins (int): Optional. Number of bins.
+        rules (dict(str->tuple)): Optional. Defaults to OUTLIER_RULES.
+
+    Returns:
+        dict(str->numpy.ndarray): The bin edges of each column, for
+            aggregate.aggregate().
+    """
+    if rules is None:
+        rules = OUTLIER_RULES
+    return dict((name, np.linspace(min_val, max_val, bins + 1))
+                for name, (min_val, max_val) in rules.items())
+
 def main():
-    df = load_data_dataframe()
     turn_off_scientific_notation()
-    df, outliers = drop_all_outliers(df)
-    sums = df.sum()
-    count = df.shape[0]
-    averages = sums / count
+
+    # A chunk of the data file at a time, never all of it.
+    outliers = []
+    frames = drop_all_outliers(iter_dataframes(), outliers.append)
+    averages = column_averages(frames)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -2,8 +2,12 @@
 """
 Downloads the all the survey responses from the database.
 """
+import datetime
+import gzip
+import json
+import os
 from pymongo import MongoClient
-from json import dump, JSONEncoder
+from json import JSONEncoder
 from bson import ObjectId
 
 # Database credentials.
@@ -11,6 +15,14 @@ USER = ''
 PASSWORD = ''
 MONGO_DATABASE = 'mongodb://{}:{}@ds137749.mlab.com:37749/sadscore'.format(USER, PASSWORD)
 DATA_FILE = 'sadscore_data.json'
+NDJSON_DATA_FILE = 'sadscore_data.ndjson'
+
+# Documents fetched from the database per round trip.
+BATCH_SIZE = 1000
+
+# Incremental exports leave out documents newer than this, so a document
+# inserted late with an older _id isn't skipped.
+LAG_SECS = 60
 
 
 class MyJSONEncoder(JSONEncoder):
@@ -40,32 +52,363 @@ def connect_db():
     return client
 
 
-def grab_data():
+def open_output(file_name, compress=False):
+    """
+    Opens a file to write text to.
+
+    Args:
+        file_name (str): The file to write.
+        compress (bool): Optional. Whether to gzip the file.
+
+    Returns:
+        file: The opened file.
+    """
+    if compress:
+        return gzip.open(file_name, 'wt')
+    return open(file_name, 'w+')
+
+
+def write_ndjson(documents, output_file):
+    """
+    Writes documents as newline delimited JSON, one document per line, as
+    they come in.
+
+    Args:
+        documents (iterable(dict)): The documents to write.
+        output_file (file): Where to write them.
+
+    Returns:
+        int: The number of documents written.
+    """
+    encoder = MyJSONEncoder(sort_keys=True, separators=(',', ':'))
+    count = 0
+    for document in documents:
+        output_file.write(encoder.encode(document))
+        output_file.write('\n')
+        count += 1
+    return count
+
+
+def write_json_array(documents, output_file):
+    """
+    Writes documents as one indented JSON array, as they come in. The output
+    is the same as json.dump(list(documents), indent=4, sort_keys=True).
+
+    Args:
+        documents (iterable(dict)): The documents to write.
+        output_file (file): Where to write them.
+
+    Returns:
+        int: The number of documents written.
+    """
+    encoder = MyJSONEncoder(indent=4, sort_keys=True)
+    count = 0
+    for document in documents:
+        output_file.write('[\n' if count == 0 else ',\n')
+
+        # Indent the document one level to sit inside the array.
+        encoded = encoder.encode(document)
+        output_file.write('    ' + encoded.replace('\n', '\n    '))
+        count += 1
+
+    output_file.write('[]' if count == 0 else '\n]')
+    return count
+
+
+def window_query(since=None, until=None):
+    """
+    Args:
+        since (float): Optional. The first timestamp_secs to export.
+        until (float): Optional. Only export timestamp_secs before this.
+
+    Returns:
+        dict: The query for responses in the time window, which the
+            timestamp_secs index (see server/schema.py) answers with a range
+            scan. Everything when neither is given.
+    """
+    window = {}
+    if since is not None:
+        window['$gte'] = since
+    if until is not None:
+        window['$lt'] = until
+    if not window:
+        return {}
+    return {'timestamp_secs': window}
+
+
+def grab_data(data_file_name=None, ndjson=False, compress=False,
+              batch_size=BATCH_SIZE, fields=None, since=None, until=None):
     """
     Fetches the reponses from the database and saves it into a JSON file.
+    Documents are written as the cursor returns them, so memory use doesn't
+    grow with the size of the collection.
+
+    Args:
+        data_file_name (str): Optional. The file to write. Defaults to
+            DATA_FILE, or NDJSON_DATA_FILE when ndjson is set.
+        ndjson (bool): Optional. Whether to write one document per line
+            instead of one JSON array.
+        compress (bool): Optional. Whether to gzip the file.
+        batch_size (int): Optional. Documents fetched per round trip.
+        fields (list(str)): Optional. Only export these fields (and _id).
+        since (float): Optional. See window_query().
+        until (float): Optional. See window_query().
+
+    Returns:
+        int: The number of documents written.
     """
+    if data_file_name is None:
+        data_file_name = NDJSON_DATA_FILE if ndjson else DATA_FILE
+        if compress:
+            data_file_name += '.gz'
+
+    projection = None
+    if fields:
+        projection = dict((field, True) for field in fields)
 
     # Connect to database and get all documents from the collection.
     client = connect_db()
     db = client.sadscore
     collection = db.responses_men
-    cursor = collection.find({})
-    count = 0
+    cursor = collection.find(window_query(since, until), projection,
+                             batch_size=batch_size)
 
     # Save the documents as a JSON file.
-    documents = []
-    with open(DATA_FILE, 'w+') as data_file:
+    write = write_ndjson if ndjson else write_json_array
+    with open_output(data_file_name, compress) as data_file:
+        count = write(cursor, data_file)
+
+        print("Wrote {} documents".format(count))
+    client.close()
+
+    return count
+
+
+def load_checkpoint(checkpoint_file_name):
+    """
+    Loads the checkpoint of the last incremental export.
+
+    Args:
+        checkpoint_file_name (str): The checkpoint file.
+
+    Returns:
+        dict: The checkpoint. None when there isn't one.
+    """
+    if not os.path.exists(checkpoint_file_name):
+        return None
+
+    with open(checkpoint_file_name) as checkpoint_file:
+        checkpoint = json.load(checkpoint_file)
+
+    if checkpoint['last_id'] is not None:
+        checkpoint['last_id'] = ObjectId(checkpoint['last_id'])
+    return checkpoint
+
+
+def save_checkpoint(checkpoint_file_name, checkpoint):
+    """
+    Saves the checkpoint. Written to a temporary file first and then renamed,
+    so a crash never leaves half a checkpoint.
+
+    Args:
+        checkpoint_file_name (str): The checkpoint file.
+        checkpoint (dict): The _id of the last document exported, how many
+            documents and how many bytes of the data file they take.
+    """
+    temp_file_name = checkpoint_file_name + '.tmp'
+    with open(temp_file_name, 'w') as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file, cls=MyJSONEncoder,
+                  indent=4, sort_keys=True)
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+    os.replace(temp_file_name, checkpoint_file_name)
+
+
+def needs_full_resync(collection, data_file_name, checkpoint):
+    """
+    Checks whether the local data can be appended to. Anything a crashed run
+    wrote after its last checkpoint doesn't count against it, the caller
+    cuts that off before appending.
+
+    Args:
+        collection (pymongo.collection.Collection): The collection exported.
+        data_file_name (str): The local NDJSON data file.
+        checkpoint (dict): The last checkpoint. May be None.
+
+    Returns:
+        str: Why everything has to be downloaded again. None when only the
+            new documents are needed.
+    """
+    if checkpoint is None:
+        return "No checkpoint."
+    if not os.path.exists(data_file_name):
+        return "Data file is missing."
+
+    size = os.path.getsize(data_file_name)
+    if size < checkpoint['bytes']:
+        return "Data file is shorter than the checkpoint."
+
+    # Documents removed or backfilled behind the checkpoint.
+    if checkpoint['last_id'] is not None:
+        count = collection.count_documents(
+            {'_id': {'$type': 'objectId', '$lte': checkpoint['last_id']}})
+        if count != checkpoint['count']:
+            return "{} documents up to the checkpoint, expected {}.".format(
+                count, checkpoint['count'])
+
+    return None
+
+
+def commit_checkpoint(data_file, checkpoint_file_name, checkpoint):
+    """
+    Makes sure everything written so far is on disk, then saves the
+    checkpoint that covers it.
+
+    Args:
+        data_file (file): The data file being appended to.
+        checkpoint_file_name (str): The checkpoint file.
+        checkpoint (dict): The checkpoint to save.
+    """
+    data_file.flush()
+    os.fsync(data_file.fileno())
+    checkpoint['bytes'] = data_file.tell()
+    save_checkpoint(checkpoint_file_name, checkpoint)
+
+
+def grab_new_data(data_file_name=NDJSON_DATA_FILE, batch_size=BATCH_SIZE,
+                  lag_secs=LAG_SECS, full_resync=False):
+    """
+    Fetches only the responses added since the last run and appends them to
+    the NDJSON data file. A checkpoint is saved after every batch, so a run
+    that crashes picks up where it left off. Falls back to downloading
+    everything when the local data doesn't match the database anymore.
+
+    Args:
+        data_file_name (str): Optional. The NDJSON file to append to.
+        batch_size (int): Optional. Documents fetched per round trip and
+            written between checkpoints.
+        lag_secs (int): Optional. Leave out documents newer than this.
+        full_resync (bool): Optional. Whether to download everything again.
+
+    Returns:
+        int: The number of documents written.
+    """
+    checkpoint_file_name = data_file_name + '.checkpoint'
+
+    client = connect_db()
+    db = client.sadscore
+    collection = db.responses_men
+
+    checkpoint = load_checkpoint(checkpoint_file_name)
+    reason = "Asked for." if full_resync else needs_full_resync(
+        collection, data_file_name, checkpoint)
+    if reason is not None:
+        print("Full resync: {}".format(reason))
+        checkpoint = {'last_id': None, 'count': 0, 'bytes': 0}
+        open(data_file_name, 'w').close()
+        save_checkpoint(checkpoint_file_name, checkpoint)
+    elif os.path.getsize(data_file_name) > checkpoint['bytes']:
+        # The last run crashed after writing, drop what it didn't checkpoint.
+        with open(data_file_name, 'r+') as data_file:
+            data_file.truncate(checkpoint['bytes'])
+
+    # Only real responses have ObjectIds, so the counter document of a
+    # database that wasn't migrated is skipped.
+    newest = (datetime.datetime.now(datetime.timezone.utc)
+              - datetime.timedelta(seconds=lag_secs))
+    id_range = {'$type': 'objectId', '$lt': ObjectId.from_datetime(newest)}
+    if checkpoint['last_id'] is not None:
+        id_range['$gt'] = checkpoint['last_id']
+
+    cursor = collection.find({'_id': id_range}, batch_size=batch_size)
+    cursor = cursor.sort('_id', 1)
+
+    encoder = MyJSONEncoder(sort_keys=True, separators=(',', ':'))
+    count = 0
+    with open(data_file_name, 'a') as data_file:
         for document in cursor:
-            documents.append(document)
+            data_file.write(encoder.encode(document))
+            data_file.write('\n')
+            checkpoint['last_id'] = document['_id']
+            checkpoint['count'] += 1
             count += 1
-        dump(documents, data_file, cls=MyJSONEncoder, indent=4, sort_keys=True)
 
-        print("Wrote {} documents".format(count))
+            if count % batch_size == 0:
+                commit_checkpoint(data_file, checkpoint_file_name, checkpoint)
+
+        commit_checkpoint(data_file, checkpoint_file_name, checkpoint)
+
+    print("Wrote {} new documents, {} in total".format(
+        count, checkpoint['count']))
     client.close()
 
-def main():
-    grab_data()
+    return count
+
+
+def main(args):
+    if args.incremental:
+        grab_new_data(
+            data_file_name=args.output or NDJSON_DATA_FILE,
+            batch_size=args.batch_size,
+            lag_secs=args.lag_secs,
+            full_resync=args.full_resync)
+        return
+
+    grab_data(
+        data_file_name=args.output,
+        ndjson=args.ndjson,
+        compress=args.gzip,
+        batch_size=args.batch_size,
+        fields=args.fields,
+        since=args.since,
+        until=args.until)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+
+    parser.add_argument('-o', '--output',
+                        help="The file to write the documents to.",
+                        default=None)
+    parser.add_argument('--ndjson',
+                        help="Write one document per line instead of an array.",
+                        default=False,
+                        action='store_true')
+    parser.add_argument('--gzip',
+                        help="Whether to gzip the output file.",
+                        default=False,
+                        action='store_true')
+    parser.add_argument('--batch_size',
+                        help="Documents fetched from the database at a time.",
+                        type=int,
+                        default=BATCH_SIZE)
+    parser.add_argument('--incremental',
+                        help="Only append documents added since the last run.",
+                        default=False,
+                        action='store_true')
+    parser.add_argument('--full_resync',
+                        help="With --incremental, download everything again.",
+                        default=False,
+                        action='store_true')
+    parser.add_argument('--lag_secs',
+                        help="With --incremental, leave out newer documents.",
+                        type=int,
+                        default=LAG_SECS)
+    parser.add_argument('--fields',
+                        help="Only export these fields.",
+                        nargs='+',
+                        default=None)
+    parser.add_argument('--since',
+                        help="Only export responses from this timestamp_secs "
+                             "on.",
+                        type=float,
+                        default=None)
+    parser.add_argument('--until',
+                        help="Only export responses before this "
+                             "timestamp_secs.",
+                        type=float,
+                        default=None)
+
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Exports every collection in parallel.
+
+Large collections are split into _id ranges by the time their ObjectIds were
+generated, and a thread pool scans the ranges at the same time. Each range is
+written to its own NDJSON shard and a manifest lists every shard, so the
+shards can be merged back into one file per collection afterwards.
+
+Example:
+    python parallel_export.py --workers 8 --output_dir export
+    python parallel_export.py --merge export/manifest.json
+"""
+import datetime
+import gzip
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from bson import ObjectId
+from download_mongo_db import (BATCH_SIZE, MyJSONEncoder, connect_db,
+                               open_output, write_json_array, write_ndjson)
+
+COLLECTIONS = ['responses_men', 'responses_women', 'visits', 'counters']
+MANIFEST_FILE = 'manifest.json'
+
+# Collections smaller than this are exported in one piece.
+MIN_PARTITION_SIZE = 10000
+
+
+def id_ranges(collection, partitions):
+    """
+    Splits a collection into _id ranges covering equal spans of time.
+
+    Args:
+        collection (pymongo.collection.Collection): The collection to split.
+        partitions (int): How many ranges to make.
+
+    Returns:
+        list(dict): One query per range, in _id order. The first one holds
+            the documents without an ObjectId, like the counter document of
+            a database that wasn't migrated (see server/schema.py).
+    """
+    queries = [{'_id': {'$not': {'$type': 'objectId'}}}]
+    object_ids = {'_id': {'$type': 'objectId'}}
+
+    first = collection.find_one(object_ids, {'_id': True}, sort=[('_id', 1)])
+    last = collection.find_one(object_ids, {'_id': True}, sort=[('_id', -1)])
+    if first is None:
+        return queries
+
+    small = collection.estimated_document_count() < MIN_PARTITION_SIZE
+    if partitions < 2 or small:
+        queries.append(object_ids)
+        return queries
+
+    start = first['_id'].generation_time
+    span = (last['_id'].generation_time - start).total_seconds()
+    step = max(span / partitions, 1)
+
+    bounds = []
+    for i in range(1, partitions):
+        bound = start + datetime.timedelta(seconds=step * i)
+        if bound >= last['_id'].generation_time:
+            break
+        bounds.append(ObjectId.from_datetime(bound))
+
+    lower = None
+    for upper in bounds + [None]:
+        id_range = {'$type': 'objectId'}
+        if lower is not None:
+            id_range['$gte'] = lower
+        if upper is not None:
+            id_range['$lt'] = upper
+        queries.append({'_id': id_range})
+        lower = upper
+
+    return queries
+
+
+def export_partition(collection, query, shard_file_name, batch_size,
+                     compress):
+    """
+    Exports one range of a collection to its own shard.
+
+    Args:
+        collection (pymongo.collection.Collection): The collection.
+        query (dict): Which documents to export.
+        shard_file_name (str): The NDJSON file to write.
+        batch_size (int): Documents fetched per round trip.
+        compress (bool): Whether to gzip the shard.
+
+    Returns:
+        dict: The manifest entry of the shard.
+    """
+    cursor = collection.find(query, batch_size=batch_size).sort('_id', 1)
+    with open_output(shard_file_name, compress) as shard_file:
+        count = write_ndjson(cursor, shard_file)
+
+    return {
+        'file': os.path.basename(shard_file_name),
+        'query': query,
+        'count': count
+    }
+
+
+def export_all(output_dir, workers=4, partitions=None, collections=None,
+               batch_size=BATCH_SIZE, compress=False, client=None):
+    """
+    Exports every collection, scanning ranges of each at the same time.
+
+    Args:
+        output_dir (str): Where to write the shards and the manifest.
+        workers (int): Optional. Number of ranges scanned at once.
+        partitions (int): Optional. Ranges per collection. Defaults to the
+            number of workers.
+        collections (list(str)): Optional. Defaults to COLLECTIONS.
+        batch_size (int): Optional. Documents fetched per round trip.
+        compress (bool): Optional. Whether to gzip the shards.
+        client (MongoClient): Optional. Connects with connect_db() when not
+            given.
+
+    Returns:
+        dict: The manifest.
+    """
+    if partitions is None:
+        partitions = workers
+    if collections is None:
+        collections = COLLECTIONS
+
+    own_client = client is None
+    if own_client:
+        client = connect_db()
+    db = client.sadscore
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    extension = '.ndjson.gz' if compress else '.ndjson'
+    start = time.time()
+
+    # MongoClient is thread safe, every worker shares its connection pool.
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for collection_name in collections:
+            collection = db[collection_name]
+            futures[collection_name] = []
+            for i, query in enumerate(id_ranges(collection, partitions)):
+                shard_file_name = os.path.join(
+                    output_dir,
+                    '{}.{:04d}{}'.format(collection_name, i, extension))
+                futures[collection_name].append(executor.submit(
+                    export_partition, collection, query, shard_file_name,
+                    batch_size, compress))
+
+        manifest = {
+            'created': time.time(),
+            'compressed': compress,
+            'collections': dict(
+                (name, [future.result() for future in shard_futures])
+                for name, shard_futures in futures.items())
+        }
+
+    if own_client:
+        client.close()
+
+    # Queries hold ObjectIds, MyJSONEncoder writes them as strings.
+    with open(os.path.join(output_dir, MANIFEST_FILE), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, cls=MyJSONEncoder, indent=4,
+                  sort_keys=True)
+
+    for name, shards in manifest['collections'].items():
+        print("{}: {} documents in {} shards".format(
+            name, sum(shard['count'] for shard in shards), len(shards)))
+    print("Exported in {:.2f}s".format(time.time() - start))
+
+    return manifest
+
+
+def read_shard(shard_file_name, compress):
+    """
+    Reads the documents of a shard one at a time.
+
+    Args:
+        shard_file_name (str): The NDJSON shard.
+        compress (bool): Whether the shard is gzipped.
+
+    Yields:
+        dict: Each document.
+    """
+    if compress:
+        shard_file = gzip.open(shard_file_name, 'rt')
+    else:
+        shard_file = open(shard_file_name)
+
+    with shard_file:
+        for line in shard_file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def merge(manifest_file_name, output_dir=None, ndjson=True):
+    """
+    Merges the shards of each collection into one file, in _id order.
+
+    Args:
+        manifest_file_name (str): The manifest written by export_all().
+        output_dir (str): Optional. Where to write the merged files. Defaults
+            to the folder of the manifest.
+        ndjson (bool): Optional. Whether to write NDJSON or one JSON array
+            like download_mongo_db.grab_data().
+
+    Returns:
+        dict(str->str): The merged file of each collection.
+    """
+    shard_dir = os.path.dirname(os.path.abspath(manifest_file_name))
+    if output_dir is None:
+        output_dir = shard_dir
+
+    with open(manifest_file_name) as manifest_file:
+        manifest = json.load(manifest_file)
+
+    compress = manifest['compressed']
+    write = write_ndjson if ndjson else write_json_array
+    extension = '.ndjson' if ndjson else '.json'
+
+    merged = {}
+    for name, shards in manifest['collections'].items():
+        def documents():
+            for shard in shards:
+                for document in read_shard(
+                        os.path.join(shard_dir, shard['file']), compress):
+                    yield document
+
+        merged_file_name = os.path.join(output_dir, name + extension)
+        with open(merged_file_name, 'w') as merged_file:
+            count = write(documents(), merged_file)
+
+        expected = sum(shard['count'] for shard in shards)
+        assert count == expected, "Merged {} documents of {}, expected {}.".format(
+            count, name, expected)
+
+        print("Merged {} documents into {}".format(count, merged_file_name))
+        merged[name] = merged_file_name
+
+    return merged
+
+
+def main(args):
+    if args.merge is not None:
+        merge(args.merge, ndjson=not args.json_array)
+        return
+
+    export_all(
+        args.output_dir,
+        workers=args.workers,
+        partitions=args.partitions,
+        collections=args.collections,
+        batch_size=args.batch_size,
+        compress=args.gzip)
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+
+    parser.add_argument('-o', '--output_dir',
+                        help="Where to write the shards and manifest.",
+                        default='export')
+    parser.add_argument('-w', '--workers',
+                        help="Number of ranges scanned at the same time.",
+                        type=int,
+                        default=4)
+    parser.add_argument('--partitions',
+                        help="Ranges per collection. Defaults to --workers.",
+                        type=int,
+                        default=None)
+    parser.add_argument('--collections',
+                        help="Collections to export.",
+                        nargs='+',
+                        default=None)
+    parser.add_argument('--batch_size',
+                        help="Documents fetched from the database at a time.",
+                        type=int,
+                        default=BATCH_SIZE)
+    parser.add_argument('--gzip',
+                        help="Whether to gzip the shards.",
+                        default=False,
+                        action='store_true')
+    parser.add_argument('--merge',
+                        help="Merge the shards listed in this manifest.",
+                        default=None)
+    parser.add_argument('--json_array',
+                        help="With --merge, write JSON arrays, not NDJSON.",
+                        default=False,
+                        action='store_true')
+
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,69 @@
+"""
+Tests for parallel_export.py against an in-memory stand-in for MongoDB, run
+from the data_fetching directory with pytest.
+"""
+import os
+import time
+from bson import ObjectId
+import mongomock
+from download_mongo_db import write_ndjson
+import parallel_export
+
+# Enough documents that the collection gets split into ranges.
+DOCUMENTS = 12000
+
+# Documents without an ObjectId, like the counter of an unmigrated database.
+OTHER_IDS = ['responses', 'visits:2026-10-18', 7]
+
+
+def make_client():
+    """
+    Returns:
+        mongomock.MongoClient: A client whose sadscore.responses_men holds
+            DOCUMENTS documents with ObjectIds a minute apart, and one more
+            for each of OTHER_IDS.
+    """
+    client = mongomock.MongoClient()
+    collection = client.sadscore.responses_men
+
+    start = int(time.time()) - DOCUMENTS * 60
+    collection.insert_many([
+        {'_id': ObjectId((start + i * 60).to_bytes(4, 'big') +
+                         i.to_bytes(8, 'big')),
+         'form_type': 'men', 'total_score': i % 50}
+        for i in range(DOCUMENTS)])
+    collection.insert_many([{'_id': _id, 'count': 1} for _id in OTHER_IDS])
+    return client
+
+
+def test_shards_merge_into_single_cursor_export(tmp_path):
+    client = make_client()
+    output_dir = str(tmp_path / 'export')
+
+    manifest = parallel_export.export_all(
+        output_dir, workers=4, collections=['responses_men'], client=client)
+    shards = manifest['collections']['responses_men']
+
+    # One shard for the ids that aren't ObjectIds, then one per range.
+    assert len(shards) == 5
+    assert shards[0]['count'] == len(OTHER_IDS)
+    assert all(shard['count'] > 0 for shard in shards[1:])
+    assert sum(shard['count'] for shard in shards) == (
+        DOCUMENTS + len(OTHER_IDS))
+
+    merged = parallel_export.merge(
+        os.path.join(output_dir, parallel_export.MANIFEST_FILE))
+
+    # The same documents in the same order as one cursor over the whole
+    # collection.
+    single_file_name = str(tmp_path / 'single.ndjson')
+    with open(single_file_name, 'w') as single_file:
+        write_ndjson(client.sadscore.responses_men.find().sort('_id', 1),
+                     single_file)
+
+    with open(merged['responses_men']) as merged_file:
+        merged_lines = merged_file.read().splitlines()
+    with open(single_file_name) as single_file:
+        single_lines = single_file.read().splitlines()
+
+    assert merged_lines == single_lines
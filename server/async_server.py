@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+Async version of the server. Serves the same routes with the same responses
+as server.py, but waits on the database without holding a worker, so one
+process can keep many slow clients open at once.
+
+Run it with any ASGI server:
+    hypercorn async_server:app --bind 0.0.0.0:5050
+"""
+import asyncio
+import json
+import logging
+import time
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from quart import Quart, request, jsonify
+from metrics import RequestError
+from pages import LATEST_QUIZ_PAGE, find_quiz_page, static_cache
+from schema import COUNTERS_COLLECTION, RESPONSE_COLLECTIONS
+import structured_logging
+from structured_logging import log_event
+from visit_counter import AsyncVisitCounter
+
+# Static files are served from memory by static_file() instead.
+app = Quart(__name__, static_folder=None)
+
+app.config.update(dict(
+    DATABASE_MAX_POOL_SIZE=100,
+    DATABASE_MIN_POOL_SIZE=0,
+    DATABASE_CONNECT_TIMEOUT_MS=5000,
+    DATABASE_SERVER_SELECTION_TIMEOUT_MS=5000,
+    DATABASE_SOCKET_TIMEOUT_MS=None,
+    VISIT_FLUSH_INTERVAL_SECS=5.0,
+    VISIT_FLUSH_THRESHOLD=1000,
+    VISIT_BUCKET=None,
+    LOG_VISIT_SAMPLE_RATE=1.0
+))
+
+# Swapped out for an in-memory stand-in with --in_memory.
+client_class = AsyncIOMotorClient
+
+# One client for the event loop, created when the server starts.
+_client = None
+
+
+def connect_db():
+    """
+    Connects to the database. The client is created once and reused by every
+    request afterwards.
+
+    Raises:
+        AssertionError: When no database specified.
+
+    Returns:
+        AsyncIOMotorClient: Database object to fetch and send data.
+    """
+    global _client
+
+    if _client is None:
+        assert 'DATABASE' in app.config, "No database key."
+
+        _client = client_class(
+            app.config['DATABASE'],
+            maxPoolSize=app.config['DATABASE_MAX_POOL_SIZE'],
+            minPoolSize=app.config['DATABASE_MIN_POOL_SIZE'],
+            connectTimeoutMS=app.config['DATABASE_CONNECT_TIMEOUT_MS'],
+            serverSelectionTimeoutMS=app.config[
+                'DATABASE_SERVER_SELECTION_TIMEOUT_MS'],
+            socketTimeoutMS=app.config['DATABASE_SOCKET_TIMEOUT_MS'])
+
+    return _client
+
+
+def get_db():
+    """
+    Gets the database from the shared client.
+
+    Raises:
+        AssertionError: When do database name specified.
+
+    Returns:
+        AsyncIOMotorDatabase: Database object to fetch and send data.
+    """
+    assert 'DATABASE_NAME' in app.config, 'No database name.'
+
+    return connect_db()[app.config['DATABASE_NAME']]
+
+
+def get_visits_col():
+    """
+    Returns:
+        AsyncIOMotorCollection: The collection holding visit counts.
+    """
+    return get_db().visits
+
+
+visit_counter = AsyncVisitCounter(
+    get_visits_col,
+    flush_interval=app.config['VISIT_FLUSH_INTERVAL_SECS'],
+    flush_threshold=app.config['VISIT_FLUSH_THRESHOLD'],
+    bucket=app.config['VISIT_BUCKET'])
+
+
+@app.before_serving
+async def startup():
+    """Connects to the database and starts flushing visits."""
+    try:
+        await connect_db().admin.command('ping')
+    except Exception as error:
+        logging.warning("Database warm up failed: {}".format(error))
+
+    visit_counter.start()
+
+
+@app.after_serving
+async def shutdown():
+    """Writes pending visits and closes the database connection."""
+    global _client
+
+    await visit_counter.stop()
+
+    if _client is not None:
+        _client.close()
+        _client = None
+
+
+def send_static(relative_path, version=None):
+    """
+    Sends a file from the static cache, see pages.py.
+
+    Args:
+        relative_path (str): Path of the file in the static folder.
+        version (str): Optional. The ?v= argument, see
+            StaticCache.respond().
+
+    Returns:
+        tuple(bytes, int, dict): Body, status and headers of the response.
+    """
+    return static_cache.respond(relative_path, request.headers,
+                                version=version)
+
+
+@app.route('/static/<path:filename>')
+async def static_file(filename):
+    """
+    Handles the static files.
+
+    Args:
+        filename (str): Path of the file in the static folder.
+
+    Returns:
+        str: The file.
+    """
+    return send_static(filename, version=request.args.get('v'))
+
+
+@app.route('/health')
+async def health():
+    """
+    Checks that the server can reach the database.
+
+    Returns:
+        str: The status of the database connection. Responds with 503 when
+            the database can not be reached.
+    """
+    try:
+        await connect_db().admin.command('ping')
+    except Exception as error:
+        logging.warning("Health check failed: {}".format(error))
+        return jsonify({'status': 'error', 'error': str(error)}), 503
+
+    return jsonify({'status': 'ok'})
+
+
+@app.route('/')
+async def index():
+    """
+    Handles the root of the webpage. Sends the most up to date version of the
+    quiz. Updates how many times this endpoint has been visited.
+
+    Returns:
+        str: The most up to date version of the quiz in HTML.
+    """
+    # Counts the visit, it gets written to the database in the background.
+    visit_counter.increment()
+
+    log_event(logging.INFO, 'visit',
+              sample_rate=app.config['LOG_VISIT_SAMPLE_RATE'],
+              ip=request.remote_addr)
+
+    return send_static(LATEST_QUIZ_PAGE)
+
+
+@app.route('/quiz/<quiz_type>')
+async def quiz(quiz_type):
+    """
+    Handles sending different quiz types and versions.
+
+    Args:
+        quiz_type (str): The quiz type requested. Should just be 'men' | 'women'
+        version (str): From request arguments. The version of the quiz to
+            return.
+
+    Raises:
+        RequestError: When quiz type or version are not valid.
+
+    Returns:
+        str: The quiz type and version requested.
+    """
+    return send_static(find_quiz_page(quiz_type, request.args))
+
+
+@app.route('/data', methods=['POST'])
+async def handle_survey_answers():
+    """
+    Receives form data adds submission to database.
+
+    Args:
+        data (str): From the POST request arguments. Should in JSON form and
+            have all the quiz response information.
+
+    Raises:
+        RequestError: When the quiz type is not valid.
+
+    Returns:
+        str: The ID of the quiz entry in the database.
+    """
+    # Load the JSON as dictionary.
+    form = await request.form
+    entry = json.loads(form['data'])
+
+    # Add the current timestamp to the data.
+    entry['timestamp_secs'] = time.time()
+
+    # Copied, the _id gets added before it's inserted.
+    log_event(logging.DEBUG, 'submission', entry=lambda: dict(entry))
+
+    # Use the form type to access differnt collections.
+    form_type = entry['form_type']
+
+    # Differentiate between men and women quiz.
+    if form_type not in RESPONSE_COLLECTIONS:
+        logging.warning("Form Type is not 'men' or 'women': {}".format(
+            form_type))
+        raise RequestError(
+            'invalid_form_type',
+            "Form Type is not 'men' or 'women': {}".format(form_type))
+
+    db = get_db()
+    collection_name = RESPONSE_COLLECTIONS[form_type]
+
+    # Insert the response, then count it. Nothing is counted when the
+    # insert fails.
+    entry['_id'] = ObjectId()
+    await db[collection_name].insert_one(entry)
+    await db[COUNTERS_COLLECTION].update_one(
+        {'_id': collection_name},
+        {'$inc': {'count': 1}},
+        upsert=True)
+
+    resp = {"id": str(entry['_id'])}
+
+    return jsonify(resp)
+
+
+@app.route('/analytics')
+async def analytics():
+    """
+    Handles accessing the visit count of the website. The count includes
+    visits that have not been written to the database yet.
+
+    Returns:
+        str: The visit count of the website.
+    """
+    visit_count = await get_visits_col().find_one({'_id': 'visits'})
+
+    if visit_count is None:
+        visit_count = {'_id': 'visits', 'count': 0}
+
+    pending = visit_counter.pending()
+    visit_count['persisted'] = visit_count['count']
+    visit_count['pending'] = pending
+    visit_count['count'] += pending
+
+    return jsonify(visit_count)
+
+
+def use_in_memory_db():
+    """
+    Serves from an in-memory stand-in for MongoDB instead of a real server.
+    Needs the mongomock_motor package.
+    """
+    global client_class
+
+    from mongomock_motor import AsyncMongoMockClient
+
+    client_class = AsyncMongoMockClient
+    app.config.update(dict(
+        DATABASE='mongodb://localhost',
+        DATABASE_NAME='sadscore'
+    ))
+
+
+def main(args):
+    import hypercorn.asyncio
+    from hypercorn.config import Config
+
+    # Set up logging.
+    if args.no_log:
+        log_file_path = None
+    else:
+        log_file_path = 'sadscore.log'
+
+    structured_logging.setup(log_file_path, level=logging.INFO)
+    app.config['LOG_VISIT_SAMPLE_RATE'] = args.log_visit_sample_rate
+
+    if args.in_memory:
+        use_in_memory_db()
+        print("Running with IN MEMORY database")
+    elif args.prod:
+        import db_key_prod as db_key
+        print("Running in PRODUCTION")
+    else:
+        import db_key_dev as db_key
+        print("Running in DEVELOPMENT")
+
+    if not args.in_memory:
+        app.config.update(dict(
+            DATABASE=db_key.dbKey,
+            USERNAME=db_key.username,
+            PASSWORD=db_key.password,
+            DATABASE_NAME=db_key.db_name
+        ))
+
+    app.config['DATABASE_MAX_POOL_SIZE'] = args.pool_size
+
+    config = Config()
+    config.bind = ['0.0.0.0:{}'.format(args.port)]
+    asyncio.run(hypercorn.asyncio.serve(app, config))
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+
+    parser.add_argument('-p', '--port',
+                        help="Port that the server will run on.",
+                        type=int,
+                        default=5050)
+    parser.add_argument('--prod',
+                        help="Whether or not to run in prod mode.",
+                        default=False,
+                        action='store_true')
+    parser.add_argument('--in_memory',
+                        help="Use an in-memory stand-in for the database.",
+                        default=False,
+                        action='store_true')
+    parser.add_argument('--no_log',
+                        help="Whether to not keep logs.",
+                        default=False,
+                        action='store_true')
+    parser.add_argument('--log_visit_sample_rate',
+                        help="Share of visits to log, e.g. 0.1.",
+                        type=float,
+                        default=1.0)
+    parser.add_argument('--pool_size',
+                        help="Max number of database connections.",
+                        type=int,
+                        default=100)
+
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Measures how the throughput of production.py scales with its number of
+workers.
+
+For each worker count the server is started in its own process against the
+in-memory stand-in for MongoDB (or --database), then load_test.py's mix of
+requests is sent from several client processes at once, so the clients
+aren't held back by one interpreter. Every worker has its own in-memory
+database, which is fine for throughput but means /analytics only counts the
+visits of one worker.
+
+Example:
+    python benchmark_workers.py --workers 1 2 4 8 --duration 10
+"""
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+from compare_servers import wait_for_port
+import load_test
+
+
+def start_production(port, workers, database=None):
+    """
+    Args:
+        port (int): Port to listen on.
+        workers (int): Number of worker processes.
+        database (str): Optional. MongoDB URI. Uses the in-memory stand-in
+            when not given.
+
+    Returns:
+        subprocess.Popen: The master process of production.py.
+    """
+    environ = dict(os.environ)
+    if database is None:
+        environ['SADSCORE_IN_MEMORY'] = '1'
+    else:
+        environ['SADSCORE_DATABASE'] = database
+        environ['SADSCORE_DATABASE_NAME'] = 'sadscore_benchmark'
+    environ['SADSCORE_LOG_LEVEL'] = 'WARNING'
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    return subprocess.Popen(
+        [sys.executable, os.path.join(here, 'production.py'),
+         '--host', '127.0.0.1', '--port', str(port),
+         '--workers', str(workers)],
+        cwd=here, env=environ, stdout=subprocess.DEVNULL)
+
+
+def stop_production(process):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def run_clients(port, weights, concurrency, duration, warmup, processes):
+    """
+    Runs load_test.run_load() in several processes at once.
+
+    Args:
+        port (int): Port the server is listening on.
+        weights (dict(str->float)): See load_test.parse_mix().
+        concurrency (int): Clients in all processes together.
+        duration (float): Seconds to record requests for.
+        warmup (float): Seconds to send requests for before recording.
+        processes (int): Number of client processes.
+
+    Returns:
+        dict(str->dict): The results of every process, merged.
+    """
+    shares = [concurrency // processes + (i < concurrency % processes)
+              for i in range(processes)]
+    shares = [share for share in shares if share]
+
+    with ProcessPoolExecutor(max_workers=len(shares)) as executor:
+        futures = [executor.submit(load_test.run_load, '127.0.0.1', port,
+                                   weights, share, duration, warmup, seed)
+                   for seed, share in enumerate(shares)]
+        results = [future.result() for future in futures]
+
+    merged = dict((name, {'latencies': [], 'errors': 0}) for name in weights)
+    for result in results:
+        for name, route in result.items():
+            merged[name]['latencies'].extend(route['latencies'])
+            merged[name]['errors'] += route['errors']
+    return merged
+
+
+def main(args):
+    weights = load_test.parse_mix(args.mix)
+    processes = args.client_processes or os.cpu_count() or 1
+
+    rows = []
+    for workers in args.workers:
+        process = start_production(args.port, workers, args.database)
+        try:
+            wait_for_port(args.port, timeout=30)
+            results = run_clients(args.port, weights, args.concurrency,
+                                  args.duration, args.warmup, processes)
+        finally:
+            stop_production(process)
+
+        total = load_test.summarize(results, args.duration)['total']
+        rows.append(dict(total, workers=workers))
+        # The next server binds the same port.
+        time.sleep(0.5)
+
+    base = rows[0]['requests_per_sec'] or 1.0
+    print("{:>8} {:>10} {:>8} {:>8} {:>9} {:>9}".format(
+        'workers', 'req/s', 'speedup', 'errors', 'p50 ms', 'p99 ms'))
+    for row in rows:
+        print("{:>8} {:>10.1f} {:>7.2f}x {:>8} {:>9.2f} {:>9.2f}".format(
+            row['workers'], row['requests_per_sec'],
+            row['requests_per_sec'] / base, row['errors'], row['p50_ms'],
+            row['p99_ms']))
+
+    if args.output is not None:
+        with open(args.output, 'w') as output_file:
+            json.dump({
+                'mix': weights,
+                'concurrency': args.concurrency,
+                'duration': args.duration,
+                'client_processes': processes,
+                'cpus': os.cpu_count(),
+                'results': rows
+            }, output_file, indent=4, sort_keys=True)
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+
+    cores = os.cpu_count() or 1
+    parser.add_argument('-w', '--workers',
+                        help="Worker counts to measure.",
+                        type=int,
+                        nargs='+',
+                        default=sorted(set([1, 2, 4, cores])))
+    parser.add_argument('-c', '--concurrency',
+                        help="Number of clients sending requests at once.",
+                        type=int,
+                        default=64)
+    parser.add_argument('--duration',
+                        help="Seconds to record requests for.",
+                        type=float,
+                        default=10.0)
+    parser.add_argument('--warmup',
+                        help="Seconds to send requests before recording.",
+                        type=float,
+                        default=1.0)
+    parser.add_argument('-m', '--mix',
+                        help="Routes and weights, see load_test.py.",
+                        default=load_test.DEFAULT_MIX)
+    parser.add_argument('--client_processes',
+                        help="Processes sending requests. Defaults to one "
+                             "per core.",
+                        type=int,
+                        default=None)
+    parser.add_argument('--database',
+                        help="MongoDB URI. Uses an in-memory stand-in if "
+                             "unset.",
+                        default=None)
+    parser.add_argument('-p', '--port',
+                        help="Port to start the server on.",
+                        type=int,
+                        default=5080)
+    parser.add_argument('-o', '--output',
+                        help="Optional JSON file to write the results to.",
+                        default=None)
+
+    args = parser.parse_args()
+    main(args)
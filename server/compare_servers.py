@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Compares the throughput of the sync (server.py) and async (async_server.py)
+servers side by side.
+
+Both servers are started in this process on local ports and hit with the same
+number of concurrent clients on every route. By default they run against
+in-memory stand-ins for MongoDB, pass --database to use a local mongod.
+
+Example:
+    python compare_servers.py --concurrency 64 --duration 10
+"""
+import asyncio
+import http.client as http_client
+import json
+import logging
+import threading
+import time
+from urllib.parse import urlencode
+
+# Routes to compare. (name, method, path, body)
+SUBMISSION = json.dumps({
+    'form_type': 'men',
+    'form_version': 1,
+    'responses': {},
+    'total_score': 0
+})
+ROUTES = [
+    ('index', 'GET', '/', None),
+    ('quiz', 'GET', '/quiz/men?version=1', None),
+    ('data', 'POST', '/data', urlencode({'data': SUBMISSION})),
+    ('analytics', 'GET', '/analytics', None),
+]
+FORM_HEADERS = {'Content-Type': 'application/x-www-form-urlencoded'}
+
+
+def start_sync_server(port, database=None):
+    """
+    Starts server.py in a background thread.
+
+    Args:
+        port (int): Port to listen on.
+        database (str): Optional. MongoDB URI. Uses the in-memory stand-in
+            when not given.
+
+    Returns:
+        function: Stops the server.
+    """
+    from werkzeug.serving import make_server
+    import server
+
+    if database is None:
+        server.use_in_memory_db()
+    else:
+        server.app.config.update(dict(
+            DATABASE=database,
+            DATABASE_NAME='sadscore_compare'
+        ))
+
+    http_server = make_server('127.0.0.1', port, server.app, threaded=True)
+    thread = threading.Thread(target=http_server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    return http_server.shutdown
+
+
+def start_async_server(port, database=None):
+    """
+    Starts async_server.py on its own event loop in a background thread.
+
+    Args:
+        port (int): Port to listen on.
+        database (str): Optional. MongoDB URI. Uses the in-memory stand-in
+            when not given.
+
+    Returns:
+        function: Stops the server.
+    """
+    import hypercorn.asyncio
+    from hypercorn.config import Config
+    import async_server
+
+    if database is None:
+        async_server.use_in_memory_db()
+    else:
+        async_server.app.config.update(dict(
+            DATABASE=database,
+            DATABASE_NAME='sadscore_compare'
+        ))
+
+    config = Config()
+    config.bind = ['127.0.0.1:{}'.format(port)]
+    config.accesslog = None
+
+    loop = asyncio.new_event_loop()
+    shutdown_event = None
+    started = threading.Event()
+
+    def run():
+        nonlocal shutdown_event
+        asyncio.set_event_loop(loop)
+        shutdown_event = asyncio.Event()
+        started.set()
+        loop.run_until_complete(hypercorn.asyncio.serve(
+            async_server.app, config, shutdown_trigger=shutdown_event.wait))
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    started.wait()
+
+    def stop():
+        loop.call_soon_threadsafe(shutdown_event.set)
+        thread.join()
+
+    return stop
+
+
+def wait_for_port(port, timeout=10.0):
+    """
+    Waits until something is accepting connections on a local port.
+
+    Args:
+        port (int): The port to check.
+        timeout (float): Optional. Seconds to wait before giving up.
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http_client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/health')
+            conn.getresponse().read()
+            conn.close()
+            return
+        except (OSError, http_client.HTTPException):
+            time.sleep(0.1)
+    raise AssertionError("Server on port {} did not start.".format(port))
+
+
+def drive(port, method, path, body, concurrency, duration):
+    """
+    Sends requests to one route from many clients at once.
+
+    Args:
+        port (int): Port the server is listening on.
+        method (str): 'GET' | 'POST'.
+        path (str): The path to request.
+        body (str): The request body. None for GET.
+        concurrency (int): Number of clients sending requests at once.
+        duration (float): Seconds to keep sending requests.
+
+    Returns:
+        dict: Requests per second, error count and mean latency in ms.
+    """
+    headers = FORM_HEADERS if body is not None else {}
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def client():
+        conn = http_client.HTTPConnection('127.0.0.1', port, timeout=30)
+        own_latencies = []
+        own_errors = 0
+        while time.time() < deadline:
+            start = time.time()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                resp = conn.getresponse()
+                resp.read()
+                if resp.status != 200:
+                    own_errors += 1
+            except (OSError, http_client.HTTPException):
+                own_errors += 1
+                conn.close()
+                conn = http_client.HTTPConnection('127.0.0.1', port,
+                                                  timeout=30)
+                continue
+            own_latencies.append(time.time() - start)
+        conn.close()
+
+        with lock:
+            latencies.extend(own_latencies)
+            errors[0] += own_errors
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    count = len(latencies)
+    return {
+        'requests_per_sec': count / float(duration),
+        'errors': errors[0],
+        'mean_latency_ms': 1000.0 * sum(latencies) / count if count else 0.0
+    }
+
+
+def compare(concurrency, duration, database=None, sync_port=5061,
+            async_port=5062):
+    """
+    Runs every route against both servers.
+
+    Args:
+        concurrency (int): Number of clients sending requests at once.
+        duration (float): Seconds to spend on each route for each server.
+        database (str): Optional. MongoDB URI. Uses in-memory stand-ins when
+            not given.
+        sync_port (int): Optional. Port for the sync server.
+        async_port (int): Optional. Port for the async server.
+
+    Returns:
+        dict(str->dict(str->dict)): Results for each route and server.
+    """
+    stop_sync = start_sync_server(sync_port, database)
+    stop_async = start_async_server(async_port, database)
+
+    try:
+        wait_for_port(sync_port)
+        wait_for_port(async_port)
+
+        results = {}
+        for name, method, path, body in ROUTES:
+            results[name] = {
+                'sync': drive(sync_port, method, path, body, concurrency,
+                              duration),
+                'async': drive(async_port, method, path, body, concurrency,
+                               duration)
+            }
+    finally:
+        stop_sync()
+        stop_async()
+
+    return results
+
+
+def print_results(results):
+    """
+    Prints the results as a table.
+
+    Args:
+        results (dict(str->dict(str->dict))): The output of compare().
+    """
+    row = '{:<10} {:>12} {:>12} {:>14} {:>14} {:>8}'
+    print(row.format('route', 'sync req/s', 'async req/s', 'sync mean ms',
+                     'async mean ms', 'errors'))
+    for name, _, _, _ in ROUTES:
+        sync = results[name]['sync']
+        asynch = results[name]['async']
+        print(row.format(
+            name,
+            '{:.1f}'.format(sync['requests_per_sec']),
+            '{:.1f}'.format(asynch['requests_per_sec']),
+            '{:.2f}'.format(sync['mean_latency_ms']),
+            '{:.2f}'.format(asynch['mean_latency_ms']),
+            sync['errors'] + asynch['errors']))
+
+
+def main(args):
+    # Keep per-request access logs out of the results.
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    results = compare(args.concurrency, args.duration, args.database)
+    print_results(results)
+
+    if args.output is not None:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=4, sort_keys=True)
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+
+    parser.add_argument('-c', '--concurrency',
+                        help="Number of clients sending requests at once.",
+                        type=int,
+                        default=32)
+    parser.add_argument('--duration',
+                        help="Seconds to spend on each route.",
+                        type=float,
+                        default=5.0)
+    parser.add_argument('--database',
+                        help="MongoDB URI. Uses in-memory stand-ins if unset.",
+                        default=None)
+    parser.add_argument('-o', '--output',
+                        help="Optional JSON file to write the results to.",
+                        default=None)
+
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,294 @@
+"""
+Batches quiz submissions into insert_many calls.
+
+Each submission gets its ObjectId when it is queued, so the caller can answer
+right away. A background thread writes the queue out in batches once enough
+submissions have piled up or the oldest one has waited long enough.
+"""
+import logging
+import os
+import threading
+import time
+from bson import ObjectId
+from pymongo import errors
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# The code of a duplicate key write error.
+DUPLICATE_KEY = 11000
+
+
+class QueueFull(Exception):
+    """Raised when the submission queue stays full for too long."""
+    pass
+
+
+class SubmissionQueue:
+    """
+    Bounded queue of submissions that are written to the database in batches.
+
+    Attributes:
+        get_db (function): Returns the database to write submissions to.
+        batch_size (int): Most submissions written in one insert_many.
+        max_latency (float): Most seconds a submission waits before its batch
+            is written.
+        put_timeout (float): Seconds submit() waits for room in a full queue
+            before giving up.
+        max_retries (int): Times a batch is retried when the database can not
+            be reached.
+        counters_collection (str): The collection the number of submissions
+            of each collection is counted in, under the name of the
+            collection. See schema.py.
+        on_inserted (function): Optional. Called from the writer thread with
+            the collection name and the list of submissions that were
+            inserted into it.
+    """
+
+    def __init__(self, get_db, batch_size=500, max_latency=0.5,
+                 max_queue_size=10000, put_timeout=1.0, max_retries=3,
+                 counters_collection='counters', on_inserted=None):
+        self.get_db = get_db
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.put_timeout = put_timeout
+        self.max_retries = max_retries
+        self.counters_collection = counters_collection
+        self.on_inserted = on_inserted
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._lock = threading.Lock()
+        self._stopped = False
+        self._thread = None
+        self._thread_pid = None
+
+    def submit(self, collection_name, entry):
+        """
+        Queues a submission to be inserted. Does not wait for the write.
+
+        Args:
+            collection_name (str): The collection to insert into.
+            entry (dict): The submission. Gets an '_id' added.
+
+        Raises:
+            QueueFull: When there is no room in the queue after put_timeout.
+
+        Returns:
+            ObjectId: The _id the submission will be stored under.
+        """
+        self._ensure_started()
+
+        entry['_id'] = ObjectId()
+        try:
+            self._queue.put((collection_name, entry), timeout=self.put_timeout)
+        except queue.Full:
+            raise QueueFull("Submission queue is full ({} waiting).".format(
+                self._queue.qsize()))
+
+        return entry['_id']
+
+    def pending(self):
+        """
+        Returns:
+            int: Submissions queued but not yet written.
+        """
+        return self._queue.qsize()
+
+    def flush(self):
+        """Blocks until every queued submission has been written."""
+        if self._thread is not None and self._thread_pid == os.getpid():
+            self._queue.join()
+        else:
+            self._drain()
+
+    def start(self):
+        """Starts the background writer thread for this process."""
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run,
+                                        name='submission-writer')
+        self._thread.daemon = True
+        self._thread_pid = os.getpid()
+        self._thread.start()
+
+    def stop(self):
+        """Stops the background thread and writes whatever is left."""
+        self._stopped = True
+        if self._thread is not None and self._thread_pid == os.getpid():
+            self._thread.join()
+        self._thread = None
+        self._drain()
+
+    def _ensure_started(self):
+        # Threads don't survive fork(), so each worker starts its own.
+        if self._thread_pid != os.getpid() and not self._stopped:
+            with self._lock:
+                if self._thread_pid != os.getpid():
+                    self.start()
+
+    def _next_batch(self, wait):
+        """
+        Takes the next batch off the queue.
+
+        Args:
+            wait (bool): Whether to wait for the first submission and for the
+                batch to fill up.
+
+        Returns:
+            list(tuple(str, dict)): Up to batch_size submissions.
+        """
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=self.max_latency)
+                         if wait else self._queue.get_nowait())
+        except queue.Empty:
+            return batch
+
+        deadline = time.time() + self.max_latency
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.time()
+            try:
+                if wait and timeout > 0:
+                    batch.append(self._queue.get(timeout=timeout))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while not self._stopped:
+            batch = self._next_batch(wait=True)
+            if batch:
+                self._write_with_retries(batch)
+
+    def _drain(self):
+        batch = self._next_batch(wait=False)
+        while batch:
+            self._write_with_retries(batch)
+            batch = self._next_batch(wait=False)
+
+    def _write_with_retries(self, batch):
+        """
+        Writes a batch, retrying each collection while the database can't be
+        reached.
+
+        Args:
+            batch (list(tuple(str, dict))): The submissions to write.
+        """
+        by_collection = {}
+        for collection_name, entry in batch:
+            by_collection.setdefault(collection_name, []).append(entry)
+
+        try:
+            for collection_name, entries in by_collection.items():
+                self._write_collection(collection_name, entries)
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    def _write_collection(self, collection_name, entries):
+        """
+        Inserts submissions, then counts the ones that made it in and hands
+        them to on_inserted. Each step is retried on its own, so a failed
+        count doesn't insert the submissions again.
+
+        Args:
+            collection_name (str): The collection to insert into.
+            entries (list(dict)): The submissions to insert.
+        """
+        inserted = self._with_retries(
+            lambda: self._insert(collection_name, entries))
+        if inserted is None:
+            logging.error("Dropped {} submissions: {}".format(
+                len(entries), [str(entry['_id']) for entry in entries]))
+            return
+        if not inserted:
+            return
+
+        counted = self._with_retries(
+            lambda: self._count(collection_name, len(inserted)))
+        if counted is None:
+            logging.error("Could not count {} submissions in {}".format(
+                len(inserted), collection_name))
+
+        if self.on_inserted is not None:
+            try:
+                self.on_inserted(collection_name, inserted)
+            except Exception as error:
+                logging.error("on_inserted failed: {}".format(error))
+
+    def _with_retries(self, write):
+        """
+        Runs a write, again while the database can't be reached.
+
+        Args:
+            write (function): The write. Must be safe to run again.
+
+        Returns:
+            object: What the write returned. None when it failed.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                return write()
+            except errors.AutoReconnect as error:
+                if attempt == self.max_retries:
+                    logging.error("Submission write failed: {}".format(error))
+                    break
+                logging.warning("Submission write failed, retrying: "
+                                "{}".format(error))
+                time.sleep(min(2 ** attempt, 10))
+            except Exception as error:
+                logging.error("Submission write failed: {}".format(error))
+                break
+        return None
+
+    def _insert(self, collection_name, entries):
+        """
+        Inserts submissions with one insert_many. Can be run again for the
+        same submissions: their _ids are set when they are queued, so one
+        that's already in from an earlier attempt only gets a duplicate key
+        error.
+
+        Args:
+            collection_name (str): The collection to insert into.
+            entries (list(dict)): The submissions to insert.
+
+        Returns:
+            list(dict): The submissions that are in the collection.
+        """
+        collection = self.get_db()[collection_name]
+        try:
+            collection.insert_many(entries, ordered=False)
+            return entries
+        except errors.BulkWriteError as error:
+            # Some may have made it in, count those and log the rest.
+            failed = set(write_error['index']
+                         for write_error in error.details['writeErrors']
+                         if write_error.get('code') != DUPLICATE_KEY)
+            if failed:
+                logging.error("Failed to insert {} submissions: {}".format(
+                    len(failed), [write_error for write_error
+                                  in error.details['writeErrors']
+                                  if write_error['index'] in failed]))
+            return [entry for index, entry in enumerate(entries)
+                    if index not in failed]
+
+    def _count(self, collection_name, count):
+        """
+        Bumps the counter of a collection once for a whole batch.
+
+        Args:
+            collection_name (str): The collection the submissions are in.
+            count (int): How many were inserted.
+
+        Returns:
+            int: The count.
+        """
+        self.get_db()[self.counters_collection].update_one(
+            {'_id': collection_name},
+            {'$inc': {'count': count}},
+            upsert=True)
+        return count
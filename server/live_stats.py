@@ -0,0 +1,505 @@
+"""
+Live statistics of the quiz responses.
+
+Every submission is folded into running aggregates as it comes in: counts,
+running means and variances (Welford), a fixed-bin histogram of total scores
+and the rate of each yes/no trait. Reading them costs the same no matter how
+many responses there are.
+
+The aggregates are checkpointed to the database in the background. Each
+process only checkpoints what it has seen since its last checkpoint, merged
+into the stored aggregates, so several workers can share them.
+"""
+import bisect
+import logging
+import math
+import os
+import threading
+from pymongo import errors
+
+# Number questions to keep running means and variances for.
+NUMERIC_FIELDS = [
+    'height_cm',
+    'iq_score',
+    'instruments',
+    'foreign_langauges_fluent',
+    'foreign_langauges_nonfluent',
+    'tattoos',
+    'attractiveness',
+]
+
+# Edges of the total score histogram. Scores outside go to the first and
+# last bins.
+SCORE_BIN_EDGES = list(range(-30, 65, 5))
+
+
+class RunningStats:
+    """
+    Running count, mean and variance of a stream of numbers (Welford).
+
+    Attributes:
+        n (int): How many numbers have been added.
+        mean (float): The mean so far.
+        m2 (float): Sum of squared differences from the mean.
+    """
+    __slots__ = ['n', 'mean', 'm2']
+
+    def __init__(self, n=0, mean=0.0, m2=0.0):
+        self.n = n
+        self.mean = mean
+        self.m2 = m2
+
+    def add(self, value):
+        """
+        Args:
+            value (float): The number to add.
+        """
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (value - self.mean)
+
+    def merge(self, other):
+        """
+        Adds everything another RunningStats has seen (Chan et al.).
+
+        Args:
+            other (RunningStats): The stats to merge in.
+        """
+        if other.n == 0:
+            return
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.mean += delta * other.n / n
+        self.m2 += other.m2 + delta * delta * self.n * other.n / n
+        self.n = n
+
+    def variance(self):
+        """
+        Returns:
+            float: The sample variance. None with fewer than two numbers.
+        """
+        if self.n < 2:
+            return None
+        return self.m2 / (self.n - 1)
+
+    def to_dict(self):
+        return {'n': self.n, 'mean': self.mean, 'm2': self.m2}
+
+    @staticmethod
+    def from_dict(data):
+        return RunningStats(data['n'], data['mean'], data['m2'])
+
+
+class Histogram:
+    """
+    Counts of numbers in fixed bins.
+
+    Attributes:
+        edges (list(float)): Bin edges. Bin i holds edges[i-1] <= x < edges[i],
+            the first and last bins hold everything below and above.
+        counts (list(int)): Count of each bin. One more than the edges.
+    """
+    __slots__ = ['edges', 'counts']
+
+    def __init__(self, edges, counts=None):
+        self.edges = list(edges)
+        self.counts = list(counts) if counts else [0] * (len(edges) + 1)
+
+    def add(self, value):
+        """
+        Args:
+            value (float): The number to count.
+        """
+        self.counts[bisect.bisect_right(self.edges, value)] += 1
+
+    def merge(self, other):
+        """
+        Args:
+            other (Histogram): Histogram with the same edges to add in.
+        """
+        assert self.edges == other.edges, "Histogram edges don't match."
+
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+
+    def to_dict(self):
+        return {'edges': self.edges, 'counts': self.counts}
+
+    @staticmethod
+    def from_dict(data):
+        return Histogram(data['edges'], data['counts'])
+
+
+def to_number(value):
+    """
+    Args:
+        value (object): A quiz answer. Number questions are sent as strings.
+
+    Returns:
+        float: The answer as a number. None when it isn't one.
+    """
+    if isinstance(value, bool):
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    if math.isnan(number) or math.isinf(number):
+        return None
+    return number
+
+
+class ResponseStats:
+    """
+    Aggregates of every response to one quiz type.
+
+    Attributes:
+        count (int): Number of responses.
+        numeric (dict(str->RunningStats)): Stats of each number question.
+        total_score (RunningStats): Stats of the total scores.
+        score_histogram (Histogram): Histogram of the total scores.
+        trait_true (dict(str->int)): Times each yes/no question was yes.
+        trait_answered (dict(str->int)): Times each yes/no question was
+            answered.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.numeric = dict((name, RunningStats()) for name in NUMERIC_FIELDS)
+        self.total_score = RunningStats()
+        self.score_histogram = Histogram(SCORE_BIN_EDGES)
+        self.trait_true = {}
+        self.trait_answered = {}
+
+    def add(self, entry):
+        """
+        Folds one submission into the aggregates.
+
+        Args:
+            entry (dict): The submission, as sent by the quiz page.
+        """
+        self.count += 1
+
+        score = to_number(entry.get('total_score'))
+        if score is not None:
+            self.total_score.add(score)
+            self.score_histogram.add(score)
+
+        for name, question in entry.get('responses', {}).items():
+            value = question.get('value') if isinstance(question, dict) else None
+
+            if isinstance(value, bool):
+                self.trait_answered[name] = self.trait_answered.get(name, 0) + 1
+                if value:
+                    self.trait_true[name] = self.trait_true.get(name, 0) + 1
+            elif name in self.numeric:
+                number = to_number(value)
+                if number is not None:
+                    self.numeric[name].add(number)
+
+    def merge(self, other):
+        """
+        Args:
+            other (ResponseStats): Aggregates to add in.
+        """
+        self.count += other.count
+        for name, stats in other.numeric.items():
+            self.numeric.setdefault(name, RunningStats()).merge(stats)
+        self.total_score.merge(other.total_score)
+        self.score_histogram.merge(other.score_histogram)
+        for name, count in other.trait_true.items():
+            self.trait_true[name] = self.trait_true.get(name, 0) + count
+        for name, count in other.trait_answered.items():
+            self.trait_answered[name] = self.trait_answered.get(name, 0) + count
+
+    def summary(self):
+        """
+        Returns:
+            dict: The statistics, ready to be sent as JSON.
+        """
+        def describe(stats):
+            return {
+                'count': stats.n,
+                'mean': stats.mean if stats.n else None,
+                'variance': stats.variance()
+            }
+
+        return {
+            'count': self.count,
+            'total_score': describe(self.total_score),
+            'score_histogram': self.score_histogram.to_dict(),
+            'numeric': dict((name, describe(stats))
+                            for name, stats in self.numeric.items()),
+            'trait_rates': dict(
+                (name, float(self.trait_true.get(name, 0)) / answered)
+                for name, answered in self.trait_answered.items()),
+        }
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'numeric': dict((name, stats.to_dict())
+                            for name, stats in self.numeric.items()),
+            'total_score': self.total_score.to_dict(),
+            'score_histogram': self.score_histogram.to_dict(),
+            'trait_true': dict(self.trait_true),
+            'trait_answered': dict(self.trait_answered),
+        }
+
+    @staticmethod
+    def from_dict(data):
+        stats = ResponseStats()
+        stats.count = data['count']
+        for name, numeric in data['numeric'].items():
+            stats.numeric[name] = RunningStats.from_dict(numeric)
+        stats.total_score = RunningStats.from_dict(data['total_score'])
+        stats.score_histogram = Histogram.from_dict(data['score_histogram'])
+        stats.trait_true = dict(data['trait_true'])
+        stats.trait_answered = dict(data['trait_answered'])
+        return stats
+
+
+class LiveStats:
+    """
+    Live statistics for every quiz type, checkpointed to the database.
+
+    Attributes:
+        get_collection (function): Returns the collection the checkpoints are
+            stored in. One document per quiz type.
+        checkpoint_interval (float): Seconds between background checkpoints.
+        max_attempts (int): Times a checkpoint is retried when another process
+            checkpoints at the same time.
+    """
+
+    def __init__(self, get_collection, checkpoint_interval=30.0,
+                 max_attempts=5):
+        self.get_collection = get_collection
+        self.checkpoint_interval = checkpoint_interval
+        self.max_attempts = max_attempts
+
+        self._lock = threading.Lock()
+        self._checkpoint_lock = threading.Lock()
+        self._stored = {}
+        self._pending = {}
+        self._loaded = False
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self._thread_pid = None
+
+    def add(self, form_type, entry):
+        """
+        Folds a submission into the statistics. Never touches the database.
+
+        Args:
+            form_type (str): The quiz type.
+            entry (dict): The submission.
+        """
+        self._ensure_started()
+
+        with self._lock:
+            if form_type not in self._pending:
+                self._pending[form_type] = ResponseStats()
+            self._pending[form_type].add(entry)
+
+    def summary(self):
+        """
+        Gets the statistics of every quiz type: the last checkpoint plus what
+        this process has seen since.
+
+        Returns:
+            dict(str->dict): The statistics of each quiz type.
+        """
+        # A worker that only serves /stats still has to pick up what the
+        # others checkpoint.
+        self._ensure_started()
+
+        if not self._loaded:
+            try:
+                self.load()
+            except Exception as error:
+                logging.warning("Could not load stats: {}".format(error))
+
+        with self._lock:
+            form_types = set(self._stored) | set(self._pending)
+            merged = {}
+            for form_type in form_types:
+                stats = ResponseStats()
+                if form_type in self._stored:
+                    stats.merge(self._stored[form_type])
+                if form_type in self._pending:
+                    stats.merge(self._pending[form_type])
+                merged[form_type] = stats.summary()
+
+        return merged
+
+    def load(self):
+        """Reads the last checkpoint of every quiz type."""
+        stored = {}
+        for doc in self.get_collection().find({}):
+            stored[doc['_id']] = ResponseStats.from_dict(doc['stats'])
+
+        with self._lock:
+            self._stored = stored
+            self._loaded = True
+
+    def checkpoint(self):
+        """
+        Merges what this process has seen since its last checkpoint into the
+        stored statistics. When the write fails the statistics are kept to be
+        written by the next checkpoint.
+        """
+        with self._checkpoint_lock:
+            with self._lock:
+                pending = self._pending
+                self._pending = {}
+
+            failed = {}
+            for form_type, delta in pending.items():
+                try:
+                    stored = self._merge_into_stored(form_type, delta)
+                except Exception as error:
+                    logging.warning("Stats checkpoint failed: {}".format(error))
+                    failed[form_type] = delta
+                    continue
+
+                with self._lock:
+                    self._stored[form_type] = stored
+
+            if failed:
+                with self._lock:
+                    for form_type, delta in failed.items():
+                        if form_type in self._pending:
+                            delta.merge(self._pending[form_type])
+                        self._pending[form_type] = delta
+
+    def _merge_into_stored(self, form_type, delta):
+        """
+        Read, merge and write with a version check, retried when another
+        process wrote in between.
+
+        Args:
+            form_type (str): The quiz type.
+            delta (ResponseStats): Statistics to add to the stored ones.
+
+        Returns:
+            ResponseStats: The new stored statistics.
+        """
+        collection = self.get_collection()
+        for _ in range(self.max_attempts):
+            doc = collection.find_one({'_id': form_type})
+            stored = ResponseStats()
+            version = 0
+            if doc is not None:
+                stored = ResponseStats.from_dict(doc['stats'])
+                version = doc['version']
+            stored.merge(delta)
+
+            new_doc = {'version': version + 1, 'stats': stored.to_dict()}
+            if doc is None:
+                try:
+                    new_doc['_id'] = form_type
+                    collection.insert_one(new_doc)
+                    return stored
+                except errors.DuplicateKeyError:
+                    continue
+
+            result = collection.replace_one(
+                {'_id': form_type, 'version': version}, new_doc)
+            if result.matched_count:
+                return stored
+
+        raise AssertionError("Stats for '{}' kept changing.".format(form_type))
+
+    def rebuild(self, form_type, responses_col):
+        """
+        Recomputes the statistics of a quiz type from every stored response
+        and replaces the checkpoint. When another process checkpoints during
+        the scan the responses are read again, so its checkpoint isn't lost.
+        What running processes haven't checkpointed yet is counted again
+        when they do, so rebuild while the servers are stopped.
+
+        Args:
+            form_type (str): The quiz type.
+            responses_col (pymongo.collection.Collection): Where its responses
+                are stored.
+
+        Raises:
+            AssertionError: When the checkpoint keeps changing during the
+                scan.
+
+        Returns:
+            int: The number of responses read.
+        """
+        collection = self.get_collection()
+        for _ in range(self.max_attempts):
+            # The version before the scan, so any checkpoint during it makes
+            # the write below miss.
+            doc = collection.find_one({'_id': form_type}, {'version': True})
+
+            stats = ResponseStats()
+            cursor = responses_col.find(
+                {'responses': {'$exists': True}},
+                {'responses': True, 'total_score': True})
+            for response in cursor:
+                stats.add(response)
+
+            if doc is None:
+                try:
+                    collection.insert_one({'_id': form_type, 'version': 1,
+                                           'stats': stats.to_dict()})
+                except errors.DuplicateKeyError:
+                    continue
+            else:
+                result = collection.replace_one(
+                    {'_id': form_type, 'version': doc['version']},
+                    {'version': doc['version'] + 1,
+                     'stats': stats.to_dict()})
+                if not result.matched_count:
+                    continue
+
+            with self._lock:
+                self._stored[form_type] = stats
+            return stats.count
+
+        raise AssertionError("Stats for '{}' kept changing.".format(form_type))
+
+    def start(self):
+        """Starts the background checkpoint thread for this process."""
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run,
+                                        name='stats-checkpoint')
+        self._thread.daemon = True
+        self._thread_pid = os.getpid()
+        self._thread.start()
+
+    def stop(self):
+        """Stops the background thread and checkpoints whatever is left."""
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None and self._thread_pid == os.getpid():
+            self._thread.join()
+        self._thread = None
+        self.checkpoint()
+
+    def _ensure_started(self):
+        # Threads don't survive fork(), so each worker starts its own.
+        if self._thread_pid != os.getpid() and not self._stopped:
+            with self._lock:
+                if self._thread_pid != os.getpid():
+                    self.start()
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.checkpoint_interval)
+            self._wake.clear()
+            if self._stopped:
+                break
+            self.checkpoint()
+
+            # Pick up what the other processes have checkpointed.
+            try:
+                self.load()
+            except Exception as error:
+                logging.warning("Could not load stats: {}".format(error))
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+Load tests server.py with a mix of requests and reports the throughput and
+latency percentiles of each route.
+
+The server is started in its own process, against an in-memory stand-in for
+MongoDB unless --database points at a local mongod, so the clients sending
+requests don't share its interpreter. Pass --url to test a server that is
+already running instead. Everything runs offline.
+
+Example:
+    python load_test.py --concurrency 64 --duration 30
+    python load_test.py --mix index=5,quiz=2,data=2,analytics=1
+"""
+import http.client as http_client
+import json
+import logging
+import math
+import multiprocessing
+import random
+import threading
+import time
+from urllib.parse import urlencode, urlparse
+from compare_servers import FORM_HEADERS, wait_for_port
+
+CHECKBOXES = [
+    'degree_acceptable', 'degree_graduated', 'degree_masters', 'degree_phd',
+    'degree_waste_of_time', 'salary_over_80k', 'salary_over_100k',
+    'salary_over_200k', 'unemployed_not_student',
+    'job_unacceptable_not_student', 'gpa_acceptable', 'dropped_out',
+    'instrument_good', 'sports_varsity_college', 'english_non_fluent',
+    'english_only', 'church_going', 'ripped', 'kpop_dance_sing',
+    'perfect_vision', 'dress_like_fuccboi', 'over_10k_instagram',
+    'asian_community_prominent_figure', 'pi_tenth_digit',
+    'racist_against_other_asians', 'always_offer_to_pay',
+    'salty_about_paying', 'let_the_girl_pay_if_she_wants', 'above_platinum',
+    'scored_yourself',
+]
+NUMBERS = {
+    'height_cm': '175',
+    'iq_score': '120',
+    'instruments': '1',
+    'foreign_langauges_fluent': '1',
+    'foreign_langauges_nonfluent': '2',
+    'tattoos': '0',
+    'attractiveness': '6',
+}
+
+
+def submission():
+    """
+    Returns:
+        str: The form body quiz_men_1.js posts to /data, every question
+            answered.
+    """
+    responses = dict((name, {'name': name, 'value': False, 'score': 0})
+                     for name in CHECKBOXES)
+    for name, value in NUMBERS.items():
+        responses[name] = {'name': name, 'value': value, 'score': 0}
+
+    return urlencode({'data': json.dumps({
+        'form_type': 'men',
+        'form_version': 1,
+        'responses': responses,
+        'total_score': 0
+    })})
+
+
+# Routes that can be in the mix. (method, path, body)
+ROUTES = {
+    'index': ('GET', '/', None),
+    'quiz': ('GET', '/quiz/men?version=1', None),
+    'data': ('POST', '/data', submission()),
+    'analytics': ('GET', '/analytics', None),
+}
+
+DEFAULT_MIX = 'index=5,quiz=2,data=2,analytics=1'
+
+
+def parse_mix(mix):
+    """
+    Args:
+        mix (str): Routes and their weights, e.g. 'index=3,data=1'.
+
+    Raises:
+        AssertionError: When a route isn't in ROUTES.
+
+    Returns:
+        dict(str->float): The weight of each route.
+    """
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ROUTES:
+            logging.warning("Unknown route in mix: {}".format(name))
+            raise AssertionError("Unknown route in mix: {}".format(name))
+        weights[name] = float(weight) if weight else 1.0
+    return weights
+
+
+def serve(port, database=None):
+    """
+    Runs server.py on a threaded WSGI server until the process is stopped.
+    Meant to be the target of its own process.
+
+    Args:
+        port (int): Port to listen on.
+        database (str): Optional. MongoDB URI. Uses the in-memory stand-in
+            when not given.
+    """
+    from werkzeug.serving import make_server
+    import server
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    if database is None:
+        server.use_in_memory_db()
+    else:
+        server.app.config.update(dict(
+            DATABASE=database,
+            DATABASE_NAME='sadscore_load_test'
+        ))
+    server.warm_up_db()
+
+    make_server('127.0.0.1', port, server.app, threaded=True).serve_forever()
+
+
+def start_server(port, database=None):
+    """
+    Starts serve() in its own process.
+
+    Args:
+        port (int): Port to listen on.
+        database (str): Optional. See serve().
+
+    Returns:
+        multiprocessing.Process: The server process.
+    """
+    process = multiprocessing.Process(target=serve, args=(port, database))
+    process.daemon = True
+    process.start()
+    return process
+
+
+def percentile(sorted_values, fraction):
+    """
+    Args:
+        sorted_values (list(float)): The values, sorted.
+        fraction (float): Between 0 and 1.
+
+    Returns:
+        float: The nearest rank percentile. 0 without values.
+    """
+    if not sorted_values:
+        return 0.0
+    # Rounded first so 0.07 * 100 = 7.000000000000001 is still rank 7.
+    rank = max(math.ceil(round(fraction * len(sorted_values), 9)), 1)
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def run_load(host, port, weights, concurrency, duration, warmup=1.0,
+             seed=0):
+    """
+    Sends a mix of requests from many clients at once. Each client keeps its
+    connection open and picks the route of every request at random by
+    weight.
+
+    Args:
+        host (str): Host the server is listening on.
+        port (int): Port the server is listening on.
+        weights (dict(str->float)): The weight of each route, see
+            parse_mix().
+        concurrency (int): Number of clients sending requests at once.
+        duration (float): Seconds to record requests for.
+        warmup (float): Optional. Seconds to send requests for before
+            recording.
+        seed (int): Optional. Seed of the route choices.
+
+    Returns:
+        dict(str->dict): Count, errors and latencies in seconds of each
+            route.
+    """
+    names = list(weights)
+    cumulative = []
+    total = 0.0
+    for name in names:
+        total += weights[name]
+        cumulative.append(total)
+
+    results = dict((name, {'latencies': [], 'errors': 0}) for name in names)
+    lock = threading.Lock()
+    start = time.time() + warmup
+    deadline = start + duration
+
+    def client(number):
+        choose = random.Random(seed * 100003 + number)
+        own = dict((name, {'latencies': [], 'errors': 0}) for name in names)
+        conn = http_client.HTTPConnection(host, port, timeout=30)
+
+        while True:
+            sent = time.time()
+            if sent >= deadline:
+                break
+
+            point = choose.random() * total
+            name = next(name for name, upper in zip(names, cumulative)
+                        if point < upper)
+            method, path, body = ROUTES[name]
+            headers = FORM_HEADERS if body is not None else {}
+
+            ok = True
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                ok = response.status == 200
+            except (OSError, http_client.HTTPException):
+                ok = False
+                conn.close()
+                conn = http_client.HTTPConnection(host, port, timeout=30)
+
+            if sent < start:
+                continue
+            if ok:
+                own[name]['latencies'].append(time.time() - sent)
+            else:
+                own[name]['errors'] += 1
+        conn.close()
+
+        with lock:
+            for name in names:
+                results[name]['latencies'].extend(own[name]['latencies'])
+                results[name]['errors'] += own[name]['errors']
+
+    threads = [threading.Thread(target=client, args=(number,))
+               for number in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results
+
+
+def summarize(results, duration):
+    """
+    Args:
+        results (dict(str->dict)): The output of run_load().
+        duration (float): Seconds the requests were recorded for.
+
+    Returns:
+        dict(str->dict): Requests per second, errors and latency percentiles
+            in ms of each route, and of all of them under 'total'.
+    """
+    summary = {}
+    everything = {'latencies': [], 'errors': 0}
+    for name, result in results.items():
+        everything['latencies'].extend(result['latencies'])
+        everything['errors'] += result['errors']
+
+    for name, result in list(results.items()) + [('total', everything)]:
+        latencies = sorted(result['latencies'])
+        count = len(latencies)
+        summary[name] = {
+            'requests': count,
+            'requests_per_sec': count / float(duration),
+            'errors': result['errors'],
+            'mean_ms': 1000.0 * sum(latencies) / count if count else 0.0,
+            'p50_ms': 1000.0 * percentile(latencies, 0.50),
+            'p95_ms': 1000.0 * percentile(latencies, 0.95),
+            'p99_ms': 1000.0 * percentile(latencies, 0.99),
+        }
+    return summary
+
+
+def print_summary(summary):
+    """
+    Prints the summary as a table.
+
+    Args:
+        summary (dict(str->dict)): The output of summarize().
+    """
+    row = '{:<10} {:>9} {:>10} {:>8} {:>9} {:>9} {:>9} {:>9}'
+    print(row.format('route', 'requests', 'req/s', 'errors', 'mean ms',
+                     'p50 ms', 'p95 ms', 'p99 ms'))
+    for name, result in summary.items():
+        print(row.format(
+            name,
+            result['requests'],
+            '{:.1f}'.format(result['requests_per_sec']),
+            result['errors'],
+            '{:.2f}'.format(result['mean_ms']),
+            '{:.2f}'.format(result['p50_ms']),
+            '{:.2f}'.format(result['p95_ms']),
+            '{:.2f}'.format(result['p99_ms'])))
+
+
+def main(args):
+    weights = parse_mix(args.mix)
+
+    process = None
+    if args.url is None:
+        host, port = '127.0.0.1', args.port
+        process = start_server(port, args.database)
+    else:
+        url = urlparse(args.url)
+        host, port = url.hostname, url.port or 80
+
+    try:
+        if process is not None:
+            wait_for_port(port)
+        results = run_load(host, port, weights, args.concurrency,
+                           args.duration, args.warmup, args.seed)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.join()
+
+    summary = summarize(results, args.duration)
+    print_summary(summary)
+
+    if args.output is not None:
+        with open(args.output, 'w') as output_file:
+            json.dump({
+                'mix': weights,
+                'concurrency': args.concurrency,
+                'duration': args.duration,
+                'database': args.database if args.url is None else None,
+                'url': args.url,
+                'routes': summary
+            }, output_file, indent=4, sort_keys=True)
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+
+    parser.add_argument('-c', '--concurrency',
+                        help="Number of clients sending requests at once.",
+                        type=int,
+                        default=32)
+    parser.add_argument('--duration',
+                        help="Seconds to record requests for.",
+                        type=float,
+                        default=10.0)
+    parser.add_argument('--warmup',
+                        help="Seconds to send requests before recording.",
+                        type=float,
+                        default=1.0)
+    parser.add_argument('-m', '--mix',
+                        help="Routes and weights, e.g. 'index=3,data=1'. "
+                             "Routes: " + ', '.join(sorted(ROUTES)),
+                        default=DEFAULT_MIX)
+    parser.add_argument('--database',
+                        help="MongoDB URI. Uses an in-memory stand-in if "
+                             "unset.",
+                        default=None)
+    parser.add_argument('-p', '--port',
+                        help="Port to start the server on.",
+                        type=int,
+                        default=5070)
+    parser.add_argument('--url',
+                        help="Test a server already running here instead, "
+                             "e.g. http://127.0.0.1:5050.",
+                        default=None)
+    parser.add_argument('--seed',
+                        help="Seed of the route choices.",
+                        type=int,
+                        default=0)
+    parser.add_argument('-o', '--output',
+                        help="Optional JSON file to write the results to.",
+                        default=None)
+
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Request and database metrics in the Prometheus text format.
+
+Counters, gauges and histograms are kept in memory by a Registry and written
+out by Registry.render() for /metrics. instrument_app() times every request
+of a Flask app and CommandTimer times every command a MongoClient sends.
+Nothing here is hooked up until the server turns metrics on, so there's no
+cost when they are off.
+"""
+import bisect
+import threading
+import time
+from pymongo import monitoring
+
+# Seconds, the Prometheus client defaults.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75,
+                   1.0, 2.5, 5.0, 7.5, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Why a request can be turned down, see RequestError. With the names of the
+# exception types, the only values of the reason label, so what a user sends
+# can never add series.
+REASONS = frozenset([
+    'invalid_quiz_type',
+    'missing_version',
+    'quiz_not_available',
+    'invalid_version',
+    'invalid_form_type',
+])
+
+
+def escape(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def format_labels(names, values, extra=None):
+    """
+    Args:
+        names (tuple(str)): The label names.
+        values (tuple): Their values.
+        extra (tuple(str, str)): Optional. One more label, like le.
+
+    Returns:
+        str: E.g. '{route="index",status="200"}'. Empty without labels.
+    """
+    pairs = ['{}="{}"'.format(name, escape(value))
+             for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append('{}="{}"'.format(extra[0], escape(extra[1])))
+    if not pairs:
+        return ''
+    return '{' + ','.join(pairs) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """
+    A named metric with one value per combination of labels.
+
+    Attributes:
+        name (str): The metric name.
+        documentation (str): What it measures.
+        labels (tuple(str)): The label names.
+    """
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _samples(self):
+        """
+        Returns:
+            list(str): The sample lines.
+        """
+        with self._lock:
+            values = sorted(self._values.items())
+        return ['{}{} {}'.format(self.name, format_labels(self.labels, key),
+                                 format_value(value))
+                for key, value in values]
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        return lines + self._samples()
+
+
+class Counter(Metric):
+    """A number that only goes up."""
+    kind = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = (
+                self._values.get(label_values, 0) + amount)
+
+
+class Gauge(Metric):
+    """
+    A number that goes up and down. Can also be read from a function when
+    scraped, see set_function().
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labels=()):
+        Metric.__init__(self, name, documentation, labels)
+        self._function = None
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = (
+                self._values.get(label_values, 0) + amount)
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+    def set_function(self, function):
+        """
+        Args:
+            function (function): Returns the value, called on every scrape.
+                Only for gauges without labels.
+        """
+        self._function = function
+
+    def _samples(self):
+        if self._function is not None:
+            self.set(self._function())
+        return Metric._samples(self)
+
+
+class Histogram(Metric):
+    """Counts of observations in cumulative buckets, with their sum."""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(),
+                 buckets=DEFAULT_BUCKETS):
+        Metric.__init__(self, name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *label_values):
+        """
+        Args:
+            value (float): The observation, e.g. seconds.
+            *label_values: The values of the labels.
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                state = self._values[label_values] = [
+                    [0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def _samples(self):
+        with self._lock:
+            values = sorted((key, (list(counts), total))
+                            for key, (counts, total) in self._values.items())
+
+        lines = []
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = format_labels(self.labels, key,
+                                       ('le', format_value(bound)))
+                lines.append('{}_bucket{} {}'.format(self.name, labels,
+                                                     cumulative))
+            labels = format_labels(self.labels, key)
+            lines.append('{}_sum{} {}'.format(self.name, labels,
+                                              format_value(total)))
+            lines.append('{}_count{} {}'.format(self.name, labels,
+                                                cumulative))
+        return lines
+
+
+class Registry:
+    """
+    Holds every metric of a process.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self._add(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()):
+        return self._add(Gauge(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(),
+                  buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, documentation, labels, buckets))
+
+    def render(self):
+        """
+        Returns:
+            str: Every metric in the Prometheus text format.
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class RequestError(AssertionError):
+    """
+    Raised when a request can't be served as asked, with the reason counted
+    in the error metrics.
+
+    Attributes:
+        reason (str): One of REASONS.
+    """
+
+    def __init__(self, reason, message):
+        """
+        Args:
+            reason (str): One of REASONS.
+            message (str): What went wrong. May hold what the user sent.
+
+        Raises:
+            ValueError: When reason isn't one of REASONS.
+        """
+        if reason not in REASONS:
+            raise ValueError("Unknown reason: '{}'".format(reason))
+        AssertionError.__init__(self, message)
+        self.reason = reason
+
+
+def error_reason(error):
+    """
+    Args:
+        error (Exception): What a request raised.
+
+    Returns:
+        str: The reason of a RequestError, otherwise the exception type.
+            Never taken from the message.
+    """
+    if isinstance(error, RequestError):
+        return error.reason
+    return type(error).__name__
+
+
+def instrument_app(app, registry):
+    """
+    Times every request of a Flask app and counts the ones in flight and the
+    ones that raise.
+
+    Args:
+        app (flask.Flask): The app.
+        registry (Registry): Where to keep the metrics.
+    """
+    from flask import g, request
+
+    duration = registry.histogram(
+        'sadscore_request_duration_seconds',
+        'Time to handle a request.', ['route'])
+    requests = registry.counter(
+        'sadscore_requests_total', 'Requests handled.', ['route', 'status'])
+    in_flight = registry.gauge(
+        'sadscore_requests_in_flight', 'Requests being handled.', ['route'])
+    errors = registry.counter(
+        'sadscore_request_errors_total',
+        'Requests that raised, by reason.', ['route', 'reason'])
+
+    def route():
+        return request.endpoint or 'unmatched'
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+        in_flight.inc(route())
+
+    @app.after_request
+    def count_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def stop_timer(error=None):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return
+        name = route()
+        duration.observe(time.perf_counter() - start, name)
+        in_flight.dec(name)
+        requests.inc(name, g.pop('metrics_status', 500))
+        if error is not None:
+            errors.inc(name, error_reason(error))
+
+
+class CommandTimer(monitoring.CommandListener):
+    """
+    Times every command a MongoClient sends, e.g. find, insert, update and
+    findAndModify. Pass it in the event_listeners of the client.
+    """
+
+    def __init__(self, registry):
+        self.duration = registry.histogram(
+            'sadscore_mongo_command_duration_seconds',
+            'Time for MongoDB to answer a command.', ['command'])
+        self.failures = registry.counter(
+            'sadscore_mongo_command_failures_total',
+            'MongoDB commands that failed.', ['command'])
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.duration.observe(event.duration_micros / 1e6, event.command_name)
+
+    def failed(self, event):
+        self.duration.observe(event.duration_micros / 1e6, event.command_name)
+        self.failures.inc(event.command_name)
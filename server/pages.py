@@ -0,0 +1,73 @@
+"""
+The pages and static files both servers send.
+
+Every static file is read into memory when this is imported, see
+static_cache.py. find_quiz_page() picks the page of a quiz type and version.
+"""
+import logging
+import os
+from metrics import RequestError
+from static_cache import StaticCache
+
+QUIZ_TYPES = set(['men', 'women'])
+
+# Maps (quiz type, version) to the page in the static folder.
+QUIZ_PAGES = {
+    ('men', 0): 'html/index.html',
+    ('men', 1): 'html/quiz_men_1.html',
+}
+
+# The page sent from the root of the site.
+LATEST_QUIZ_PAGE = QUIZ_PAGES[('men', 1)]
+
+STATIC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'static')
+
+# Every static file is read into memory up front.
+static_cache = StaticCache(STATIC_FOLDER)
+static_cache.load_all()
+
+
+def find_quiz_page(quiz_type, args):
+    """
+    Finds the page for a quiz type and version.
+
+    Args:
+        quiz_type (str): The quiz type requested. Should just be 'men' | 'women'
+        args (dict): The request arguments. Should have 'version'.
+
+    Raises:
+        RequestError: When quiz type or version are not valid. An
+            AssertionError.
+
+    Returns:
+        str: Path of the quiz page in the static folder.
+    """
+    # Check that this quiz type exists.
+    if quiz_type not in QUIZ_TYPES:
+        logging.warning("Incorrect Quiz Type: '{}'".format(quiz_type))
+        raise RequestError('invalid_quiz_type',
+                           "'{}' is not a valid quiz type.".format(quiz_type))
+
+    # Check that the request has version argument.
+    if 'version' not in args:
+        logging.warning("'version' not in args.")
+
+        raise RequestError('missing_version', "'version' is not in args.")
+
+    version = int(args['version'])
+
+    page = QUIZ_PAGES.get((quiz_type, version))
+    if page is not None:
+        return page
+
+    # Quiz types without any pages yet.
+    if not any(key[0] == quiz_type for key in QUIZ_PAGES):
+        reason = 'quiz_not_available'
+        message = "{} quiz not available yet.".format(quiz_type.capitalize())
+    else:
+        reason = 'invalid_version'
+        message = "Version does not exist: '{}'".format(version)
+
+    logging.warning(message)
+    raise RequestError(reason, message)
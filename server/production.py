@@ -0,0 +1,537 @@
+#!/usr/bin/env python3
+"""
+Runs server.py in production: configured from the environment, served by a
+pre-forked worker process per core.
+
+create_app() configures the app from SADSCORE_* variables instead of the
+db_key modules, e.g. SADSCORE_DATABASE and SADSCORE_DATABASE_NAME, see
+ENVIRONMENT. They are read from the environment and from the optional
+--env_file, which overrides it. The master process forks the workers, which
+all accept connections on the socket it opened. The master never imports
+server.py, each worker loads the app, makes its own database client,
+background writers and log listener after the fork.
+
+Signals to the master:
+    SIGTERM, SIGINT: Workers finish the requests in flight, write out what's
+        pending and exit, then the master exits.
+    SIGHUP: Reads the env file again and starts new workers, which load
+        server.py as it is now, then stops the old ones the same way. The
+        socket stays open the whole time. The environment of the master
+        can't change, so settings that should change on SIGHUP go in the
+        env file.
+
+A worker that dies is replaced.
+
+Example:
+    SADSCORE_IN_MEMORY=1 python production.py --workers 4 --port 5050
+    python production.py --env_file sadscore.env
+"""
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import structured_logging
+
+ENV_PREFIX = 'SADSCORE_'
+
+# The app config read from the environment, with their types. Each is set
+# from SADSCORE_<KEY>, e.g. SADSCORE_DATABASE_MAX_POOL_SIZE=50.
+ENVIRONMENT = {
+    'DATABASE': str,
+    'DATABASE_NAME': str,
+    'DATABASE_MAX_POOL_SIZE': int,
+    'DATABASE_MIN_POOL_SIZE': int,
+    'DATABASE_CONNECT_TIMEOUT_MS': int,
+    'DATABASE_SERVER_SELECTION_TIMEOUT_MS': int,
+    'DATABASE_SOCKET_TIMEOUT_MS': int,
+    'VISIT_BUCKET': str,
+    'METRICS_ENABLED': bool,
+    'LOG_VISIT_SAMPLE_RATE': float,
+}
+
+# Seconds a worker waits for the requests in flight before it exits anyway.
+GRACEFUL_TIMEOUT_SECS = 30.0
+
+# A worker that dies sooner than this after starting failed to start. Its
+# replacement waits RESPAWN_DELAY_SECS, doubled for every such failure in a
+# row up to MAX_RESPAWN_DELAY_SECS, and the master gives up after
+# MAX_FAST_FAILURES of them.
+MIN_UPTIME_SECS = 5.0
+RESPAWN_DELAY_SECS = 0.5
+MAX_RESPAWN_DELAY_SECS = 30.0
+MAX_FAST_FAILURES = 8
+
+LOG_FILE_ENV = ENV_PREFIX + 'LOG_FILE'
+LOG_LEVEL_ENV = ENV_PREFIX + 'LOG_LEVEL'
+IN_MEMORY_ENV = ENV_PREFIX + 'IN_MEMORY'
+WORKERS_ENV = ENV_PREFIX + 'WORKERS'
+
+
+def parse_bool(value):
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def config_from_environment(environ=None):
+    """
+    Args:
+        environ (dict(str->str)): Optional. Defaults to os.environ.
+
+    Raises:
+        AssertionError: When a value isn't of the type of its key.
+
+    Returns:
+        dict: The app config keys set in the environment, see ENVIRONMENT.
+    """
+    if environ is None:
+        environ = os.environ
+
+    config = {}
+    for key, kind in ENVIRONMENT.items():
+        value = environ.get(ENV_PREFIX + key)
+        if value is None or value == '':
+            continue
+        try:
+            config[key] = parse_bool(value) if kind is bool else kind(value)
+        except ValueError:
+            logging.warning("Invalid {}{}: '{}'".format(ENV_PREFIX, key,
+                                                        value))
+            raise AssertionError("Invalid {}{}: '{}'".format(ENV_PREFIX, key,
+                                                             value))
+    return config
+
+
+def read_env_file(file_name):
+    """
+    Reads KEY=VALUE lines. Blank lines and lines starting with # are
+    skipped.
+
+    Args:
+        file_name (str): The env file.
+
+    Raises:
+        AssertionError: When a line isn't KEY=VALUE.
+
+    Returns:
+        dict(str->str): The values by key.
+    """
+    values = {}
+    with open(file_name) as env_file:
+        for number, line in enumerate(env_file, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            key, equals, value = line.partition('=')
+            if not equals or not key.strip():
+                logging.warning("Invalid line {} of {}: '{}'".format(
+                    number, file_name, line))
+                raise AssertionError("Invalid line {} of {}: '{}'".format(
+                    number, file_name, line))
+            values[key.strip()] = value.strip().strip('\'"')
+    return values
+
+
+def load_environment(env_file=None):
+    """
+    Args:
+        env_file (str): Optional. An env file, see read_env_file().
+
+    Raises:
+        AssertionError: When the env file or a value in it is invalid, or
+            no database is given.
+
+    Returns:
+        dict(str->str): The environment with the env file on top.
+    """
+    environ = dict(os.environ)
+    if env_file is not None:
+        environ.update(read_env_file(env_file))
+
+    # Checked here so a bad file is caught by the master, not the workers.
+    config_from_environment(environ)
+    if (not parse_bool(environ.get(IN_MEMORY_ENV, '')) and
+            not environ.get(ENV_PREFIX + 'DATABASE')):
+        logging.warning("No database, set {}DATABASE.".format(ENV_PREFIX))
+        raise AssertionError("No database, set {}DATABASE.".format(
+            ENV_PREFIX))
+    return environ
+
+
+def default_workers():
+    """
+    Returns:
+        int: One worker per core this process may run on, which can be
+            fewer than the machine has, e.g. in a container pinned to some.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0)) or 1
+    return os.cpu_count() or 1
+
+
+def describe_exit(status):
+    """
+    Args:
+        status (int): A status from os.waitpid().
+
+    Returns:
+        str: How the process ended, e.g. "exited with 1".
+    """
+    if os.WIFSIGNALED(status):
+        number = os.WTERMSIG(status)
+        try:
+            return "was killed by {}".format(signal.Signals(number).name)
+        except ValueError:
+            return "was killed by signal {}".format(number)
+    return "exited with {}".format(os.WEXITSTATUS(status))
+
+
+def log_level(environ):
+    return getattr(logging, environ.get(LOG_LEVEL_ENV, 'INFO').upper())
+
+
+def create_app(environ=None):
+    """
+    Configures server.app from the environment.
+
+    Args:
+        environ (dict(str->str)): Optional. Defaults to os.environ. With
+            SADSCORE_IN_MEMORY=1 the in-memory stand-in for MongoDB is used.
+
+    Raises:
+        AssertionError: When no database is given.
+
+    Returns:
+        flask.Flask: The app.
+    """
+    import server
+
+    if environ is None:
+        environ = os.environ
+
+    config = config_from_environment(environ)
+    metrics_enabled = config.pop('METRICS_ENABLED', False)
+
+    if parse_bool(environ.get(IN_MEMORY_ENV, '')):
+        server.use_in_memory_db()
+    server.app.config.update(config)
+
+    if 'DATABASE' not in server.app.config:
+        logging.warning("No database, set {}DATABASE.".format(ENV_PREFIX))
+        raise AssertionError("No database, set {}DATABASE.".format(
+            ENV_PREFIX))
+
+    server.visit_counter.bucket = server.app.config['VISIT_BUCKET']
+    if metrics_enabled:
+        server.enable_metrics()
+
+    server.close_client()
+    return server.app
+
+
+class InFlight:
+    """
+    WSGI middleware counting the requests being handled.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        with self._lock:
+            self.count += 1
+        try:
+            # The body is built by the app before it's returned.
+            return self.app(environ, start_response)
+        finally:
+            with self._lock:
+                self.count -= 1
+
+
+def run_worker(listener, environ):
+    """
+    Loads the app and serves requests on the socket of the master until
+    SIGTERM, then waits for the requests in flight and writes out what's
+    pending. Runs in the forked worker.
+
+    Args:
+        listener (socket.socket): The listening socket of the master.
+        environ (dict(str->str)): The environment, see load_environment().
+    """
+    from werkzeug.serving import make_server
+    import server
+
+    # Stopped by the master with SIGTERM. Until the server is up that
+    # simply ends the worker.
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    # The log listener thread of the master didn't survive the fork.
+    structured_logging.setup(environ.get(LOG_FILE_ENV) or None,
+                             level=log_level(environ))
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    app = create_app(environ)
+    in_flight = InFlight(app)
+    host, port = listener.getsockname()[:2]
+    http_server = make_server(host, port, in_flight, threaded=True,
+                              fd=listener.fileno())
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever() to return, so it can't be
+        # called from the thread running it.
+        threading.Thread(target=http_server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+
+    try:
+        server.warm_up_db()
+    except Exception as error:
+        logging.warning("Database warm up failed: {}".format(error))
+
+    http_server.serve_forever()
+
+    deadline = time.time() + GRACEFUL_TIMEOUT_SECS
+    while in_flight.count and time.time() < deadline:
+        time.sleep(0.05)
+    http_server.server_close()
+
+    server.shutdown()
+    structured_logging.stop()
+
+
+class Master:
+    """
+    Forks the workers, replaces the ones that die, and reloads or stops them
+    on signals.
+
+    Attributes:
+        workers (int): Number of workers to keep running.
+        env_file (str): Optional. Read again on every reload, see
+            load_environment().
+        listener (socket.socket): The socket the workers accept on.
+        pids (set(int)): The workers of the current generation.
+        environ (dict(str->str)): What the current generation runs with.
+        gave_up (bool): Whether run() stopped because the workers kept
+            dying right after starting.
+    """
+
+    def __init__(self, host, port, workers=None, backlog=2048,
+                 env_file=None):
+        self.workers = workers or default_workers()
+        self.env_file = env_file
+        self.listener = socket.create_server((host, port), backlog=backlog)
+        self.listener.set_inheritable(True)
+        self.pids = set()
+        self.gave_up = False
+        self._retiring = set()
+        self._stopping = False
+        self._reloading = False
+        self._started = {}
+        self._fast_failures = 0
+        self._owed = 0
+        self._respawn_at = 0.0
+        self.environ = None
+
+    def spawn(self):
+        """
+        Returns:
+            int: The pid of a new worker.
+        """
+        pid = os.fork()
+        if pid != 0:
+            self._started[pid] = time.monotonic()
+            return pid
+
+        # The worker never returns into the master's code.
+        code = 0
+        try:
+            run_worker(self.listener, self.environ)
+        except BaseException:
+            logging.exception("Worker {} failed".format(os.getpid()))
+            code = 1
+        finally:
+            os._exit(code)
+
+    def reap(self):
+        """
+        Collects the workers that exited.
+
+        Returns:
+            list(tuple): The pid, os.waitpid() status and seconds it ran for
+                of each current worker that exited.
+        """
+        dead = []
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            started = self._started.pop(pid, None)
+            if pid in self.pids:
+                self.pids.discard(pid)
+                dead.append((pid, status, time.monotonic() - started))
+            self._retiring.discard(pid)
+        return dead
+
+    def replace(self, dead):
+        """
+        Starts workers in place of the ones that died. When they die right
+        after starting, their replacements are started later and later, and
+        after MAX_FAST_FAILURES times in a row the master stops.
+
+        Args:
+            dead (list(tuple)): The workers that died, see reap().
+        """
+        now = time.monotonic()
+        if dead:
+            for pid, status, uptime in dead:
+                logging.warning("Worker {} {} after {:.1f}s".format(
+                    pid, describe_exit(status), uptime))
+            self._owed += len(dead)
+
+            # Workers that died together count as one failure.
+            if all(uptime < MIN_UPTIME_SECS for _, _, uptime in dead):
+                self._fast_failures += 1
+            else:
+                self._fast_failures = 0
+
+            if self._fast_failures >= MAX_FAST_FAILURES:
+                logging.error("Workers died right after starting {} times "
+                              "in a row, giving up".format(
+                                  self._fast_failures))
+                self.gave_up = True
+                self._stopping = True
+                return
+
+            delay = 0.0
+            if self._fast_failures:
+                delay = min(
+                    RESPAWN_DELAY_SECS * 2 ** (self._fast_failures - 1),
+                    MAX_RESPAWN_DELAY_SECS)
+            self._respawn_at = now + delay
+            logging.warning("Starting {} workers in {:.1f}s".format(
+                self._owed, delay))
+
+        if self._owed and now >= self._respawn_at:
+            for _ in range(self._owed):
+                self.pids.add(self.spawn())
+            self._owed = 0
+
+    def signal_workers(self, pids, signum):
+        for pid in pids:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def reload(self):
+        """
+        Starts a new generation of workers with the env file as it is now,
+        then stops the old one. The new workers load server.py again.
+        """
+        try:
+            self.environ = load_environment(self.env_file)
+        except (AssertionError, OSError) as error:
+            logging.warning("Not reloading: {}".format(error))
+            return
+        old = self.pids
+        # New settings or code might fix workers that kept dying.
+        self._fast_failures = 0
+        self._owed = 0
+        self.pids = set(self.spawn() for _ in range(self.workers))
+        self._retiring |= old
+        self.signal_workers(old, signal.SIGTERM)
+        logging.info("Reloaded {} workers".format(self.workers))
+
+    def stop(self, timeout=GRACEFUL_TIMEOUT_SECS + 5):
+        """
+        Stops every worker, killing the ones still running after timeout.
+        """
+        everyone = self.pids | self._retiring
+        self.signal_workers(everyone, signal.SIGTERM)
+        deadline = time.time() + timeout
+        while (self.pids or self._retiring) and time.time() < deadline:
+            self.reap()
+            time.sleep(0.05)
+        self.signal_workers(self.pids | self._retiring, signal.SIGKILL)
+        self.reap()
+        self.listener.close()
+
+    def run(self):
+        """
+        Serves until SIGTERM or SIGINT, or until workers keep dying right
+        after starting.
+
+        Returns:
+            bool: False when it gave up on the workers.
+        """
+        def on_stop(signum, frame):
+            self._stopping = True
+
+        def on_reload(signum, frame):
+            self._reloading = True
+
+        signal.signal(signal.SIGTERM, on_stop)
+        signal.signal(signal.SIGINT, on_stop)
+        signal.signal(signal.SIGHUP, on_reload)
+
+        self.environ = load_environment(self.env_file)
+        self.pids = set(self.spawn() for _ in range(self.workers))
+        logging.info("Started {} workers on {}".format(
+            self.workers, self.listener.getsockname()))
+
+        while not self._stopping:
+            if self._reloading:
+                self._reloading = False
+                self.reload()
+            self.replace(self.reap())
+            time.sleep(0.1)
+
+        self.stop()
+        logging.info("Stopped")
+        return not self.gave_up
+
+
+def main(args):
+    structured_logging.setup(os.environ.get(LOG_FILE_ENV) or None,
+                             level=log_level(os.environ))
+
+    workers = args.workers or int(os.environ.get(WORKERS_ENV) or 0) or None
+    master = Master(args.host, args.port, workers, env_file=args.env_file)
+    print("Serving on http://{}:{} with {} workers".format(
+        args.host, args.port, master.workers))
+    sys.stdout.flush()
+    if not master.run():
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+
+    parser.add_argument('-p', '--port',
+                        help="Port that the server will run on.",
+                        type=int,
+                        default=5050)
+    parser.add_argument('--host',
+                        help="Address to listen on.",
+                        default='0.0.0.0')
+    parser.add_argument('-w', '--workers',
+                        help="Number of worker processes. Defaults to "
+                             "{} or one per core.".format(WORKERS_ENV),
+                        type=int,
+                        default=None)
+    parser.add_argument('--env_file',
+                        help="File of {}* settings, read again on "
+                             "SIGHUP.".format(ENV_PREFIX),
+                        default=None)
+
+    args = parser.parse_args()
+    main(args)
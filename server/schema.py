@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+The collections of the database, their indexes, and a tool to migrate an
+existing database to them.
+
+The number of responses of each response collection is kept in the counters
+collection, under the name of the response collection, instead of in a
+document with _id 'responses' inside the response collection itself. The
+response collections are indexed for time windows and for the form type and
+version, so exports and analytics over a time range scan an index instead of
+the whole collection.
+
+migrate_counters() moves the old counter documents, adding them to whatever the
+counters collection already has, so it can be run again while servers that
+still write the old counters are being replaced. ensure_indexes() creates the
+indexes and check_queries() asks the database with explain which plan it
+picks for the queries they are meant for.
+
+Example:
+    python schema.py --database mongodb://localhost --database_name sadscore
+    python schema.py --prod --check_only
+"""
+import logging
+import time
+from pymongo import ASCENDING, MongoClient
+from pymongo.errors import OperationFailure
+
+# Maps each form type to the collection its responses are stored in.
+RESPONSE_COLLECTIONS = {
+    'men': 'responses_men',
+    'women': 'responses_women',
+}
+
+# Holds {'_id': <response collection>, 'count': <number of responses>}.
+COUNTERS_COLLECTION = 'counters'
+
+# The _id of the counter document inside a response collection, before the
+# counters collection.
+LEGACY_COUNTER_ID = 'responses'
+
+# The indexes of every response collection, by name.
+INDEXES = {
+    'timestamp_secs': [('timestamp_secs', ASCENDING)],
+    'form_type_version_timestamp_secs': [('form_type', ASCENDING),
+                                         ('form_version', ASCENDING),
+                                         ('timestamp_secs', ASCENDING)],
+}
+
+
+def window_queries(form_type, form_version=1, start=0.0, end=None):
+    """
+    Args:
+        form_type (str): A key of RESPONSE_COLLECTIONS.
+        form_version (int): Optional. The version of the form.
+        start (float): Optional. The first timestamp_secs.
+        end (float): Optional. Up to this timestamp_secs. Defaults to now.
+
+    Returns:
+        dict(str->dict): The queries the indexes are for: a time window, and
+            a time window of one version of a form type.
+    """
+    if end is None:
+        end = time.time()
+    window = {'$gte': start, '$lt': end}
+    return {
+        'time_window': {'timestamp_secs': window},
+        'version_time_window': {'form_type': form_type,
+                                'form_version': form_version,
+                                'timestamp_secs': window},
+    }
+
+
+def migrate_counters(db):
+    """
+    Moves the counter document of each response collection into the
+    counters collection, adding its count to what is already there.
+
+    Args:
+        db (pymongo.database.Database): The database.
+
+    Returns:
+        dict(str->int): The count moved for each response collection.
+    """
+    counters = db[COUNTERS_COLLECTION]
+    moved = {}
+    for collection_name in RESPONSE_COLLECTIONS.values():
+        collection = db[collection_name]
+        added = 0
+        while True:
+            old = collection.find_one({'_id': LEGACY_COUNTER_ID})
+            if old is None:
+                break
+
+            # An old server may bump the count in the meantime. Only delete
+            # the count that was added, otherwise add the difference.
+            counters.update_one({'_id': collection_name},
+                                {'$inc': {'count': old['count'] - added}},
+                                upsert=True)
+            added = old['count']
+            if collection.delete_one({'_id': LEGACY_COUNTER_ID,
+                                      'count': added}).deleted_count:
+                break
+        moved[collection_name] = added
+    return moved
+
+
+def ensure_indexes(db):
+    """
+    Creates the indexes of every response collection. Indexes that already
+    exist are left alone.
+
+    Args:
+        db (pymongo.database.Database): The database.
+
+    Returns:
+        dict(str->list(str)): The index names of each response collection.
+    """
+    created = {}
+    for collection_name in RESPONSE_COLLECTIONS.values():
+        collection = db[collection_name]
+        created[collection_name] = [
+            collection.create_index(keys, name=name)
+            for name, keys in INDEXES.items()]
+    return created
+
+
+def plan_stages(plan):
+    """
+    Args:
+        plan (dict): A plan from explain, e.g. its winningPlan.
+
+    Returns:
+        list(str): Every stage of the plan, from the top.
+        list(str): The names of the indexes it scans.
+    """
+    stages = []
+    indexes = []
+    pending = [plan]
+    while pending:
+        stage = pending.pop()
+        # Plans run by the slot based engine nest the plan one level down.
+        if 'queryPlan' in stage:
+            stage = stage['queryPlan']
+        if 'stage' in stage:
+            stages.append(stage['stage'])
+        if 'indexName' in stage:
+            indexes.append(stage['indexName'])
+        if 'inputStage' in stage:
+            pending.append(stage['inputStage'])
+        pending.extend(stage.get('inputStages', []))
+    return stages, indexes
+
+
+def check_queries(db, start=0.0, end=None):
+    """
+    Asks the database which plan it picks for each query of
+    window_queries() on each response collection.
+
+    Args:
+        db (pymongo.database.Database): The database.
+        start (float): Optional. See window_queries().
+        end (float): Optional. See window_queries().
+
+    Returns:
+        list(dict): The collection, query name, stages, indexes and whether
+            the query scans an index instead of the whole collection. A
+            query the database refused to explain has no stages. None when
+            the database has no explain at all, like the in-memory stand-in.
+    """
+    results = []
+    for form_type, collection_name in RESPONSE_COLLECTIONS.items():
+        collection = db[collection_name]
+        queries = window_queries(form_type, start=start, end=end)
+        for name, query in queries.items():
+            cursor = collection.find(query)
+            if not hasattr(cursor, 'explain'):
+                return None
+
+            try:
+                explained = cursor.explain()
+            except OperationFailure as error:
+                logging.warning("Can't explain {} on {}: {}".format(
+                    name, collection_name, error))
+                stages, indexes = [], []
+            else:
+                stages, indexes = plan_stages(
+                    explained['queryPlanner']['winningPlan'])
+
+            results.append({
+                'collection': collection_name,
+                'query': name,
+                'stages': stages,
+                'indexes': indexes,
+                'index_scan': 'IXSCAN' in stages and 'COLLSCAN' not in stages,
+            })
+    return results
+
+
+def main(args):
+    if args.in_memory:
+        import mongomock
+        client = mongomock.MongoClient()
+        database_name = 'sadscore'
+    elif args.database is not None:
+        client = MongoClient(args.database)
+        database_name = args.database_name
+    else:
+        if args.prod:
+            import db_key_prod as db_key
+        else:
+            import db_key_dev as db_key
+        client = MongoClient(db_key.dbKey)
+        database_name = db_key.db_name
+    db = client[database_name]
+
+    if not args.check_only:
+        for collection_name, count in migrate_counters(db).items():
+            print("Moved a count of {} from {} to {}".format(
+                count, collection_name, COUNTERS_COLLECTION))
+        for collection_name, names in ensure_indexes(db).items():
+            print("Indexes of {}: {}".format(collection_name,
+                                             ', '.join(names)))
+
+    results = check_queries(db)
+    if results is None:
+        print("This database can't explain queries, not checking them.")
+        results = []
+
+    for result in results:
+        print("{:<16} {:<20} {:<6} {} {}".format(
+            result['collection'], result['query'],
+            'index' if result['index_scan'] else 'SCAN',
+            ' <- '.join(result['stages']), ', '.join(result['indexes'])))
+    client.close()
+
+    failed = [result for result in results if not result['index_scan']]
+    if failed:
+        logging.warning("{} queries scan whole collections".format(
+            len(failed)))
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+
+    parser.add_argument('--database',
+                        help="MongoDB URI. Uses the db_key module if unset.",
+                        default=None)
+    parser.add_argument('--database_name',
+                        help="With --database, the database to migrate.",
+                        default='sadscore')
+    parser.add_argument('--prod',
+                        help="Migrate the production database.",
+                        default=False,
+                        action='store_true')
+    parser.add_argument('--in_memory',
+                        help="Try it on an empty in-memory stand-in.",
+                        default=False,
+                        action='store_true')
+    parser.add_argument('--check_only',
+                        help="Only check which plans the queries get.",
+                        default=False,
+                        action='store_true')
+
+    args = parser.parse_args()
+    main(args)
@@ -2,21 +2,68 @@
 """
 Server code to track number of visitors and save quiz responses.
 """
+import atexit
 import logging
 import json
+import os
+import threading
 import time
-from flask import Flask, request, send_from_directory, g, redirect, url_for
-from flask import jsonify
+from flask import Flask, request
+from flask import abort, jsonify
 from pymongo import MongoClient
-
-QUIZ_TYPES = set(['men', 'women'])
-
-app = Flask(__name__)
+from ingest import QueueFull, SubmissionQueue
+from live_stats import LiveStats
+import metrics
+from metrics import RequestError
+from pages import LATEST_QUIZ_PAGE, find_quiz_page, static_cache
+from schema import COUNTERS_COLLECTION, RESPONSE_COLLECTIONS
+import structured_logging
+from structured_logging import log_event
+from visit_counter import VisitCounter
+
+# Static files are served from memory by static_file() instead.
+app = Flask(__name__, static_folder=None)
+
+# Connection pool settings. Can be overridden before the first request.
+app.config.update(dict(
+    DATABASE_MAX_POOL_SIZE=100,
+    DATABASE_MIN_POOL_SIZE=0,
+    DATABASE_CONNECT_TIMEOUT_MS=5000,
+    DATABASE_SERVER_SELECTION_TIMEOUT_MS=5000,
+    DATABASE_SOCKET_TIMEOUT_MS=None,
+    VISIT_FLUSH_INTERVAL_SECS=5.0,
+    VISIT_FLUSH_THRESHOLD=1000,
+    VISIT_BUCKET=None,
+    SUBMISSION_BATCH_SIZE=500,
+    SUBMISSION_MAX_LATENCY_SECS=0.5,
+    SUBMISSION_QUEUE_SIZE=10000,
+    SUBMISSION_PUT_TIMEOUT_SECS=1.0,
+    STATS_CHECKPOINT_INTERVAL_SECS=30.0,
+    METRICS_ENABLED=False,
+    LOG_VISIT_SAMPLE_RATE=1.0
+))
+
+# Swapped out for an in-memory stand-in with --in_memory.
+client_class = MongoClient
+
+# One MongoClient per process. MongoClient is thread safe and keeps its own
+# connection pool, so every request shares it instead of reconnecting.
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+# Filled in by enable_metrics(). Nothing is measured until then.
+metrics_registry = metrics.Registry()
+command_timer = None
 
 
 def connect_db():
     """
-    Connects to the signinucsd database on mlab servers.
+    Connects to the signinucsd database on mlab servers. The client is created
+    once per process and reused by every request afterwards.
+
+    A client inherited through fork() can not be used safely, so a new one is
+    created whenever the process id changes.
 
     Raises:
         AssertionError: When no database specified.
@@ -24,17 +71,66 @@ def connect_db():
     Returns:
         MongoClient: Database object to fetch and send data.
     """
+    global _client, _client_pid
+
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
 
     assert 'DATABASE' in app.config, "No database key."
 
-    db = MongoClient(app.config['DATABASE'])
-    return db
+    # Only time database commands when metrics are on.
+    options = {}
+    if command_timer is not None:
+        options['event_listeners'] = [command_timer]
+
+    with _client_lock:
+        if _client is None or _client_pid != pid:
+            # Don't close a client inherited from the parent, its sockets
+            # still belong to the parent process.
+            _client = client_class(
+                app.config['DATABASE'],
+                maxPoolSize=app.config['DATABASE_MAX_POOL_SIZE'],
+                minPoolSize=app.config['DATABASE_MIN_POOL_SIZE'],
+                connectTimeoutMS=app.config['DATABASE_CONNECT_TIMEOUT_MS'],
+                serverSelectionTimeoutMS=app.config[
+                    'DATABASE_SERVER_SELECTION_TIMEOUT_MS'],
+                socketTimeoutMS=app.config['DATABASE_SOCKET_TIMEOUT_MS'],
+                connect=False,
+                **options)
+            _client_pid = pid
+
+    return _client
+
+
+def close_client():
+    """Closes the process wide client. The next request will reconnect."""
+    global _client, _client_pid
+
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+
+
+atexit.register(close_client)
+
+
+def warm_up_db():
+    """
+    Connects to the database before serving so that the first request doesn't
+    pay for server discovery.
+
+    Raises:
+        pymongo.errors.PyMongoError: When the database can not be reached.
+    """
+    connect_db().admin.command('ping')
 
 
 def get_db():
     """
-    Opens a new database connection if there is none yet for the
-    current application context.
+    Gets the database from the process wide client.
 
     Raises:
         AssertionError: When do database name specified.
@@ -42,19 +138,131 @@ def get_db():
     Returns:
         MongoClient: Database object to fetch and send data.
     """
-    if not hasattr(g, 'dbConnection'):
-        g.dbConnection = connect_db()
-
     assert 'DATABASE_NAME' in app.config, 'No database name.'
-    
-    return g.dbConnection[app.config['DATABASE_NAME']]
 
+    return connect_db()[app.config['DATABASE_NAME']]
+
+
+def get_visits_col():
+    """
+    Returns:
+        pymongo.collection.Collection: The collection holding visit counts.
+    """
+    return get_db().visits
+
+
+# Visits are counted in memory and written behind the request.
+visit_counter = VisitCounter(
+    get_visits_col,
+    flush_interval=app.config['VISIT_FLUSH_INTERVAL_SECS'],
+    flush_threshold=app.config['VISIT_FLUSH_THRESHOLD'],
+    bucket=app.config['VISIT_BUCKET'])
+
+def get_stats_col():
+    """
+    Returns:
+        pymongo.collection.Collection: The collection holding the live
+            statistics checkpoints.
+    """
+    return get_db().stats
+
+
+# Statistics of the responses, updated on every inserted submission.
+live_stats = LiveStats(
+    get_stats_col,
+    checkpoint_interval=app.config['STATS_CHECKPOINT_INTERVAL_SECS'])
+
+
+def add_to_stats(collection_name, entries):
+    """
+    Folds submissions into the live statistics once they are inserted.
+
+    Args:
+        collection_name (str): The collection they were inserted into.
+        entries (list(dict)): The inserted submissions.
+    """
+    for entry in entries:
+        live_stats.add(entry['form_type'], entry)
+
+
+# Quiz submissions are inserted in batches behind the request.
+submission_queue = SubmissionQueue(
+    get_db,
+    batch_size=app.config['SUBMISSION_BATCH_SIZE'],
+    max_latency=app.config['SUBMISSION_MAX_LATENCY_SECS'],
+    max_queue_size=app.config['SUBMISSION_QUEUE_SIZE'],
+    put_timeout=app.config['SUBMISSION_PUT_TIMEOUT_SECS'],
+    counters_collection=COUNTERS_COLLECTION,
+    on_inserted=add_to_stats)
+
+# Registered after close_client so they run first and can still write. The
+# last submissions are added to the stats before their last checkpoint.
+atexit.register(visit_counter.stop)
+atexit.register(live_stats.stop)
+atexit.register(submission_queue.stop)
+
+
+def shutdown():
+    """
+    Writes out the pending visits, submissions and statistics, then closes
+    the client. Does what the exit handlers do, for processes that leave
+    without running them, like forked workers.
+    """
+    submission_queue.stop()
+    live_stats.stop()
+    visit_counter.stop()
+    close_client()
+
+
+def send_static(relative_path, version=None):
+    """
+    Sends a file from the static cache. Answers with 304 when the browser
+    already has the latest version.
+
+    Args:
+        relative_path (str): Path of the file in the static folder.
+        version (str): Optional. The ?v= argument, see
+            StaticCache.respond().
+
+    Returns:
+        tuple(bytes, int, dict): Body, status and headers of the response.
+    """
+    return static_cache.respond(relative_path, request.headers,
+                                version=version)
+
+
+@app.route('/static/<path:filename>')
+def static_file(filename):
+    """
+    Handles the static files. Files requested with their version, like the
+    pages link to them, e.g. /static/js/quiz_men_1.js?v=1a2b3c4d5e6f, are
+    cached by the browser for good.
+
+    Args:
+        filename (str): Path of the file in the static folder.
+
+    Returns:
+        str: The file.
+    """
+    return send_static(filename, version=request.args.get('v'))
+
+
+@app.route('/health')
+def health():
+    """
+    Checks that the server can reach the database.
+
+    Returns:
+        str: The status of the database connection. Responds with 503 when
+            the database can not be reached.
+    """
+    try:
+        connect_db().admin.command('ping')
+    except Exception as error:
+        logging.warning("Health check failed: {}".format(error))
+        return jsonify({'status': 'error', 'error': str(error)}), 503
 
-@app.teardown_appcontext
-def close_db(error):
-    """Closes the database again at the end of the request."""
-    if hasattr(g, 'dbConnection'):
-        g.dbConnection.close()
+    return jsonify({'status': 'ok'})
 
 
 @app.route('/')
@@ -70,17 +278,14 @@ def index():
         str: The most up to date version of the quiz in HTML.
     """
 
-    # Logs in the database how many times the site is visited.
-    db = get_db()
-    visits_col = db.visits
-    visits_col.find_one_and_update(
-        {'_id': 'visits'},
-        {'$inc': {'count': 1}},
-        upsert=True)
+    # Counts the visit, it gets written to the database in the background.
+    visit_counter.increment()
 
-    logging.info("IP Address: {}".format(request.remote_addr))
+    log_event(logging.INFO, 'visit',
+              sample_rate=app.config['LOG_VISIT_SAMPLE_RATE'],
+              ip=request.remote_addr)
 
-    return send_from_directory('static', 'html/quiz_men_1.html')
+    return send_static(LATEST_QUIZ_PAGE)
 
 
 @app.route('/quiz/<quiz_type>')
@@ -100,42 +305,12 @@ def quiz(quiz_type):
             return. 
 
     Raises:
-        AssertionError: When quiz type or version are not valid.
+        RequestError: When quiz type or version are not valid.
 
     Returns:
         str: The quiz type and version requested.
     """
-
-    # Check that this quiz type exists.
-    if quiz_type not in QUIZ_TYPES:
-        logging.warning("Incorrect Quiz Type: '{}'".format(quiz_type))
-        raise AssertionError("'{}' is not a valid quiz type.".format(quiz_type))
-
-    # Check that the request has version argument.
-    args = request.args
-    if 'version' not in args:
-        logging.warning("'version' not in args.")
-        
-        raise AssertionError("'version' is not in args.")
-
-    version = int(args['version'])
-
-    # Handle quizzes for men.
-    if quiz_type == 'men':
-        if version == 0:
-            return send_from_directory('static', 'html/index.html')
-        elif version == 1:
-            return send_from_directory('static', 'html/quiz_men_1.html')
-        else:
-            logging.warning("Version does not exist: '{}'".format(version))
-
-            raise AssertionError("Version does not exist: '{}'".format(version))
-
-    # Handle quizzes for women.
-    elif quiz_type == 'women':
-        logging.warning("Women quiz not available yet.")
-
-        raise AssertionError("Women quiz not available yet.")
+    return send_static(find_quiz_page(quiz_type, request.args))
 
 
 @app.route('/data', methods=['POST'])
@@ -148,7 +323,7 @@ def handle_survey_answers():
             have all the quiz response information.
 
     Raises:
-        AssertionError: When the quiz type is not valid.
+        RequestError: When the quiz type is not valid.
     
     Returns:
         str: The ID of the quiz entry in the database.
@@ -161,35 +336,28 @@ def handle_survey_answers():
     timestamp = time.time()
     entry['timestamp_secs'] = timestamp
 
-    entry_string = json.dumps(entry, indent=4, sort_keys=True)
-    logging.debug(entry_string)
-
-    db = get_db()
+    # Copied, the _id gets added when it's queued.
+    log_event(logging.DEBUG, 'submission', entry=lambda: dict(entry))
 
     # Use the form type to access differnt collections.
     form_type = entry['form_type']
 
-    responses_col = None
-
     # Differentiate between men and women quiz.
-    if form_type == 'men':
-        responses_col = db.responses_men
-    elif form_type == 'women':
-        responses_col = db.responses_women
-    else:
+    if form_type not in RESPONSE_COLLECTIONS:
         logging.warning("Form Type is not 'men' or 'women': {}".format(
             form_type))
-        raise AssertionError("Form Type is not 'men' or 'women': {}".format(
-            form_type))
-
-    # Update responses counter.
-    responses_col.find_one_and_update(
-        {'_id': 'responses'},
-        {'$inc': {'count': 1}},
-        upsert=True)
-
-    # Insert the response information.
-    response_id = responses_col.insert_one(entry).inserted_id
+        raise RequestError(
+            'invalid_form_type',
+            "Form Type is not 'men' or 'women': {}".format(form_type))
+
+    # Queue the response information, it gets inserted with the next batch
+    # and the responses counter and the stats are updated once it is.
+    try:
+        response_id = submission_queue.submit(
+            RESPONSE_COLLECTIONS[form_type], entry)
+    except QueueFull as error:
+        logging.warning(str(error))
+        return jsonify({'error': 'Too many submissions, try again.'}), 503
 
     resp = {"id": str(response_id)}
 
@@ -199,19 +367,111 @@ def handle_survey_answers():
 @app.route('/analytics')
 def analytics():
     """
-    Handles accessing the visit count of the website.
+    Handles accessing the visit count of the website. The count includes
+    visits that have not been written to the database yet.
 
     Returns:
         str: The visit count of the website.
     """
-    db = get_db()
-    visits_col = db.visits
+    visits_col = get_visits_col()
     visit_count = visits_col.find_one(
         {'_id': 'visits'})
 
+    if visit_count is None:
+        visit_count = {'_id': 'visits', 'count': 0}
+
+    pending = visit_counter.pending()
+    visit_count['persisted'] = visit_count['count']
+    visit_count['pending'] = pending
+    visit_count['count'] += pending
+
     return jsonify(visit_count)
 
 
+@app.route('/stats')
+def stats():
+    """
+    Handles accessing the live statistics of the responses: counts, means and
+    variances of the number questions, a histogram of the total scores and
+    how often each yes/no question was answered yes.
+
+    Returns:
+        str: The statistics of each quiz type.
+    """
+    return jsonify(live_stats.summary())
+
+
+@app.route('/metrics')
+def get_metrics():
+    """
+    Handles accessing the request and database metrics, see metrics.py. Only
+    there when metrics are turned on with --metrics.
+
+    Returns:
+        str: Every metric in the Prometheus text format.
+    """
+    if not app.config['METRICS_ENABLED']:
+        abort(404)
+
+    return (metrics_registry.render(), 200,
+            {'Content-Type': metrics.CONTENT_TYPE})
+
+
+def enable_metrics():
+    """
+    Starts measuring every request and database command for /metrics. Has to
+    be called before the first request.
+    """
+    global command_timer
+
+    if app.config['METRICS_ENABLED']:
+        return
+    app.config['METRICS_ENABLED'] = True
+
+    metrics.instrument_app(app, metrics_registry)
+    command_timer = metrics.CommandTimer(metrics_registry)
+
+    metrics_registry.gauge(
+        'sadscore_submissions_pending',
+        'Submissions waiting to be inserted.').set_function(
+            submission_queue.pending)
+    metrics_registry.gauge(
+        'sadscore_visits_pending',
+        'Visits not written to the database yet.').set_function(
+            visit_counter.pending)
+
+    # The next client is made with the command timer.
+    close_client()
+
+
+def rebuild_stats():
+    """
+    Recomputes the live statistics of every quiz type from the stored
+    responses.
+    """
+    db = get_db()
+    for form_type, collection_name in RESPONSE_COLLECTIONS.items():
+        count = live_stats.rebuild(form_type, db[collection_name])
+        print("Rebuilt '{}' stats from {} responses".format(form_type, count))
+
+
+def use_in_memory_db():
+    """
+    Serves from an in-memory stand-in for MongoDB instead of a real server.
+    Needs the mongomock package.
+    """
+    global client_class
+
+    import mongomock
+
+    client_class = mongomock.MongoClient
+    close_client()
+    app.config.update(dict(
+        DATABASE='mongodb://localhost',
+        DATABASE_NAME='sadscore'
+    ))
+
+
 def main(args):
 
     # Set up logging.
@@ -220,10 +480,14 @@ def main(args):
     else:
         log_file_path = 'sadscore.log'
 
-    logging.basicConfig(filename=log_file_path, level=logging.INFO)
+    structured_logging.setup(log_file_path, level=logging.INFO)
+    app.config['LOG_VISIT_SAMPLE_RATE'] = args.log_visit_sample_rate
 
     # Switching between the production and development databases.
-    if args.prod:
+    if args.in_memory:
+        use_in_memory_db()
+        print("Running with IN MEMORY database")
+    elif args.prod:
         import db_key_prod as db_key
         print("Running in PRODUCTION")
     else:
@@ -231,13 +495,38 @@ def main(args):
         print("Running in DEVELOPMENT")
 
     # Load default config and override config from an environment variable
+    if not args.in_memory:
+        app.config.update(dict(
+            DATABASE=db_key.dbKey,
+            USERNAME=db_key.username,
+            PASSWORD=db_key.password,
+            DATABASE_NAME=db_key.db_name
+        ))
+
     app.config.update(dict(
-        DATABASE=db_key.dbKey,
-        USERNAME=db_key.username,
-        PASSWORD=db_key.password,
-        DATABASE_NAME=db_key.db_name
+        DATABASE_MAX_POOL_SIZE=args.pool_size,
+        DATABASE_CONNECT_TIMEOUT_MS=args.db_timeout_ms,
+        DATABASE_SERVER_SELECTION_TIMEOUT_MS=args.db_timeout_ms
     ))
 
+    visit_counter.bucket = args.visit_bucket
+
+    # Pick up changes to the static files while developing.
+    static_cache.reload = args.debug
+
+    if args.rebuild_stats:
+        rebuild_stats()
+        return
+
+    if args.metrics:
+        enable_metrics()
+
+    # Connect once up front instead of on the first request.
+    try:
+        warm_up_db()
+    except Exception as error:
+        logging.warning("Database warm up failed: {}".format(error))
+
     # Launch the webserver.
     app.run(
         host='0.0.0.0',
@@ -262,10 +551,39 @@ if __name__ == '__main__':
                         default=False,
                         action='store_true')
 
+    parser.add_argument('--in_memory',
+                        help="Use an in-memory stand-in for the database.",
+                        default=False,
+                        action='store_true')
+
     parser.add_argument('--no_log',
                         help="Whether to not keep logs.",
                         default=False,
                         action='store_true')
+    parser.add_argument('--log_visit_sample_rate',
+                        help="Share of visits to log, e.g. 0.1.",
+                        type=float,
+                        default=1.0)
+    parser.add_argument('--pool_size',
+                        help="Max number of database connections per process.",
+                        type=int,
+                        default=100)
+    parser.add_argument('--db_timeout_ms',
+                        help="Database connect and server selection timeout.",
+                        type=int,
+                        default=5000)
+    parser.add_argument('--visit_bucket',
+                        help="Also count visits per 'day' or 'hour'.",
+                        choices=['day', 'hour'],
+                        default=None)
+    parser.add_argument('--metrics',
+                        help="Measure requests and serve them at /metrics.",
+                        default=False,
+                        action='store_true')
+    parser.add_argument('--rebuild_stats',
+                        help="Recompute the /stats statistics and exit.",
+                        default=False,
+                        action='store_true')
 
     args = parser.parse_args()
     main(args)
@@ -0,0 +1,309 @@
+"""
+Serves the static files from memory.
+
+Every file under the static folder is read once at startup along with its
+gzip (and brotli, when the brotli package is installed) version. Responses
+carry a strong ETag so browsers can revalidate with a 304 instead of
+downloading the file again.
+
+The links from the HTML pages to other static files get the version of the
+file stamped in, e.g. /static/js/index.js?v=1a2b3c4d5e6f, so browsers keep
+those files for good and only fetch them again when the page links a new
+version.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Cache-Control for requests with the ?v= version of the file.
+VERSIONED_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Cache-Control for everything else. Browsers revalidate with the ETag.
+DEFAULT_CACHE_CONTROL = 'no-cache'
+
+# Where the static folder is served from.
+STATIC_URL = '/static/'
+
+# Links to static files in the HTML pages, e.g. src="/static/js/index.js".
+STATIC_LINK = re.compile(r'((?:src|href)=")' + re.escape(STATIC_URL) +
+                         r'([^"?#]+)"')
+
+# Characters of the ETag used as the version of a file.
+VERSION_LENGTH = 12
+
+# Types that are worth compressing.
+COMPRESSIBLE_TYPES = set([
+    'application/javascript',
+    'application/json',
+    'image/svg+xml',
+    'image/vnd.microsoft.icon',
+    'image/x-icon',
+])
+
+
+class StaticAsset:
+    """
+    One static file held in memory.
+
+    Attributes:
+        path (str): Absolute path to the file.
+        mtime (float): Modification time of the file when it was read.
+        mimetype (str): The Content-Type to send.
+        etag (str): Strong ETag of the uncompressed file.
+        bodies (dict(str->bytes)): The file for each Content-Encoding. The
+            uncompressed file is under 'identity'.
+    """
+    __slots__ = ['path', 'mtime', 'mimetype', 'etag', 'bodies']
+
+    def __init__(self, path, body=None):
+        """
+        Args:
+            path (str): Absolute path to the file.
+            body (bytes): Optional. What to serve instead of the file as it
+                is on disk, e.g. a page with versioned links.
+        """
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+
+        if body is None:
+            with open(path, 'rb') as asset_file:
+                body = asset_file.read()
+
+        mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if mimetype.startswith('text/') or mimetype == 'application/javascript':
+            mimetype += '; charset=utf-8'
+        self.mimetype = mimetype
+
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.bodies = {'identity': body}
+
+        if mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES:
+            # mtime=0 so the same file always compresses to the same bytes.
+            gzipped = gzip.compress(body, 9, mtime=0)
+            if len(gzipped) < len(body):
+                self.bodies['gzip'] = gzipped
+
+            if brotli is not None:
+                brotlied = brotli.compress(body)
+                if len(brotlied) < len(body):
+                    self.bodies['br'] = brotlied
+
+    @property
+    def version(self):
+        """
+        Returns:
+            str: The version put in links to the file, see STATIC_URL.
+        """
+        return self.etag[:VERSION_LENGTH]
+
+    def is_page(self):
+        return self.mimetype.startswith('text/html')
+
+    def etag_for(self, encoding):
+        """
+        Args:
+            encoding (str): 'identity' | 'gzip' | 'br'.
+
+        Returns:
+            str: The quoted ETag of that encoding of the file.
+        """
+        if encoding == 'identity':
+            return '"{}"'.format(self.etag)
+        return '"{}-{}"'.format(self.etag, encoding)
+
+
+def accepted_encodings(accept_encoding):
+    """
+    Parses an Accept-Encoding header.
+
+    Args:
+        accept_encoding (str): The header value. May be None.
+
+    Returns:
+        set(str): Encodings the client accepts.
+    """
+    accepted = set()
+    if not accept_encoding:
+        return accepted
+
+    for part in accept_encoding.split(','):
+        pieces = part.strip().split(';')
+        encoding = pieces[0].strip().lower()
+        quality = 1.0
+        for param in pieces[1:]:
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(encoding)
+    return accepted
+
+
+def stamp_versions(page, assets):
+    """
+    Puts the version of each static file a page links to in the link.
+
+    Args:
+        page (StaticAsset): An HTML page.
+        assets (dict(str->StaticAsset)): The files by path in the static
+            folder.
+
+    Returns:
+        StaticAsset: The page with versioned links. Links to files that
+            aren't in assets are left alone.
+    """
+    def versioned_link(match):
+        asset = assets.get(match.group(2))
+        if asset is None:
+            return match.group(0)
+        return '{}{}{}?v={}"'.format(match.group(1), STATIC_URL,
+                                     match.group(2), asset.version)
+
+    text = page.bodies['identity'].decode('utf-8')
+    return StaticAsset(page.path,
+                       STATIC_LINK.sub(versioned_link, text).encode('utf-8'))
+
+
+class StaticCache:
+    """
+    All the static files, held in memory.
+
+    Attributes:
+        root (str): The static folder.
+        reload (bool): Whether to reread files that changed on disk. Meant for
+            development.
+    """
+
+    def __init__(self, root, reload=False):
+        self.root = os.path.abspath(root)
+        self.reload = reload
+        self._assets = {}
+        self._lock = threading.Lock()
+
+    def load_all(self):
+        """
+        Reads every file under the static folder.
+
+        Returns:
+            int: The number of files loaded.
+        """
+        assets = {}
+        for dir_path, _, file_names in os.walk(self.root):
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                relative_path = os.path.relpath(path, self.root)
+                assets[relative_path.replace(os.sep, '/')] = StaticAsset(path)
+
+        # Pages are stamped once every file they may link to is loaded.
+        for relative_path, asset in assets.items():
+            if asset.is_page():
+                assets[relative_path] = stamp_versions(asset, assets)
+
+        with self._lock:
+            self._assets = assets
+
+        return len(assets)
+
+    def get(self, relative_path):
+        """
+        Gets a file from the cache.
+
+        Args:
+            relative_path (str): Path of the file in the static folder.
+
+        Returns:
+            StaticAsset: The file. None when it doesn't exist.
+        """
+        asset = self._assets.get(relative_path)
+
+        if self.reload:
+            asset = self._reload(relative_path, asset)
+
+        return asset
+
+    def _reload(self, relative_path, asset):
+        path = os.path.normpath(os.path.join(self.root, relative_path))
+
+        # Never read outside of the static folder.
+        if not path.startswith(self.root + os.sep):
+            return None
+
+        if not os.path.isfile(path):
+            with self._lock:
+                self._assets.pop(relative_path, None)
+            return None
+
+        if asset is None or os.path.getmtime(path) != asset.mtime:
+            asset = StaticAsset(path)
+            if asset.is_page():
+                asset = stamp_versions(asset, self._assets)
+            with self._lock:
+                self._assets[relative_path] = asset
+
+        return asset
+
+    def respond(self, relative_path, headers, version=None):
+        """
+        Builds the response for a static file.
+
+        Args:
+            relative_path (str): Path of the file in the static folder.
+            headers (dict): The request headers.
+            version (str): Optional. The ?v= argument of the URL. When it's
+                the version of the file the browser can keep it for good.
+
+        Returns:
+            tuple(bytes, int, dict): Body, status and headers of the response.
+                404 when the file doesn't exist.
+        """
+        asset = self.get(relative_path)
+        if asset is None:
+            return b'Not Found', 404, {'Content-Type': 'text/plain'}
+
+        # Prefer the smallest encoding the client accepts.
+        accepted = accepted_encodings(headers.get('Accept-Encoding'))
+        encoding = 'identity'
+        for candidate in ('br', 'gzip'):
+            if candidate in accepted and candidate in asset.bodies:
+                encoding = candidate
+                break
+
+        # Files reloaded while developing change under the same version.
+        versioned = (version is not None and version == asset.version and
+                     not self.reload)
+
+        etag = asset.etag_for(encoding)
+        response_headers = {
+            'ETag': etag,
+            'Cache-Control': (VERSIONED_CACHE_CONTROL if versioned
+                              else DEFAULT_CACHE_CONTROL),
+            'Vary': 'Accept-Encoding',
+        }
+
+        # The file hasn't changed since the browser last got it.
+        if_none_match = headers.get('If-None-Match')
+        if if_none_match:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            known_tags = [asset.etag_for(name) for name in asset.bodies]
+            if '*' in tags or any(tag.replace('W/', '', 1) in known_tags
+                                  for tag in tags):
+                return b'', 304, response_headers
+
+        body = asset.bodies[encoding]
+        response_headers['Content-Type'] = asset.mimetype
+        response_headers['Content-Length'] = str(len(body))
+        if encoding != 'identity':
+            response_headers['Content-Encoding'] = encoding
+
+        return body, 200, response_headers
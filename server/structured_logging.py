@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Logging that never makes a request wait on disk.
+
+setup() points the root logger at a queue. A QueueListener thread takes
+records off it and writes them out as one compact JSON object per line, so a
+request only pays for putting a record on the queue. When the queue is full
+the record is dropped and counted instead of waiting for room.
+
+log_event() logs an event with fields. Fields given as functions are only
+called when the level is enabled, and events can be sampled, so high volume
+events like visits can be kept to a share of them.
+
+Example:
+    structured_logging.setup('sadscore.log')
+    log_event(logging.INFO, 'visit', sample_rate=0.1, ip='127.0.0.1')
+    log_event(logging.DEBUG, 'submission', entry=lambda: dict(entry))
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+
+# Records waiting to be written before new ones get dropped.
+QUEUE_SIZE = 10000
+
+# Attributes every LogRecord has, so they aren't written out as fields.
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | set(['message'])
+
+_listener = None
+_listener_pid = None
+_handler = None
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as one line of JSON: time, level, logger and message,
+    then the fields of log_event() or anything passed as extra.
+    """
+
+    def format(self, record):
+        line = {
+            'time': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES and not key.startswith('_'):
+                line[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            line['exception'] = record.exc_text
+        return json.dumps(line, separators=(',', ':'), default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records on a bounded queue without ever waiting for room.
+
+    Attributes:
+        dropped (int): Records dropped because the queue was full.
+    """
+
+    def __init__(self, record_queue):
+        logging.handlers.QueueHandler.__init__(self, record_queue)
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def prepare(self, record):
+        """
+        Resolves the message and any traceback now, while the objects they
+        refer to still exist, but leaves formatting to the listener.
+        """
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+
+def setup(file_name=None, level=logging.INFO, queue_size=QUEUE_SIZE):
+    """
+    Sends every record of the root logger through a queue to a background
+    thread that writes it as JSON. Replaces the handlers the root logger had.
+    Can be called again, e.g. in a forked worker, to start a new listener.
+
+    Args:
+        file_name (str): Optional. File to append to. Defaults to stderr.
+        level (int): Optional. The lowest level logged.
+        queue_size (int): Optional. See QUEUE_SIZE.
+
+    Returns:
+        DroppingQueueHandler: The handler of the root logger.
+    """
+    global _listener, _listener_pid, _handler
+
+    stop()
+
+    if file_name is None:
+        output = logging.StreamHandler()
+    else:
+        output = logging.FileHandler(file_name)
+    output.setFormatter(JsonFormatter())
+
+    handler = DroppingQueueHandler(queue.Queue(queue_size))
+    _listener = logging.handlers.QueueListener(handler.queue, output)
+    _listener.start()
+    _listener_pid = os.getpid()
+    _handler = handler
+
+    root = logging.getLogger()
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+    return handler
+
+
+def stop():
+    """
+    Writes out the records still queued and stops the listener thread.
+    """
+    global _listener
+
+    # A listener inherited through fork() has no thread in this process.
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+        for output in _listener.handlers:
+            output.close()
+    _listener = None
+
+
+atexit.register(stop)
+
+
+# Holds the lock of the queue across fork(), so a forked worker never gets
+# a copy of it locked by the listener thread, which doesn't exist there.
+def _before_fork():
+    if _handler is not None:
+        _handler.queue.mutex.acquire()
+
+
+def _after_fork():
+    if _handler is not None:
+        _handler.queue.mutex.release()
+
+
+os.register_at_fork(before=_before_fork, after_in_parent=_after_fork,
+                    after_in_child=_after_fork)
+
+
+def log_event(level, event, sample_rate=1.0, logger=None, **fields):
+    """
+    Logs an event with fields, only doing the work when it gets logged.
+
+    Args:
+        level (int): E.g. logging.INFO.
+        event (str): Name of the event, the message of the record.
+        sample_rate (float): Optional. Share of the events to log, the rest
+            are skipped before anything is built. Logged as a field when
+            below 1, so counts can be scaled back up.
+        logger (logging.Logger): Optional. Defaults to the root logger.
+        **fields: Values to log with it, not named like an attribute of
+            logging.LogRecord. Functions are called for their value, only
+            when the event is logged.
+
+    Returns:
+        bool: Whether the event was logged.
+    """
+    if logger is None:
+        logger = logging.getLogger()
+    if not logger.isEnabledFor(level):
+        return False
+    if sample_rate < 1.0 and random.random() >= sample_rate:
+        return False
+
+    extra = {'event': event}
+    for key, value in fields.items():
+        extra[key] = value() if callable(value) else value
+    if sample_rate < 1.0:
+        extra['sample_rate'] = sample_rate
+
+    logger.log(level, event, extra=extra)
+    return True
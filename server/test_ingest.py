@@ -0,0 +1,60 @@
+"""
+Tests for ingest.py, run from the server directory with pytest.
+"""
+import mongomock
+from pymongo import errors
+import ingest
+from ingest import SubmissionQueue
+
+
+class FlakyCollection:
+    """
+    Inserts the first half of the first insert_many, then loses the
+    connection. The first update_one loses the connection before it runs.
+    """
+
+    def __init__(self, collection, state):
+        self.collection = collection
+        self.state = state
+
+    def insert_many(self, documents, ordered=True):
+        if not self.state['insert_failed']:
+            self.state['insert_failed'] = True
+            self.collection.insert_many(documents[:len(documents) // 2])
+            raise errors.AutoReconnect('connection lost')
+        return self.collection.insert_many(documents, ordered=ordered)
+
+    def update_one(self, *args, **kwargs):
+        if not self.state['update_failed']:
+            self.state['update_failed'] = True
+            raise errors.AutoReconnect('connection lost')
+        return self.collection.update_one(*args, **kwargs)
+
+
+class FlakyDb:
+    def __init__(self):
+        self.db = mongomock.MongoClient().sadscore
+        self.state = {'insert_failed': False, 'update_failed': False}
+
+    def __getitem__(self, name):
+        return FlakyCollection(self.db[name], self.state)
+
+
+def test_retries_count_what_made_it_in(monkeypatch):
+    monkeypatch.setattr(ingest.time, 'sleep', lambda secs: None)
+    db = FlakyDb()
+    inserted = []
+    submissions = SubmissionQueue(
+        lambda: db, on_inserted=lambda name, entries: inserted.extend(entries))
+
+    for i in range(10):
+        submissions.submit('responses_men', {'total_score': i})
+    submissions.flush()
+    submissions.stop()
+
+    # The retry gets duplicate key errors for the first half, which are in.
+    assert db.state == {'insert_failed': True, 'update_failed': True}
+    assert db.db.responses_men.count_documents({}) == 10
+    assert db.db.counters.find_one({'_id': 'responses_men'})['count'] == 10
+    assert sorted(entry['total_score'] for entry in inserted) == list(
+        range(10))
@@ -0,0 +1,21 @@
+"""
+Tests for load_test.py, run from the server directory with pytest.
+"""
+from load_test import percentile
+
+
+def test_percentile_nearest_rank():
+    hundred = list(range(1, 101))
+    assert percentile(hundred, 0.5) == 50
+    assert percentile(hundred, 0.95) == 95
+    assert percentile(hundred, 0.99) == 99
+    assert percentile(hundred, 0.07) == 7
+    assert percentile(hundred, 1.0) == 100
+
+    two_hundred = list(range(1, 201))
+    assert percentile(two_hundred, 0.95) == 190
+    assert percentile(two_hundred, 0.99) == 198
+
+    assert percentile([3.0], 0.0) == 3.0
+    assert percentile([1.0, 2.0, 3.0], 0.5) == 2.0
+    assert percentile([], 0.99) == 0.0
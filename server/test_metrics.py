@@ -0,0 +1,44 @@
+"""
+Tests for metrics.py, run from the server directory with pytest.
+"""
+import random
+import string
+from flask import Flask
+import metrics
+import server
+
+
+def error_series(registry):
+    """
+    Returns:
+        list(str): The sample lines of the request error counter.
+    """
+    return [line for line in registry.render().splitlines()
+            if line.startswith('sadscore_request_errors_total{')]
+
+
+def test_error_reasons_stay_fixed():
+    # A fresh app, since metrics can't be turned on after a request.
+    app = Flask(__name__)
+    app.add_url_rule('/quiz/<quiz_type>', 'quiz', server.quiz)
+    registry = metrics.Registry()
+    metrics.instrument_app(app, registry)
+    client = app.test_client()
+
+    rng = random.Random(0)
+    for _ in range(100):
+        quiz_type = ''.join(rng.choice(string.ascii_letters + ':')
+                            for _ in range(8))
+        response = client.get('/quiz/{}?version=1'.format(quiz_type))
+        assert response.status_code == 500
+
+        version = rng.randint(2, 10 ** 6)
+        response = client.get('/quiz/men?version={}'.format(version))
+        assert response.status_code == 500
+
+    assert error_series(registry) == [
+        'sadscore_request_errors_total'
+        '{route="quiz",reason="invalid_quiz_type"} 100',
+        'sadscore_request_errors_total'
+        '{route="quiz",reason="invalid_version"} 100',
+    ]
@@ -0,0 +1,67 @@
+"""
+Tests for schema.py, run from the server directory with pytest.
+"""
+import mongomock
+from pymongo.errors import OperationFailure
+import schema
+
+INDEX_PLAN = {'stage': 'FETCH',
+              'inputStage': {'stage': 'IXSCAN',
+                             'indexName': 'timestamp_secs'}}
+SCAN_PLAN = {'stage': 'COLLSCAN'}
+
+
+class ExplainedCursor:
+    def __init__(self, plan):
+        self.plan = plan
+
+    def explain(self):
+        if self.plan is None:
+            raise OperationFailure('not authorized')
+        return {'queryPlanner': {'winningPlan': self.plan}}
+
+
+class ExplainedCollection:
+    """A collection whose every query gets the same plan."""
+
+    def __init__(self, plan):
+        self.plan = plan
+
+    def find(self, query):
+        return ExplainedCursor(self.plan)
+
+
+def test_check_queries_reads_the_plans():
+    db = {'responses_men': ExplainedCollection(INDEX_PLAN),
+          'responses_women': ExplainedCollection(SCAN_PLAN)}
+    results = schema.check_queries(db)
+
+    by_collection = dict((result['collection'], result['index_scan'])
+                         for result in results)
+    assert by_collection == {'responses_men': True, 'responses_women': False}
+    assert results[0]['stages'] == ['FETCH', 'IXSCAN']
+    assert results[0]['indexes'] == ['timestamp_secs']
+
+
+def test_check_queries_without_explain():
+    # Refused explains fail the check, a database without explain skips it.
+    db = {'responses_men': ExplainedCollection(None),
+          'responses_women': ExplainedCollection(INDEX_PLAN)}
+    results = schema.check_queries(db)
+    assert [result['index_scan'] for result in results] == [
+        False, False, True, True]
+
+    assert schema.check_queries(mongomock.MongoClient().sadscore) is None
+
+
+def test_migrate_counters_adds_to_the_counters():
+    db = mongomock.MongoClient().sadscore
+    db.responses_men.insert_one({'_id': 'responses', 'count': 5})
+    db.counters.insert_one({'_id': 'responses_men', 'count': 2})
+
+    assert schema.migrate_counters(db) == {'responses_men': 5,
+                                           'responses_women': 0}
+    assert schema.migrate_counters(db) == {'responses_men': 0,
+                                           'responses_women': 0}
+    assert db.counters.find_one({'_id': 'responses_men'})['count'] == 7
+    assert db.responses_men.find_one({'_id': 'responses'}) is None
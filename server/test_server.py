@@ -0,0 +1,56 @@
+"""
+Tests for server.py, run from the server directory with pytest.
+"""
+import json
+import mongomock
+import pytest
+import server
+
+
+@pytest.fixture
+def counting_client(monkeypatch):
+    """
+    Serves from an in-memory database whose client counts how many times it
+    was constructed.
+
+    Returns:
+        list: One item per client constructed.
+    """
+    constructed = []
+
+    class CountingClient(mongomock.MongoClient):
+        def __init__(self, *args, **kwargs):
+            constructed.append(args)
+            mongomock.MongoClient.__init__(self, *args, **kwargs)
+
+    server.close_client()
+    monkeypatch.setattr(server, 'client_class', CountingClient)
+    monkeypatch.setitem(server.app.config, 'DATABASE', 'mongodb://localhost')
+    monkeypatch.setitem(server.app.config, 'DATABASE_NAME', 'sadscore_test')
+    yield constructed
+    # Write out what the tests left while the database is still set.
+    server.submission_queue.flush()
+    server.live_stats.checkpoint()
+    server.close_client()
+
+
+def test_requests_share_one_client(counting_client):
+    client = server.app.test_client()
+    for _ in range(10):
+        assert client.get('/analytics').status_code == 200
+        assert client.get('/health').status_code == 200
+
+    assert len(counting_client) == 1
+
+
+def test_stats_only_count_inserted_submissions(counting_client):
+    client = server.app.test_client()
+    entry = {'form_type': 'men', 'total_score': 10,
+             'responses': {'height_cm': {'value': '180'}}}
+    response = client.post('/data', data={'data': json.dumps(entry)})
+    assert response.status_code == 200
+
+    # Counted once, when it is written, not when it is queued.
+    server.submission_queue.flush()
+    stats = client.get('/stats').get_json()
+    assert stats['men']['count'] == 1
@@ -0,0 +1,28 @@
+"""
+Tests for static_cache.py, run from the server directory with pytest.
+"""
+import os
+from static_cache import (DEFAULT_CACHE_CONTROL, VERSIONED_CACHE_CONTROL,
+                          StaticCache)
+
+STATIC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'static')
+
+
+def test_pages_link_versioned_files():
+    cache = StaticCache(STATIC_FOLDER)
+    cache.load_all()
+
+    script = cache.get('js/quiz_men_1.js')
+    page = cache.get('html/quiz_men_1.html').bodies['identity']
+    link = '/static/js/quiz_men_1.js?v={}'.format(script.version)
+    assert link.encode('utf-8') in page
+
+    _, status, headers = cache.respond('js/quiz_men_1.js', {},
+                                       version=script.version)
+    assert status == 200
+    assert headers['Cache-Control'] == VERSIONED_CACHE_CONTROL
+
+    # A version the file no longer has isn't kept for good.
+    _, _, headers = cache.respond('js/quiz_men_1.js', {}, version='old')
+    assert headers['Cache-Control'] == DEFAULT_CACHE_CONTROL
@@ -0,0 +1,81 @@
+"""
+Tests for visit_counter.py, run from the server directory with pytest.
+"""
+import time
+from pymongo.errors import BulkWriteError
+import pytest
+from visit_counter import VisitCounter
+
+
+class PartlyFailingCollection:
+    """
+    Applies every update of a bulk write except the ones at failing_indexes,
+    then raises like an unordered bulk write does.
+    """
+
+    def __init__(self, failing_indexes):
+        self.failing_indexes = set(failing_indexes)
+        self.counts = {}
+
+    def bulk_write(self, updates, ordered=True):
+        write_errors = []
+        for index, update in enumerate(updates):
+            if index in self.failing_indexes:
+                write_errors.append({'index': index, 'code': 11000,
+                                     'errmsg': 'duplicate key'})
+                continue
+            key = update._filter['_id']
+            self.counts[key] = (self.counts.get(key, 0) +
+                                update._doc['$inc']['count'])
+        if write_errors:
+            raise BulkWriteError({'writeErrors': write_errors,
+                                  'writeConcernErrors': []})
+
+
+def make_counter(collection):
+    """
+    Returns:
+        VisitCounter: Counts visits per day, only flushes when asked to.
+    """
+    return VisitCounter(lambda: collection, bucket='day',
+                        flush_interval=3600.0, flush_threshold=float('inf'))
+
+
+def test_failed_flush_only_retries_the_failed_updates():
+    collection = PartlyFailingCollection(failing_indexes=[1])
+    counter = make_counter(collection)
+    counter.increment(5)
+    bucket = counter.bucket_id(time.time())
+
+    with pytest.raises(BulkWriteError):
+        counter.flush()
+
+    # The total was written, only the bucket is left to write.
+    assert counter.pending() == 0
+    assert collection.counts == {'visits': 5}
+
+    collection.failing_indexes = set()
+    counter.flush()
+    counter.stop()
+    assert collection.counts == {'visits': 5, bucket: 5}
+
+
+def test_visits_being_written_are_still_pending():
+    collection = PartlyFailingCollection(failing_indexes=[])
+    counter = make_counter(collection)
+    seen = []
+
+    # Looks at the count while the flush is writing.
+    bulk_write = collection.bulk_write
+
+    def recording_bulk_write(updates, ordered=True):
+        seen.append(counter.pending())
+        return bulk_write(updates, ordered)
+
+    collection.bulk_write = recording_bulk_write
+    counter.increment(3)
+    assert counter.flush() == 3
+    counter.stop()
+
+    assert seen == [3]
+    assert counter.pending() == 0
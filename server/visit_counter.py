@@ -0,0 +1,322 @@
+"""
+Write-behind counter for page visits.
+
+Visits are added up in memory and written to the database as a single $inc
+every few seconds, or sooner once enough have piled up, so page views never
+wait on the database.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+BUCKET_FORMATS = {
+    'day': '%Y-%m-%d',
+    'hour': '%Y-%m-%dT%H',
+}
+
+
+class VisitCounter:
+    """
+    Counts visits in memory and flushes them to the database in the
+    background.
+
+    Attributes:
+        get_collection (function): Returns the collection to write counts to.
+        counter_id (str): The _id of the total count document.
+        flush_interval (float): Seconds between background flushes.
+        flush_threshold (int): Pending count that triggers an early flush.
+        bucket (str): Optional. 'day' | 'hour'. Also keeps a count per time
+            bucket in documents with _id '<counter_id>:<bucket>'.
+    """
+
+    def __init__(self, get_collection, counter_id='visits', flush_interval=5.0,
+                 flush_threshold=1000, bucket=None):
+        if bucket is not None and bucket not in BUCKET_FORMATS:
+            raise AssertionError("Bucket is not 'day' or 'hour': {}".format(
+                bucket))
+
+        self.get_collection = get_collection
+        self.counter_id = counter_id
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.bucket = bucket
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = 0
+        self._pending_buckets = {}
+        self._in_flight = 0
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self._thread_pid = None
+
+    def bucket_id(self, timestamp):
+        """
+        Gets the _id of the bucket document a timestamp belongs to.
+
+        Args:
+            timestamp (float): Seconds since the epoch.
+
+        Returns:
+            str: The bucket document _id.
+        """
+        bucket_name = time.strftime(BUCKET_FORMATS[self.bucket],
+                                    time.gmtime(timestamp))
+        return '{}:{}'.format(self.counter_id, bucket_name)
+
+    def increment(self, amount=1):
+        """
+        Adds visits to the pending count. Never touches the database.
+
+        Args:
+            amount (int): Optional. Defaults to 1. How many visits to add.
+        """
+        self._ensure_started()
+
+        with self._lock:
+            self._pending += amount
+            if self.bucket is not None:
+                key = self.bucket_id(time.time())
+                self._pending_buckets[key] = (
+                    self._pending_buckets.get(key, 0) + amount)
+            pending = self._pending
+
+        if pending >= self.flush_threshold:
+            self._request_flush()
+
+    def pending(self):
+        """
+        Returns:
+            int: Visits counted but not yet written to the database,
+                including the ones a flush is writing right now. Those may
+                already be in the database for the moment until the flush
+                returns.
+        """
+        with self._lock:
+            return self._pending + self._in_flight
+
+    def flush(self):
+        """
+        Writes all pending visits to the database in one round trip. The
+        visits of the updates that failed are put back so the next flush
+        retries them.
+
+        Returns:
+            int: The number of visits written.
+        """
+        with self._flush_lock:
+            amount, buckets = self._take_pending()
+            if amount == 0 and not buckets:
+                return 0
+
+            try:
+                self.get_collection().bulk_write(
+                    self._updates(amount, buckets), ordered=False)
+            except Exception as error:
+                self._finish_flush(*self._unwritten(amount, buckets, error))
+                raise
+
+            self._finish_flush()
+            return amount
+
+    def _take_pending(self):
+        # Still counted by pending() until the flush is done.
+        with self._lock:
+            amount = self._pending
+            buckets = self._pending_buckets
+            self._pending = 0
+            self._pending_buckets = {}
+            self._in_flight = amount
+        return amount, buckets
+
+    def _finish_flush(self, amount=0, buckets=None):
+        """
+        Ends a flush, putting back the visits that weren't written.
+
+        Args:
+            amount (int): Optional. Visits of the total to write again.
+            buckets (dict(str->int)): Optional. Visits of each bucket to
+                write again.
+        """
+        if buckets is None:
+            buckets = {}
+        with self._lock:
+            self._in_flight = 0
+            self._pending += amount
+            for key, count in buckets.items():
+                self._pending_buckets[key] = (
+                    self._pending_buckets.get(key, 0) + count)
+
+    def _unwritten(self, amount, buckets, error):
+        """
+        Picks out the visits of a flush that didn't get written.
+
+        Args:
+            amount (int): Visits added to the total, see _updates().
+            buckets (dict(str->int)): Visits added to each bucket document.
+            error (Exception): What the bulk write raised.
+
+        Returns:
+            int: Visits of the total that weren't written.
+            dict(str->int): Visits of each bucket that weren't written.
+        """
+        # Without a BulkWriteError nothing says which updates were applied.
+        if not isinstance(error, BulkWriteError):
+            return amount, buckets
+
+        # The updates were applied unordered, only the ones with a write
+        # error weren't. The total is update 0, then the buckets in order.
+        failed = set(write_error['index']
+                     for write_error in error.details.get('writeErrors', []))
+        unwritten_buckets = dict(
+            (key, count)
+            for index, (key, count) in enumerate(buckets.items(), 1)
+            if index in failed)
+        return (amount if 0 in failed else 0), unwritten_buckets
+
+    def _updates(self, amount, buckets):
+        """
+        Builds the $inc updates for a flush.
+
+        Args:
+            amount (int): Visits to add to the total.
+            buckets (dict(str->int)): Visits to add to each bucket document.
+
+        Returns:
+            list(UpdateOne): One update for the total and one per bucket.
+        """
+        updates = [UpdateOne({'_id': self.counter_id},
+                             {'$inc': {'count': amount}},
+                             upsert=True)]
+        for key, count in buckets.items():
+            updates.append(UpdateOne({'_id': key},
+                                     {'$inc': {'count': count}},
+                                     upsert=True))
+        return updates
+
+    def start(self):
+        """Starts the background flushing thread for this process."""
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run,
+                                        name='visit-counter-flush')
+        self._thread.daemon = True
+        self._thread_pid = os.getpid()
+        self._thread.start()
+
+    def stop(self):
+        """Stops the background thread and writes whatever is left."""
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None and self._thread_pid == os.getpid():
+            self._thread.join()
+        self._thread = None
+
+        try:
+            self.flush()
+        except Exception as error:
+            logging.error("Could not flush {} pending visits: {}".format(
+                self.pending(), error))
+
+    def _request_flush(self):
+        self._wake.set()
+
+    def _ensure_started(self):
+        # Threads don't survive fork(), so each worker starts its own.
+        if self._thread_pid != os.getpid() and not self._stopped:
+            with self._lock:
+                if self._thread_pid != os.getpid():
+                    self.start()
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if self._stopped:
+                break
+            try:
+                self.flush()
+            except Exception as error:
+                logging.warning("Visit counter flush failed: {}".format(error))
+
+
+class AsyncVisitCounter(VisitCounter):
+    """
+    VisitCounter for the async server. Flushes from a task on the event loop
+    through an async collection instead of a thread.
+    """
+
+    def __init__(self, *args, **kwargs):
+        VisitCounter.__init__(self, *args, **kwargs)
+        self._task = None
+        self._async_wake = None
+
+    async def flush(self):
+        """
+        Writes all pending visits to the database in one round trip. The
+        visits of the updates that failed are put back so the next flush
+        retries them.
+
+        Returns:
+            int: The number of visits written.
+        """
+        amount, buckets = self._take_pending()
+        if amount == 0 and not buckets:
+            return 0
+
+        try:
+            await self.get_collection().bulk_write(
+                self._updates(amount, buckets), ordered=False)
+        except Exception as error:
+            self._finish_flush(*self._unwritten(amount, buckets, error))
+            raise
+
+        self._finish_flush()
+        return amount
+
+    def start(self):
+        """Starts the flushing task. Must be called on the event loop."""
+        self._stopped = False
+        self._async_wake = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run_async())
+
+    async def stop(self):
+        """Stops the flushing task and writes whatever is left."""
+        self._stopped = True
+        if self._task is not None:
+            self._async_wake.set()
+            await self._task
+        self._task = None
+
+        try:
+            await self.flush()
+        except Exception as error:
+            logging.error("Could not flush {} pending visits: {}".format(
+                self.pending(), error))
+
+    def _request_flush(self):
+        if self._async_wake is not None:
+            self._async_wake.set()
+
+    def _ensure_started(self):
+        # The task is started with the server, see start().
+        pass
+
+    async def _run_async(self):
+        while not self._stopped:
+            try:
+                await asyncio.wait_for(self._async_wake.wait(),
+                                       self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._async_wake.clear()
+            if self._stopped:
+                break
+            try:
+                await self.flush()
+            except Exception as error:
+                logging.warning("Visit counter flush failed: {}".format(error))